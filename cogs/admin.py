@@ -1,8 +1,23 @@
+import asyncio
+import time
+
 import discord
 from discord.ext import commands
 
+from core import database_manager
+from core.backends import backend_registry
 from core.config import config_manager
-from utils import is_admin_check, is_owner_check, parse_model_id_from_input, perform_set_max_output_tokens, set_and_verify_model
+from core.credentials import OPENROUTER_KEY_RPM, credential_pool
+from core.job_queue import job_queue
+from core.log import fields, get_logger
+from core.offload import OFFLOAD_INLINE_BYTES, OFFLOAD_PROCESSES, OFFLOAD_THREADS, offload_pool
+from core.openrouter_models import model_info_manager
+from core.quotas import QUOTA_SETTINGS, quota_manager
+from core.reasoning import describe_reasoning_setting, parse_reasoning_setting
+from core.reloader import reload_coordinator
+from utils import REASONING_SETTING_HELP, is_admin_check, is_bot_owner_check, is_owner_check, parse_model_id_from_input, perform_set_max_output_tokens, set_and_verify_model
+
+logger = get_logger('cogs.admin')
 
 class AdminCommands(commands.Cog):
     def __init__(self, bot: commands.Bot):
@@ -98,5 +113,210 @@ class AdminCommands(commands.Cog):
     async def set_max_output_tokens_command(self, ctx: commands.Context, max_tokens: int):
         await perform_set_max_output_tokens(ctx, max_tokens)
 
+    @commands.command(name='setserverreasoning')
+    @is_admin_check()
+    @commands.guild_only()
+    async def set_server_reasoning_command(self, ctx: commands.Context, value: str):
+        parsed = parse_reasoning_setting(value)
+        if parsed is None:
+            await ctx.send(f"❌ Valor inválido. Usa {REASONING_SETTING_HELP}."); return
+
+        guild_cfg = config_manager.get_guild_config(ctx.guild.id)
+        guild_cfg['reasoning_effort'], guild_cfg['reasoning_max_tokens'] = parsed
+        config_manager.save_config()
+        await ctx.send(f"✅ Razonamiento por defecto del servidor establecido en: `{describe_reasoning_setting(*parsed)}`")
+
+    @commands.command(name='usage')
+    @is_admin_check()
+    @commands.guild_only()
+    async def usage_command(self, ctx: commands.Context, days: int = 7):
+        if not 1 <= days <= 365:
+            await ctx.send("❌ El número de días debe estar entre 1 y 365."); return
+
+        summary = await asyncio.to_thread(database_manager.get_usage_summary, ctx.guild.id, days)
+        if not summary['requests']:
+            await ctx.send(f"ℹ️ No hay uso registrado en los últimos **{days}** días."); return
+
+        prompt_ratio = summary['prompt_tokens'] / summary['total_tokens'] * 100 if summary['total_tokens'] else 0
+        embed = discord.Embed(title=f"📊 Uso de Tokens ({days}d)", color=discord.Color.blue())
+        embed.set_author(name=ctx.guild.name, icon_url=ctx.guild.icon.url if ctx.guild.icon else None)
+        embed.add_field(
+            name="Total del Servidor",
+            value=f"**Peticiones:** `{summary['requests']:,}`\n"
+                  f"**Tokens:** `{summary['total_tokens']:,}`\n"
+                  f"**Prompt / Respuesta:** `{summary['prompt_tokens']:,}` / `{summary['completion_tokens']:,}` ({prompt_ratio:.0f}% prompt)\n"
+                  f"**Prompt en Caché:** `{summary['cached_tokens']:,}`\n"
+                  f"**Razonamiento / Respuesta:** `{summary['reasoning_tokens']:,}` / `{summary['completion_tokens'] - summary['reasoning_tokens']:,}`",
+            inline=False
+        )
+
+        breakdowns = (
+            ('model', "🤖 Por Modelo", lambda model: f"`{model or 'desconocido'}`"),
+            ('channel_id', "💬 Por Canal", lambda channel_id: f"<#{channel_id}>" if channel_id else "`desconocido`"),
+            ('user_id', "👤 Por Usuario", lambda user_id: f"<@{user_id}>" if user_id else "`desconocido`"),
+        )
+        breakdown_rows = await asyncio.gather(*(
+            asyncio.to_thread(database_manager.get_usage_breakdown, ctx.guild.id, dimension, days, limit=5)
+            for dimension, _, _ in breakdowns
+        ))
+        for (dimension, title, formatter), rows in zip(breakdowns, breakdown_rows):
+            lines = [
+                f"{formatter(key)}: `{tokens:,}` tokens en `{requests:,}` peticiones ({prompt:,} / {completion:,})"
+                for key, requests, prompt, completion, tokens in rows
+            ]
+            embed.add_field(name=title, value="\n".join(lines) or "Sin datos", inline=False)
+
+        await ctx.send(embed=embed)
+
+    @commands.command(name='setquota')
+    @is_admin_check()
+    @commands.guild_only()
+    async def set_quota_command(self, ctx: commands.Context, scope: str, kind: str, value: int):
+        scope, kind = scope.lower(), kind.lower()
+        if (scope, kind) not in QUOTA_SETTINGS:
+            await ctx.send(f"❌ Uso: `{ctx.prefix}setquota <guild|user> <rpm|tpd> <valor>` (0 = sin límite)."); return
+        if value < 0:
+            await ctx.send("❌ El límite no puede ser negativo."); return
+
+        setting_key, _ = QUOTA_SETTINGS[(scope, kind)]
+        guild_cfg = config_manager.get_guild_config(ctx.guild.id)
+        guild_cfg[setting_key] = value
+        config_manager.save_config()
+
+        value_text = f"**{value:,}**" if value else "**sin límite**"
+        await ctx.send(f"✅ Cuota `{scope} {kind}` establecida en {value_text}.")
+
+    @commands.command(name='quota')
+    @is_admin_check()
+    @commands.guild_only()
+    async def show_quota_command(self, ctx: commands.Context, member: discord.Member = None):
+        member = member or ctx.author
+        guild_cfg = config_manager.get_guild_config(ctx.guild.id)
+
+        labels = {'rpm': "Peticiones/minuto", 'tpd': "Tokens/día"}
+        embed = discord.Embed(title="⏳ Cuotas de Uso", color=discord.Color.blue())
+        for scope, title in (('guild', f"Servidor ({ctx.guild.name})"), ('user', f"Usuario ({member.display_name})")):
+            lines = []
+            for kind, label in labels.items():
+                setting_key, _ = QUOTA_SETTINGS[(scope, kind)]
+                limit = guild_cfg.get(setting_key) or 0
+                remaining = quota_manager.get_remaining(scope, kind, ctx.guild.id, member.id, guild_cfg)
+                if remaining is None:
+                    lines.append(f"**{label}:** sin límite")
+                else:
+                    lines.append(f"**{label}:** `{max(remaining, 0):,}` / `{limit:,}` disponibles")
+            embed.add_field(name=title, value="\n".join(lines), inline=False)
+
+        embed.set_footer(text=f"Usa {ctx.prefix}setquota <guild|user> <rpm|tpd> <valor> para cambiarlas.")
+        await ctx.send(embed=embed)
+
+    @commands.command(name='keys')
+    @is_bot_owner_check()
+    async def keys_command(self, ctx: commands.Context, days: int = 7):
+        if not 1 <= days <= 365:
+            await ctx.send("❌ El número de días debe estar entre 1 y 365."); return
+        if not credential_pool.credentials:
+            await ctx.send("⚠️ No hay claves de API configuradas."); return
+
+        usage_by_key = {key: (requests, tokens) for key, requests, tokens in await asyncio.to_thread(database_manager.get_usage_by_key, days)}
+        pinned_guilds = {}
+        for guild_id, name in credential_pool.pins.items():
+            pinned_guilds.setdefault(name, []).append(guild_id)
+
+        now = time.monotonic()
+        rpm_limit = f"/{OPENROUTER_KEY_RPM}" if OPENROUTER_KEY_RPM else ""
+        embed = discord.Embed(title="🔑 Claves de API", description=f"Estrategia: `{credential_pool.strategy}`", color=discord.Color.blue())
+        for credential in credential_pool.credentials:
+            if credential.is_available(now):
+                status = "✅ Disponible"
+            else:
+                status = f"⏸️ En cuarentena `{credential.quarantined_until - now:.0f}s` (error `{credential.last_error}`)"
+            requests, tokens = usage_by_key.get(credential.name, (0, 0))
+            lines = [
+                status,
+                f"**En curso:** `{credential.in_flight}` | **Último minuto:** `{credential.requests_in_window(now)}{rpm_limit}` | **Fallos:** `{credential.failures}`",
+                f"**Uso ({days}d):** `{tokens:,}` tokens en `{requests:,}` peticiones",
+            ]
+            if guilds := pinned_guilds.get(credential.name):
+                lines.append("**Servidores fijados:** " + ", ".join(f"`{guild_id}`" for guild_id in guilds))
+            embed.add_field(name=credential.name, value="\n".join(lines), inline=False)
+
+        await ctx.send(embed=embed)
+
+    @commands.command(name='backends')
+    @is_bot_owner_check()
+    async def backends_command(self, ctx: commands.Context):
+        embed = discord.Embed(title="🔌 Backends de IA", description=f"Usa `<backend>:<modelo>` con `{ctx.prefix}setmodel` o `{ctx.prefix}setservermodel` para elegir uno.", color=discord.Color.blue())
+        now = time.monotonic()
+        for backend in backend_registry.backends.values():
+            models = await model_info_manager.get_all_models(backend.name)
+            credentials = backend.pool.credentials
+            available = sum(credential.is_available(now) for credential in credentials)
+            in_flight = sum(credential.in_flight for credential in credentials)
+            failures = sum(credential.failures for credential in credentials)
+            system_prompt = {True: "sí", False: "no", None: "se prueba"}[backend.system_prompt]
+            images = "según el modelo" if backend.is_openrouter else ("sí" if backend.image_input else "no")
+            reasoning = "según el modelo" if backend.is_openrouter else ("sí" if backend.reasoning else "no")
+            lines = [
+                f"**URL:** `{backend.pool.connection.base_url}` | **Catálogo:** `{backend.catalog}`",
+                f"**Modelos:** `{len(models)}`" if models is not None else "**Modelos:** ⚠️ el catálogo no responde",
+                f"**Claves disponibles:** `{available}/{len(credentials)}` | **En curso:** `{in_flight}` | **Fallos:** `{failures}`",
+                f"**Personalidad:** {system_prompt} | **Imágenes:** {images} | **Razonamiento:** {reasoning}",
+            ]
+            embed.add_field(name=backend.name, value="\n".join(lines), inline=False)
+        await ctx.send(embed=embed)
+
+    @commands.command(name='workers')
+    @is_bot_owner_check()
+    async def workers_command(self, ctx: commands.Context):
+        if not offload_pool.stats and not job_queue.enabled:
+            await ctx.send("ℹ️ Todavía no se ha procesado ningún adjunto ni petición."); return
+
+        description = (
+            f"**Hilos:** `{OFFLOAD_THREADS}` | **Procesos:** `{OFFLOAD_PROCESSES}` | "
+            f"**Umbral:** `{OFFLOAD_INLINE_BYTES // 1024} KiB`"
+        )
+        embed = discord.Embed(title="⚙️ Trabajo en Segundo Plano", description=description, color=discord.Color.blue())
+        for label, stats in sorted(offload_pool.stats.items()):
+            lines = [f"**En el bucle:** `{stats.inline}` (`{stats.inline_seconds * 1000:.0f}ms`)"]
+            if stats.offloaded:
+                lines.append(
+                    f"**Delegados:** `{stats.offloaded}` | **Tiempo ahorrado al bucle:** `{stats.worker_seconds * 1000:.0f}ms` | "
+                    f"**Espera media:** `{stats.wait_seconds / stats.offloaded * 1000:.1f}ms`"
+                )
+            embed.add_field(name=label, value="\n".join(lines), inline=False)
+
+        if job_queue.enabled:
+            depth = job_queue.depth()
+            lines = [
+                f"**Worker {shard}:** `{depth.get(shard, {}).get('queued', 0)}` en cola | `{depth.get(shard, {}).get('running', 0)}` en curso"
+                for shard in range(job_queue.shard_count)
+            ]
+            embed.add_field(name="Cola de respuestas", value="\n".join(lines), inline=False)
+
+        await ctx.send(embed=embed)
+
+    @commands.command(name='reload')
+    @is_bot_owner_check()
+    async def reload_command(self, ctx: commands.Context):
+        msg = await ctx.send("🔄 *Esperando a que terminen las respuestas en curso y recargando módulos...*")
+        report = await reload_coordinator.reload(self.bot)
+
+        color = discord.Color.green() if not report.errors else discord.Color.red()
+        embed = discord.Embed(title="🔄 Recarga en Caliente", color=color)
+        embed.add_field(
+            name="Resumen",
+            value=f"**Respuestas drenadas:** `{report.drained}` (aún en curso: `{report.still_running}`)\n"
+                  f"**Módulos:** `{len(report.modules)}` | **Extensiones:** `{len(report.extensions)}`\n"
+                  f"**Tiempo:** `{report.seconds * 1000:.0f}ms`",
+            inline=False
+        )
+        if report.errors:
+            embed.add_field(name="Errores", value="\n".join(f"`{error[:200]}`" for error in report.errors), inline=False)
+        logger.info("Hot reload finished", extra=fields(
+            seconds=round(report.seconds, 2), modules=len(report.modules), extensions=len(report.extensions), errors=report.errors or None
+        ))
+        await msg.edit(content=None, embed=embed)
+
 async def setup(bot: commands.Bot):
     await bot.add_cog(AdminCommands(bot))
\ No newline at end of file
@@ -1,10 +1,15 @@
+import asyncio
 import typing
 
 import discord
 from discord.ext import commands
 
+from core.config import config_manager
 from core.contexts import context_manager
+from core.memory import long_term_memory
+from core.reasoning import describe_reasoning_setting, parse_reasoning_setting
 from utils import (
+    REASONING_SETTING_HELP,
     is_admin_check,
     parse_model_id_from_input,
     request_confirmation,
@@ -98,13 +103,75 @@ class ChannelCommands(commands.Cog):
         state_text = "Activada" if new_state else "Desactivada"
         await ctx.send(f"✅ Conversación natural **{state_text}** en este canal.")
 
+    @commands.command(name='setrelevance')
+    @is_admin_check()
+    @commands.guild_only()
+    async def set_relevance_threshold_command(self, ctx: commands.Context, threshold: float):
+        if not 0.0 <= threshold <= 1.0:
+            await ctx.send("❌ El umbral de relevancia debe ser un número entre 0.0 y 1.0.")
+            return
+        channel_context = await context_manager.get_channel_ctx(ctx.channel.id)
+        channel_context.settings['relevance_threshold'] = threshold
+        await ctx.send(f"✅ Umbral de relevancia para {ctx.channel.mention} actualizado a: `{threshold}`")
+
+    @commands.command(name='togglesummary')
+    @is_admin_check()
+    @commands.guild_only()
+    async def toggle_summary_command(self, ctx: commands.Context):
+        channel_context = await context_manager.get_channel_ctx(ctx.channel.id)
+        new_state = not channel_context.settings.get('summarize_history', False)
+        channel_context.settings['summarize_history'] = new_state
+        state_text = "Activado" if new_state else "Desactivado"
+        await ctx.send(f"✅ Resumen automático del historial **{state_text}** en este canal.")
+
+    @commands.command(name='togglememory')
+    @is_admin_check()
+    @commands.guild_only()
+    async def toggle_memory_command(self, ctx: commands.Context):
+        channel_context = await context_manager.get_channel_ctx(ctx.channel.id)
+        new_state = not channel_context.settings.get('long_term_memory', False)
+        channel_context.settings['long_term_memory'] = new_state
+        state_text = "Activada" if new_state else "Desactivada"
+        await ctx.send(f"✅ Memoria a largo plazo **{state_text}** en este canal.")
+
+    @commands.command(name='setreasoning')
+    @is_admin_check()
+    @commands.guild_only()
+    async def set_reasoning_command(self, ctx: commands.Context, value: str):
+        channel_context = await context_manager.get_channel_ctx(ctx.channel.id)
+        if value.lower() in ['server', 'reset']:
+            channel_context.settings.pop('reasoning_effort', None)
+            channel_context.settings.pop('reasoning_max_tokens', None)
+            await ctx.send(f"✅ Razonamiento para {ctx.channel.mention} restablecido al del servidor.")
+            return
+
+        parsed = parse_reasoning_setting(value)
+        if parsed is None:
+            await ctx.send(f"❌ Valor inválido. Usa {REASONING_SETTING_HELP}, o `server` para usar el del servidor.")
+            return
+        channel_context.settings['reasoning_effort'], channel_context.settings['reasoning_max_tokens'] = parsed
+        await ctx.send(f"✅ Razonamiento para {ctx.channel.mention} establecido en: `{describe_reasoning_setting(*parsed)}`")
+
+    @commands.command(name='togglereasoning')
+    @is_admin_check()
+    @commands.guild_only()
+    async def toggle_reasoning_command(self, ctx: commands.Context):
+        channel_context = await context_manager.get_channel_ctx(ctx.channel.id)
+        guild_cfg = config_manager.get_guild_config(ctx.guild.id)
+        new_state = not channel_context.settings.get('show_reasoning', guild_cfg.get('show_reasoning', False))
+        channel_context.settings['show_reasoning'] = new_state
+        state_text = "Visible" if new_state else "Oculto"
+        await ctx.send(f"✅ Razonamiento del modelo **{state_text}** en este canal.")
+
     @commands.command(name='clearhistory', aliases=['ch'])
     @is_admin_check()
     @commands.guild_only()
     async def clear_channel_history_command(self, ctx: commands.Context):
         if await request_confirmation(ctx, f"borrar **todo** el historial de la IA para {ctx.channel.mention}"):
             channel_context = await context_manager.get_channel_ctx(ctx.channel.id)
-            channel_context.history.clear()
+            channel_context.cancel_all_requests()
+            channel_context.clear_memory()
+            await asyncio.to_thread(long_term_memory.clear, ctx.channel.id)
             await ctx.send(f"🧹 Historial de IA para {ctx.channel.mention} limpiado.", delete_after=15)
 
     @commands.command(name='resetai', aliases=['reset'])
@@ -116,6 +183,16 @@ class ChannelCommands(commands.Cog):
             reset_channel_settings(channel_context)
             await ctx.send(f"⚙️ Configuración de IA para {ctx.channel.mention} restablecida.", delete_after=15)
 
+    @commands.command(name='stop')
+    @is_admin_check()
+    @commands.guild_only()
+    async def stop_generation_command(self, ctx: commands.Context):
+        channel_context = await context_manager.get_channel_ctx(ctx.channel.id)
+        cancelled = channel_context.cancel_all_requests()
+        if not cancelled:
+            await ctx.send(f"ℹ️ No hay respuestas en curso en {ctx.channel.mention}.", delete_after=10)
+            return
+        await ctx.send(f"⏹️ Se detuvieron **{cancelled}** respuesta(s) en curso en {ctx.channel.mention}.", delete_after=15)
 
 async def setup(bot: commands.Bot):
     await bot.add_cog(ChannelCommands(bot))
\ No newline at end of file
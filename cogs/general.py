@@ -5,8 +5,11 @@ import discord
 from discord.ext import commands
 from discord.ui import Button, View
 
+from core.backends import DEFAULT_BACKEND, backend_registry
 from core.config import config_manager
 from core.contexts import context_manager
+from core.memory import long_term_memory
+from core.reasoning import describe_reasoning_setting
 from core.openrouter_models import model_info_manager
 
 MODELS_PER_PAGE = 5
@@ -62,13 +65,17 @@ class ModelsPaginator(View):
                 except (ValueError, TypeError):
                     date_str = "N/A"
             
-            url = f"https://openrouter.ai/models/{model_id}"
+            backend, backend_model_id = backend_registry.resolve(model_id)
             context_str = f"{context_size // 1000}K" if context_size else "N/A"
-            provider = model_id.split('/')[0] if '/' in model_id else "Desconocido"
+            provider = backend_model_id.split('/')[0] if '/' in backend_model_id else "Desconocido"
+            if backend.is_openrouter:
+                link = f"[Ver en OpenRouter](https://openrouter.ai/models/{backend_model_id})"
+            else:
+                link, provider = f"`{model_id}`", backend.name
             
             embed.add_field(
                 name=f"🔹 {model_name}",
-                value=f"[Ver en OpenRouter]({url}) | **Contexto:** {context_str} | **Por:** `{provider}` | **Creado:** {date_str}",
+                value=f"{link} | **Contexto:** {context_str} | **Por:** `{provider}` | **Creado:** {date_str}",
                 inline=False
             )
 
@@ -118,6 +125,12 @@ class GeneralCommands(commands.Cog):
                   f"`{prefix}setpersonality <texto>` - Define la personalidad de la IA.\n"
                   f"`{prefix}settemperature <0.0-1.0>` - Cambia la creatividad de la IA.\n"
                   f"`{prefix}togglenatural` - Activa/desactiva respuesta sin mención.\n"
+                  f"`{prefix}setrelevance <0.0-1.0>` - Qué tan relevante debe ser un mensaje para responder sin mención.\n"
+                  f"`{prefix}togglesummary` - Activa/desactiva el resumen automático del historial antiguo.\n"
+                  f"`{prefix}togglememory` - Activa/desactiva la memoria a largo plazo de mensajes antiguos.\n"
+                  f"`{prefix}setreasoning <auto/model/off/low/.../tokens/server>` - Cuánto razona el modelo en este canal.\n"
+                  f"`{prefix}togglereasoning` - Muestra u oculta el razonamiento del modelo.\n"
+                  f"`{prefix}stop` - Detiene las respuestas de la IA en curso en el canal.\n"
                   f"`{prefix}clearhistory` - Borra el historial de conversación del canal.\n"
                   f"`{prefix}resetai` - Restablece todas las opciones de IA del canal.",
             inline=False
@@ -126,7 +139,11 @@ class GeneralCommands(commands.Cog):
         embed.add_field(
             name=f"⚙️ Configuración del Servidor (Admins)",
             value=f"`{prefix}setservermodel <nombre_modelo>` - Asigna el modelo por defecto del servidor.\n"
+                  f"`{prefix}setserverreasoning <auto/model/off/low/.../tokens>` - Razonamiento por defecto del servidor.\n"
                   f"`{prefix}setprefix <prefijo>` - Cambia el prefijo de comandos.\n"
+                  f"`{prefix}setquota <guild|user> <rpm|tpd> <valor>` - Limita peticiones/minuto o tokens/día.\n"
+                  f"`{prefix}quota [@usuario]` - Muestra las cuotas y lo disponible.\n"
+                  f"`{prefix}usage [días]` - Muestra el uso de tokens por modelo, canal y usuario.\n"
                   f"`{prefix}showconfig` - Muestra la configuración actual.",
             inline=False
         )
@@ -159,6 +176,14 @@ class GeneralCommands(commands.Cog):
         ch_temp = ch_settings.get('temperature')
         ch_persona = ch_settings.get('personality', 'Por defecto')
         ch_natural = ch_settings.get('natural_conversation', False)
+        ch_summary = ch_settings.get('summarize_history', False)
+        ch_memory = ch_settings.get('long_term_memory', False)
+        reasoning_source = ch_settings if 'reasoning_effort' in ch_settings else guild_cfg
+        ch_reasoning = describe_reasoning_setting(reasoning_source.get('reasoning_effort') or 'auto', reasoning_source.get('reasoning_max_tokens'))
+        ch_show_reasoning = ch_settings.get('show_reasoning', guild_cfg.get('show_reasoning', False))
+        ch_relevance = ch_settings.get('relevance_threshold', 0.5)
+        relevance_stats = channel_context.relevance_stats
+        history_tokens = sum(entry.token_estimate for entry in channel_context.history)
         
         active_model_name = ch_model_override or server_model
         
@@ -186,6 +211,11 @@ class GeneralCommands(commands.Cog):
             value=f"**Modelo Activo:** `{active_model_name}`\n"
                   f"**Temperatura:** `{ch_temp}`\n"
                   f"**Conversación Natural:** {'✅ Activada' if ch_natural else '❌ Desactivada'}\n"
+                  f"**Umbral de Relevancia:** `{ch_relevance}` (respondidos: `{relevance_stats['passed']}`, filtrados: `{relevance_stats['gated']}`)\n"
+                  f"**Resumen del Historial:** {'✅ Activado' if ch_summary else '❌ Desactivado'}\n"
+                  f"**Razonamiento:** `{ch_reasoning}` ({'visible' if ch_show_reasoning else 'oculto'})\n"
+                  f"**Memoria a Largo Plazo:** {'✅ Activada' if ch_memory else '❌ Desactivada'} (`{long_term_memory.size(ctx.channel.id):,}` fragmentos)\n"
+                  f"**Historial:** `{len(channel_context.history)}` mensajes (~`{history_tokens:,}` tokens)\n"
                   f"**Personalidad:** {personality_display_str}",
             inline=False
         )
@@ -195,9 +225,12 @@ class GeneralCommands(commands.Cog):
     @commands.command(name='models')
     @commands.guild_only()
     async def list_models_command(self, ctx: commands.Context, *, args: str = ""):
-        msg = await ctx.send("🔍 *Buscando modelos gratuitos en OpenRouter...*")
-
         raw_args = args.split()
+        backend_name = DEFAULT_BACKEND
+        if raw_args and backend_registry.get(raw_args[0].lower()):
+            backend_name = raw_args.pop(0).lower()
+        msg = await ctx.send(f"🔍 *Buscando modelos gratuitos en `{backend_name}`...*")
+
         search_query = ""
         sort_key_arg = None
         if raw_args:
@@ -205,9 +238,9 @@ class GeneralCommands(commands.Cog):
                 sort_key_arg = raw_args.pop().lower()
             search_query = " ".join(raw_args).strip()
 
-        all_models_dict = await model_info_manager.get_all_models()
+        all_models_dict = await model_info_manager.get_all_models(backend_name)
         if not all_models_dict:
-            await msg.edit(content="❌ No se pudo obtener la lista de modelos de la API de OpenRouter.")
+            await msg.edit(content=f"❌ No se pudo obtener la lista de modelos del backend `{backend_name}`.")
             return
 
         free_models = [
@@ -0,0 +1,6 @@
+from dotenv import load_dotenv
+
+from .log import setup_logging
+
+load_dotenv()
+setup_logging()
@@ -1,14 +1,64 @@
+import asyncio
+import math
+import time
 import typing
 
 import discord
 from discord.ext import commands
-from openai import OpenAIError
-from openai.types.chat import ChatCompletion
 
 from . import database_manager
+from .attachments import ATTACHMENT_IMAGE, classify_attachment, encode_image_for_model, format_text_attachment
 from .config import MAX_ATTACHMENT_SIZE_BYTES, config_manager
 from .contexts import context_manager
+from .backends import backend_registry
+from .history import HistoryEntry, serialize_chat_request
+from .log import fields, get_logger
+from .memory import long_term_memory
+from .offload import offload_pool
 from .openrouter_models import model_info_manager
+from .quotas import quota_manager
+from .reasoning import MAX_SHOWN_REASONING_CHARS, build_reasoning_options, drops_opening_think_tag, is_short_question, split_reasoning
+from .summarizer import history_summarizer
+from .tracing import RequestTrace
+
+if typing.TYPE_CHECKING:
+    from openai import OpenAIError
+    from openai.types.chat import ChatCompletion
+
+logger = get_logger('ai_handler')
+
+HISTORY_MAX_MESSAGES = 20
+HISTORY_TRIM_BLOCK = 8
+PROMPT_CACHE_CONTROL_PREFIXES = ('anthropic/', 'google/gemini')
+MAX_KEY_ATTEMPTS = 2
+
+async def check_quota(message: discord.Message, guild_cfg: dict) -> bool:
+    decision = quota_manager.check_request(message.guild.id, message.author.id, guild_cfg)
+    if decision.allowed:
+        return True
+
+    if quota_manager.should_notify_refusal(message.guild.id, message.author.id):
+        scope_text = "del servidor" if decision.scope == 'guild' else "de usuario"
+        await message.reply(
+            f"⏳ Límite {scope_text} alcanzado. Intenta de nuevo en {max(1, int(decision.retry_after))}s.",
+            mention_author=False, delete_after=15
+        )
+    return False
+
+class ModelCapabilities(typing.NamedTuple):
+    system_prompt: bool
+    image_input: bool
+    reasoning: bool
+
+def _with_cache_control(message: typing.Union[HistoryEntry, dict]) -> dict:
+    if isinstance(message, HistoryEntry):
+        message = message.to_message()
+    content = message['content']
+    parts = [{'type': 'text', 'text': content}] if isinstance(content, str) else list(content)
+    if not parts or parts[-1].get('type') != 'text':
+        return message
+    parts[-1] = {**parts[-1], 'cache_control': {'type': 'ephemeral'}}
+    return {**message, 'content': parts}
 
 class AIResponseHandler:
     def __init__(self, bot: commands.Bot, message: discord.Message, content: str):
@@ -17,90 +67,252 @@ class AIResponseHandler:
         self.bot = bot 
         self.channel_context = None
         self.guild_cfg = None
+        self.model_name = None
+        self.backend = None
+        self.backend_model_id = None
+        self.api_key_name: typing.Optional[str] = None
+        self.show_reasoning = False
+        self.reasoning_text = ""
+        self.request_id = str(message.id)
+        self.trace = RequestTrace()
 
-    async def _prepare_llm_input(self) -> typing.Optional[list]:
-        parts = []
-        author_name = self.message.author.display_name
-        author_id = self.message.author.id
+    def _log_fields(self, **extra) -> dict:
+        return fields(
+            guild=self.message.guild.id, channel=self.message.channel.id, model=self.model_name,
+            backend=self.backend.name if self.backend else None, request_id=self.request_id, key=self.api_key_name, **self.trace.durations(), **extra
+        )
 
-        if self.content:
-            text_for_llm = f"{author_name} (ID: {author_id}): {self.content}"
-            parts.append({'type': 'text', 'text': text_for_llm})
+    async def _resolve_capabilities(self) -> ModelCapabilities:
+        system_prompt, image_input, reasoning = await asyncio.gather(
+            model_info_manager.test_system_prompt_support(self.model_name),
+            model_info_manager.supports_image_input(self.model_name),
+            model_info_manager.supports_reasoning(self.model_name),
+        )
+        return ModelCapabilities(system_prompt, image_input, reasoning)
 
-        for attachment in self.message.attachments:
-            if attachment.size > MAX_ATTACHMENT_SIZE_BYTES:
-                await self.message.channel.send(f"⚠️ Archivo '{attachment.filename}' demasiado grande.", delete_after=15)
-                continue
-            try:
-                file_bytes = await attachment.read()
-                file_content = file_bytes.decode('utf-8', errors='replace')
-                file_context = f"\n--- Contenido de {attachment.filename} ---\n{file_content}\n--- Fin de {attachment.filename} ---"
-                parts.append({'type': 'text', 'text': file_context})
-            except Exception as e:
-                await self.message.channel.send(f"⚠️ Error al leer el adjunto '{attachment.filename}'.", delete_after=15)
-                print(f"Error processing attachment: {e}")
-
-        return parts if parts else None
-
-    def _update_and_trim_history(self, user_message_content: list):
-        MAX_HISTORY_MESSAGES = 10
-        self.channel_context.history.append({'role': 'user', 'content': user_message_content})
-        if len(self.channel_context.history) > MAX_HISTORY_MESSAGES * 2:
-            self.channel_context.history = self.channel_context.history[-(MAX_HISTORY_MESSAGES * 2):]
-
-    async def _call_openrouter_api(self) -> typing.Optional[ChatCompletion]:
-        client = self.channel_context.create_client() 
-        if not client:
-            print("Critical error: The OpenRouter client is not initialized.")
-            await self.message.channel.send("⚠️ El bot no está configurado para conectarse al servicio de IA.")
+    async def _prepare_llm_input(self, capabilities: 'asyncio.Future[ModelCapabilities]') -> typing.Optional[HistoryEntry]:
+        prepared = await asyncio.gather(*(self._prepare_attachment(attachment, capabilities) for attachment in self.message.attachments))
+        attachments = [item for item in prepared if isinstance(item, str)]
+        images = [item for item in prepared if isinstance(item, tuple)]
+
+        if not self.content and not attachments and not images:
             return None
+        return HistoryEntry.user(self.message.author.display_name, self.message.author.id, self.content, attachments, images)
 
-        model_name = self.channel_context.settings.get('model') or self.guild_cfg.get('model')
-        
+    async def _prepare_attachment(self, attachment: discord.Attachment, capabilities: 'asyncio.Future[ModelCapabilities]') -> typing.Union[str, typing.Tuple[str, str], None]:
+        if attachment.size > MAX_ATTACHMENT_SIZE_BYTES:
+            await self.message.channel.send(f"⚠️ Archivo '{attachment.filename}' demasiado grande.", delete_after=15)
+            return None
+        try:
+            kind = classify_attachment(attachment.content_type)
+            if kind == ATTACHMENT_IMAGE:
+                return await self._prepare_image(attachment, capabilities)
+
+            file_bytes = await attachment.read()
+            file_context = await offload_pool.run(
+                'decode_attachment', format_text_attachment, attachment.filename, file_bytes, kind,
+                size=len(file_bytes), picklable=True
+            )
+            if file_context is None:
+                await self.message.channel.send(f"ℹ️ Tipo de archivo no soportado, se ignoró '{attachment.filename}'.", delete_after=15)
+            return file_context
+        except Exception as e:
+            await self.message.channel.send(f"⚠️ Error al leer el adjunto '{attachment.filename}'.", delete_after=15)
+            logger.warning("Error processing attachment %s: %s", attachment.filename, e, extra=self._log_fields())
+            return None
+
+    async def _prepare_image(self, attachment: discord.Attachment, capabilities: 'asyncio.Future[ModelCapabilities]') -> typing.Optional[typing.Tuple[str, str]]:
+        if not (await capabilities).image_input:
+            await self.message.channel.send(f"ℹ️ El modelo `{self.model_name}` no acepta imágenes, se ignoró '{attachment.filename}'.", delete_after=15)
+            return None
+
+        file_bytes = await attachment.read()
+        data_url = await offload_pool.run('encode_image', encode_image_for_model, file_bytes, size=len(file_bytes), picklable=True)
+        if not data_url:
+            await self.message.channel.send(f"⚠️ No pude procesar la imagen '{attachment.filename}'.", delete_after=15)
+            return None
+        return attachment.filename, data_url
+
+    def _update_and_trim_history(self, user_entry: HistoryEntry):
+        history = self.channel_context.history
+        history.append(user_entry)
+        if len(history) > HISTORY_MAX_MESSAGES:
+            # Drop a whole block at once so the prompt prefix stays identical between trims.
+            drop_count = len(history) - HISTORY_MAX_MESSAGES + HISTORY_TRIM_BLOCK
+            dropped_turns = history[:drop_count]
+            self.channel_context.history = history[drop_count:]
+            if self.channel_context.settings.get('summarize_history'):
+                history_summarizer.schedule(self.channel_context, dropped_turns, self.guild_cfg.get('summary_model'), self.message.guild.id)
+            if self.channel_context.settings.get('long_term_memory'):
+                long_term_memory.schedule_store(self.channel_context.channel_id, dropped_turns)
+
+    async def _build_request_body(self, capabilities: ModelCapabilities, recalled: typing.Optional[str]) -> bytes:
         messages_for_api = []
-        if await model_info_manager.test_system_prompt_support(model_name):
+        system_prompt_supported = capabilities.system_prompt
+        if system_prompt_supported:
             messages_for_api.append(self.channel_context.get_system_prompt_message())
-            
-        messages_for_api.extend(self.channel_context.history)
 
-        try:
-            return await client.chat.completions.create(
-                model=model_name,
-                messages=messages_for_api,
-                temperature=self.channel_context.settings.get('temperature'),
-                max_tokens=self.guild_cfg.get('max_output_tokens')
-            )
-        except OpenAIError as e:
-            error_msg = f"⚠️ Error de API con el modelo `{model_name}`: {e.body.get('message', 'Error desconocido') if e.body else str(e)}"
-            await self.bot.get_channel(self.channel_context.channel_id).send(error_msg, delete_after=20)
-            print(f"Error from OpenRouter: {e}")
+        if summary_message := self.channel_context.get_summary_message(as_system=system_prompt_supported):
+            messages_for_api.append(summary_message)
+
+        history = self.channel_context.history
+        messages_for_api.extend(history[:-1])
+        cached_prefix_length = len(messages_for_api)
+        # Recalled snippets change every request, so they go right before the new message to keep the cached prefix intact.
+        if recalled:
+            content = f"Fragmentos de conversaciones anteriores en este canal que pueden ser relevantes:\n{recalled}"
+            messages_for_api.append({'role': 'system' if system_prompt_supported else 'user', 'content': content})
+        messages_for_api.extend(history[-1:])
+
+        if self.guild_cfg.get('prompt_caching') and self.model_name.startswith(PROMPT_CACHE_CONTROL_PREFIXES):
+            self._add_cache_breakpoints(messages_for_api, cached_prefix_length=cached_prefix_length)
+
+        max_tokens = self.guild_cfg.get('max_output_tokens')
+        reasoning = self._reasoning_options(capabilities.reasoning)
+        if reasoning and reasoning.get('max_tokens'):
+            # The reasoning budget is added on top so it can't eat into the answer's max_output_tokens.
+            max_tokens += reasoning['max_tokens']
+        request_fields = {
+            'model': self.backend_model_id,
+            'temperature': self.channel_context.settings.get('temperature'),
+            'max_tokens': max_tokens,
+            'reasoning': reasoning,
+            # OpenRouter only reports usage when asked; OpenAI-compatible servers always include it.
+            'usage': {'include': True} if self.backend.is_openrouter else None,
+        }
+        uncached_size = sum(message.serialization_size for message in messages_for_api if isinstance(message, HistoryEntry))
+        return await offload_pool.run('serialize_request', serialize_chat_request, request_fields, messages_for_api, size=uncached_size)
+
+    async def _call_model_api(self, request_body: bytes) -> typing.Optional['ChatCompletion']:
+        from openai import OpenAIError
+        from openai.types.chat import ChatCompletion
+
+        pool = self.backend.pool
+        if not pool.credentials:
+            logger.critical("No API key is configured for the backend.", extra=self._log_fields())
+            await self.message.channel.send("⚠️ El bot no está configurado para conectarse al servicio de IA.")
             return None
-        except Exception as e:
-            await self.bot.get_channel(self.channel_context.channel_id).send("⚠️ Ocurrió un error inesperado al contactar la API.")
-            print(f"Unexpected Error in API call: {e}")
+
+        last_error = None
+        for _ in range(MAX_KEY_ATTEMPTS):
+            with pool.lease(self.message.guild.id) as credential:
+                if credential is None:
+                    break
+                self.api_key_name = credential.name
+                try:
+                    return await credential.get_client().post('/chat/completions', cast_to=ChatCompletion, content=request_body)
+                except OpenAIError as e:
+                    last_error = e
+                    if pool.report_error(credential, e):
+                        continue
+                    await self._report_api_error(e)
+                    return None
+                except Exception as e:
+                    await self.message.channel.send("⚠️ Ocurrió un error inesperado al contactar la API.")
+                    logger.error("Unexpected error in API call: %s", e, extra=self._log_fields())
+                    return None
+
+        wait_seconds = pool.seconds_until_available(self.message.guild.id) or 0
+        if last_error is not None and wait_seconds == 0:
+            await self._report_api_error(last_error)
+            return None
+        await self.message.channel.send(
+            f"⏳ Las claves de API están limitadas temporalmente. Inténtalo de nuevo en `{math.ceil(wait_seconds)}s`.", delete_after=20
+        )
+        logger.warning("No API key available", extra=self._log_fields(retry_in=round(wait_seconds)))
+        return None
+
+    def _reasoning_options(self, reasoning_supported: bool) -> typing.Optional[dict]:
+        settings = self.channel_context.settings
+        self.show_reasoning = bool(settings.get('show_reasoning', self.guild_cfg.get('show_reasoning')))
+        if not reasoning_supported:
             return None
 
-    def _extract_response_text(self, api_response: ChatCompletion) -> typing.Optional[str]:
+        source = settings if 'reasoning_effort' in settings else self.guild_cfg
+        return build_reasoning_options(
+            source.get('reasoning_effort') or 'auto', source.get('reasoning_max_tokens'), self.show_reasoning,
+            short_question=is_short_question(self.content, bool(self.message.attachments)),
+        )
+
+    async def _recall_memory(self) -> typing.Optional[str]:
+        if not self.channel_context.settings.get('long_term_memory'):
+            return None
+        return await long_term_memory.recall(self.channel_context.channel_id, self.content)
+
+    async def _report_api_error(self, e: 'OpenAIError'):
+        error_msg = f"⚠️ Error de API con el modelo `{self.model_name}`: {e.body.get('message', 'Error desconocido') if e.body else str(e)}"
+        await self.message.channel.send(error_msg, delete_after=20)
+        logger.error("Error from the model API: %s", e, extra=self._log_fields(status=getattr(e, 'status_code', None)))
+
+    def _add_cache_breakpoints(self, messages_for_api: list, cached_prefix_length: int):
+        if cached_prefix_length <= 0:
+            return
+        if isinstance(messages_for_api[0], dict) and messages_for_api[0]['role'] == 'system':
+            messages_for_api[0] = _with_cache_control(messages_for_api[0])
+        last_cached_index = cached_prefix_length - 1
+        if last_cached_index > 0:
+            messages_for_api[last_cached_index] = _with_cache_control(messages_for_api[last_cached_index])
+
+    def _extract_response_text(self, api_response: 'ChatCompletion') -> typing.Optional[str]:
         try:
-            return api_response.choices[0].message.content
+            message = api_response.choices[0].message
         except (AttributeError, IndexError, TypeError):
             return None
+        answer, inline_reasoning = split_reasoning(message.content or '', drops_opening_think_tag(self.model_name or ''))
+        self.reasoning_text = getattr(message, 'reasoning', None) or inline_reasoning
+        return answer or None
 
     def _update_history_with_model_response(self, response_text: str):
-        self.channel_context.history.append({'role': 'model', 'content': response_text})
+        self.channel_context.history.append(HistoryEntry.assistant(response_text))
 
-    def _get_token_info(self, api_response: ChatCompletion) -> str:
+    def _get_token_info(self, api_response: 'ChatCompletion') -> str:
         try:
             usage = api_response.usage
             if usage and usage.total_tokens > 0:
                 prompt_tokens = usage.prompt_tokens
                 completion_tokens = usage.completion_tokens
                 total_tokens = usage.total_tokens
-                return f"\n\n*Prompt Tokens: `{prompt_tokens}` | Completion Tokens: `{completion_tokens}` | Total Tokens: `{total_tokens}`*"
+                cached_tokens = self._get_cached_tokens(usage)
+                cached_info = f" (Cached: `{cached_tokens}`)" if cached_tokens else ""
+                reasoning_tokens = self._get_reasoning_tokens(usage)
+                reasoning_info = f" (Reasoning: `{reasoning_tokens}`)" if reasoning_tokens else ""
+                return f"\n\n*Prompt Tokens: `{prompt_tokens}`{cached_info} | Completion Tokens: `{completion_tokens}`{reasoning_info} | Total Tokens: `{total_tokens}`*"
         except (AttributeError, TypeError):
             pass
         return ""
 
+    def _get_cached_tokens(self, usage) -> int:
+        details = getattr(usage, 'prompt_tokens_details', None)
+        return (getattr(details, 'cached_tokens', None) or 0) if details else 0
+
+    def _get_reasoning_tokens(self, usage) -> int:
+        details = getattr(usage, 'completion_tokens_details', None)
+        return (getattr(details, 'reasoning_tokens', None) or 0) if details else 0
+
+    def _log_usage(self, usage):
+        try:
+            database_manager.log_token_usage(
+                guild_id=self.message.guild.id,
+                channel_id=self.message.channel.id,
+                user_id=self.message.author.id,
+                model=self.model_name,
+                prompt_tokens=usage.prompt_tokens,
+                completion_tokens=usage.completion_tokens,
+                total_tokens=usage.total_tokens,
+                cached_tokens=self._get_cached_tokens(usage),
+                reasoning_tokens=self._get_reasoning_tokens(usage),
+                api_key=self.api_key_name or '',
+            )
+        except Exception as e:
+            logger.error("Error logging token usage: %s", e, extra=self._log_fields())
+
+    async def _send_reasoning(self):
+        reasoning = self.reasoning_text.strip()
+        if len(reasoning) > MAX_SHOWN_REASONING_CHARS:
+            reasoning = reasoning[:MAX_SHOWN_REASONING_CHARS].rstrip() + "…"
+        quoted = "\n".join(f"> {line}" if line else ">" for line in reasoning.splitlines())
+        await self.message.channel.send(f"💭 *Razonamiento:*\n{quoted}")
+
     async def _send_discord_response(self, response_text: str, token_info: str):
         MAX_MSG_LEN = 2000
         cleaned_response_text = response_text.rstrip()
@@ -116,25 +328,89 @@ class AIResponseHandler:
     async def process_request(self):
         self.channel_context = await context_manager.get_channel_ctx(self.message.channel.id)
         self.guild_cfg = config_manager.get_guild_config(self.message.guild.id)
+        self.model_name = self.channel_context.settings.get('model') or self.guild_cfg.get('model')
+        self.backend, self.backend_model_id = backend_registry.resolve(self.model_name)
         
+        outcome = 'started'
+        try:
+            outcome = await self._run_pipeline()
+        except asyncio.CancelledError:
+            outcome = 'cancelled'
+            raise
+        finally:
+            logger.info("AI request finished", extra=self._log_fields(outcome=outcome, critical_path=self.trace.critical_path()))
+            logger.debug("AI request trace: %s", self.trace.render(), extra=fields(request_id=self.request_id))
+
+    async def _run_pipeline(self) -> str:
+        with self.trace.span('quota'):
+            allowed = await check_quota(self.message, self.guild_cfg)
+        if not allowed:
+            return 'quota_refused'
+
         async with self.message.channel.typing():
-            llm_content = await self._prepare_llm_input()
-            if not llm_content: return
+            # Attachment reads need the image capability, so they share one lookup instead of starting their own.
+            capabilities = asyncio.ensure_future(self._resolve_capabilities())
+            prepared = await self.trace.gather('prepare', {
+                'capabilities': capabilities,
+                'attachments': self._prepare_llm_input(capabilities),
+                'memory': self._recall_memory(),
+            })
+            user_entry = prepared['attachments']
+            if not user_entry: return 'empty'
 
-            self._update_and_trim_history(llm_content)
+            self._update_and_trim_history(user_entry)
+
+            try:
+                with self.trace.span('serialize'):
+                    request_body = await self._build_request_body(prepared['capabilities'], prepared['memory'])
+                with self.trace.span('api'):
+                    api_response = await self._call_model_api(request_body)
+            except asyncio.CancelledError:
+                self._discard_history_entry(user_entry)
+                raise
 
-            api_response = await self._call_openrouter_api()
             if not api_response:
-                self.channel_context.history.pop()
-                return
+                self._discard_history_entry(user_entry)
+                return 'api_error'
+
+            user_entry.strip_images()
 
             response_text = self._extract_response_text(api_response)
-            if response_text is None: return
+            if response_text is None:
+                if self.reasoning_text or self._get_reasoning_tokens(api_response.usage):
+                    await self.message.channel.send(
+                        "⚠️ El modelo gastó todo el límite de tokens razonando y no llegó a responder. "
+                        "Prueba a bajar el razonamiento con `setreasoning` o a subir `setmaxoutput`.", delete_after=20
+                    )
+                return 'empty_response'
 
-            self._update_history_with_model_response(response_text)
             token_info = self._get_token_info(api_response)
+            with self.trace.span('send'):
+                try:
+                    if self.show_reasoning and self.reasoning_text:
+                        await self._send_reasoning()
+                    await self._send_discord_response(response_text, token_info)
+                finally:
+                    # Runs once the reply is out, and also if sending failed, so the turn is still recorded.
+                    usage_write = self._record_reply(response_text, api_response.usage)
+            self.channel_context.last_reply_at = time.monotonic()
 
-            if api_response.usage:
-                database_manager.log_token_usage(api_response.usage.total_tokens)
+        if usage_write is not None:
+            with self.trace.span('bookkeeping'):
+                await usage_write
+        return 'replied'
 
-            await self._send_discord_response(response_text, token_info)
\ No newline at end of file
+    def _record_reply(self, response_text: str, usage) -> typing.Optional[asyncio.Future]:
+        self._update_history_with_model_response(response_text)
+        if not usage:
+            return None
+        quota_manager.charge_tokens(self.message.guild.id, self.message.author.id, self.guild_cfg, usage.total_tokens)
+        # Started right away so the row is written even if the request is cancelled while waiting for it.
+        return asyncio.ensure_future(asyncio.to_thread(self._log_usage, usage))
+
+    def _discard_history_entry(self, entry: HistoryEntry):
+        history = self.channel_context.history
+        for index in range(len(history) - 1, -1, -1):
+            if history[index] is entry:
+                del history[index]
+                return
@@ -0,0 +1,63 @@
+import base64
+import io
+import typing
+
+from .config import MAX_IMAGE_BYTES, MAX_IMAGE_DIMENSION
+from .log import get_logger
+
+logger = get_logger('attachments')
+
+ATTACHMENT_IMAGE = 'image'
+ATTACHMENT_TEXT = 'text'
+ATTACHMENT_UNKNOWN = 'unknown'
+ATTACHMENT_UNSUPPORTED = 'unsupported'
+
+TEXT_CONTENT_TYPES = {
+    'application/json', 'application/xml', 'application/javascript', 'application/x-sh',
+    'application/x-python', 'application/sql', 'application/x-yaml', 'application/toml',
+}
+IMAGE_CONTENT_TYPES = {'image/png', 'image/jpeg', 'image/webp', 'image/gif'}
+JPEG_QUALITY_STEPS = (85, 70, 55, 40)
+
+def classify_attachment(content_type: typing.Optional[str]) -> str:
+    if not content_type:
+        return ATTACHMENT_UNKNOWN
+    mime_type = content_type.split(';', 1)[0].strip().lower()
+    if mime_type in IMAGE_CONTENT_TYPES:
+        return ATTACHMENT_IMAGE
+    if mime_type.startswith('text/') or mime_type in TEXT_CONTENT_TYPES:
+        return ATTACHMENT_TEXT
+    return ATTACHMENT_UNSUPPORTED
+
+def decode_text_attachment(file_bytes: bytes, kind: str) -> typing.Optional[str]:
+    if kind == ATTACHMENT_TEXT:
+        return file_bytes.decode('utf-8', errors='replace')
+    try:
+        return file_bytes.decode('utf-8')
+    except UnicodeDecodeError:
+        return None
+
+def format_text_attachment(filename: str, file_bytes: bytes, kind: str) -> typing.Optional[str]:
+    file_content = decode_text_attachment(file_bytes, kind)
+    if file_content is None:
+        return None
+    return f"\n--- Contenido de {filename} ---\n{file_content}\n--- Fin de {filename} ---"
+
+def encode_image_for_model(file_bytes: bytes) -> typing.Optional[str]:
+    from PIL import Image, UnidentifiedImageError
+
+    try:
+        with Image.open(io.BytesIO(file_bytes)) as image:
+            image.thumbnail((MAX_IMAGE_DIMENSION, MAX_IMAGE_DIMENSION))
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+
+            for quality in JPEG_QUALITY_STEPS:
+                buffer = io.BytesIO()
+                image.save(buffer, format='JPEG', quality=quality, optimize=True)
+                if buffer.tell() <= MAX_IMAGE_BYTES:
+                    encoded = base64.b64encode(buffer.getvalue()).decode('ascii')
+                    return f"data:image/jpeg;base64,{encoded}"
+    except (UnidentifiedImageError, OSError, ValueError) as e:
+        logger.warning("Could not re-encode image attachment: %s", e)
+    return None
@@ -0,0 +1,149 @@
+import json
+import os
+import re
+import typing
+
+from .credentials import OPENROUTER_KEEPALIVE_SECONDS, ConnectionSettings, CredentialPool, credential_pool
+from .log import fields, get_logger
+
+logger = get_logger('backends')
+
+BACKENDS_FILE = os.getenv('BACKENDS_FILE', 'backends.json')
+DEFAULT_BACKEND = 'openrouter'
+CATALOG_OPENROUTER = 'openrouter'
+CATALOG_OPENAI = 'openai'
+CATALOG_FORMATS = (CATALOG_OPENROUTER, CATALOG_OPENAI)
+BACKEND_NAME_PATTERN = re.compile(r'^[a-z0-9_-]+$')
+# Local servers usually run without auth, but the OpenAI client refuses an empty key.
+PLACEHOLDER_API_KEY = 'none'
+
+class Backend:
+    def __init__(self, name: str, pool: CredentialPool, catalog: str = CATALOG_OPENAI,
+                 system_prompt: typing.Optional[bool] = True, models: typing.Optional[list[str]] = None,
+                 image_input: typing.Union[bool, list[str]] = False, reasoning: bool = False,
+                 context_length: typing.Optional[int] = None):
+        self.name = name
+        self.pool = pool
+        self.catalog = catalog
+        # None means the support is probed with a live request, like OpenRouter models.
+        self.system_prompt = system_prompt
+        self.models = models
+        self.image_input = image_input
+        self.reasoning = reasoning
+        self.context_length = context_length
+
+    @property
+    def is_openrouter(self) -> bool:
+        return self.catalog == CATALOG_OPENROUTER
+
+    @property
+    def keepalive_path(self) -> str:
+        return '/key' if self.is_openrouter else '/models'
+
+    def model_ref(self, model_id: str) -> str:
+        return model_id if self.name == DEFAULT_BACKEND else f"{self.name}:{model_id}"
+
+    def catalog_headers(self) -> dict:
+        api_key = self.pool.credentials[0].api_key if self.pool.credentials else ''
+        if self.name == DEFAULT_BACKEND or not api_key or api_key == PLACEHOLDER_API_KEY:
+            return {}
+        return {'Authorization': f"Bearer {api_key}"}
+
+    def accepts_images(self, model_id: str) -> bool:
+        return self.image_input if isinstance(self.image_input, bool) else model_id in self.image_input
+
+    def normalize_catalog(self, data: dict) -> dict[str, dict]:
+        models = {}
+        for model in data.get('data') or []:
+            model_id = model.get('id')
+            if not model_id:
+                continue
+            if self.is_openrouter:
+                models[self.model_ref(model_id)] = {**model, 'id': self.model_ref(model_id)}
+                continue
+            # vLLM reports max_model_len and llama.cpp reports meta.n_ctx_train; plain OpenAI servers report neither.
+            context_length = model.get('max_model_len') or (model.get('meta') or {}).get('n_ctx_train') or self.context_length or 0
+            models[self.model_ref(model_id)] = {
+                'id': self.model_ref(model_id),
+                'name': model_id,
+                'created': model.get('created') or 0,
+                'context_length': context_length,
+                'description': f"Modelo servido por el backend `{self.name}`.",
+                'pricing': {'prompt': '0', 'completion': '0'},
+                'architecture': {'input_modalities': ['text', 'image'] if self.accepts_images(model_id) else ['text']},
+                'supported_parameters': ['reasoning'] if self.reasoning else [],
+            }
+        return models
+
+    def static_catalog(self) -> typing.Optional[dict[str, dict]]:
+        if self.models is None:
+            return None
+        return self.normalize_catalog({'data': [{'id': model_id} for model_id in self.models]})
+
+def _build_backend(name: str, options: dict) -> Backend:
+    if not BACKEND_NAME_PATTERN.match(name) or name == DEFAULT_BACKEND:
+        raise ValueError("the name must use lowercase letters, digits, '-' or '_' and can't be 'openrouter'")
+    catalog = options.get('catalog', CATALOG_OPENAI)
+    if catalog not in CATALOG_FORMATS:
+        raise ValueError(f"unknown catalog format {catalog}")
+    system_prompt = options.get('system_prompt', True)
+    if system_prompt not in (True, False, 'probe'):
+        raise ValueError("system_prompt must be true, false or 'probe'")
+
+    api_key = options.get('api_key') or os.getenv(options.get('api_key_env') or '', '') or PLACEHOLDER_API_KEY
+    connection = ConnectionSettings(
+        base_url=options['base_url'].rstrip('/'),
+        headers=dict(options.get('headers') or {}),
+        keepalive_seconds=float(options.get('keepalive_seconds', OPENROUTER_KEEPALIVE_SECONDS)),
+        timeout=float(options['timeout']) if options.get('timeout') else None,
+        max_connections=int(options['max_connections']) if options.get('max_connections') else None,
+    )
+    pool = CredentialPool([(name, api_key)], {}, rpm=int(options.get('rpm', 0)), connection=connection)
+    return Backend(
+        name, pool, catalog=catalog,
+        system_prompt=None if system_prompt == 'probe' else system_prompt,
+        models=list(options['models']) if options.get('models') is not None else None,
+        image_input=options.get('image_input', False),
+        reasoning=bool(options.get('reasoning', False)),
+        context_length=int(options['context_length']) if options.get('context_length') else None,
+    )
+
+def load_backends(path: str = BACKENDS_FILE) -> dict[str, Backend]:
+    backends = {DEFAULT_BACKEND: Backend(DEFAULT_BACKEND, credential_pool, catalog=CATALOG_OPENROUTER, system_prompt=None)}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            configured = json.load(f)
+    except FileNotFoundError:
+        return backends
+    except (OSError, json.JSONDecodeError) as e:
+        logger.error("Could not read %s, only OpenRouter is available: %s", path, e)
+        return backends
+
+    for name, options in configured.items():
+        try:
+            backends[name] = _build_backend(name, options)
+        except (KeyError, TypeError, ValueError) as e:
+            logger.error("Ignoring backend %s in %s: %s - %s", name, path, type(e).__name__, e)
+            continue
+        logger.info("Backend configured", extra=fields(backend=name, base_url=backends[name].pool.connection.base_url, catalog=backends[name].catalog))
+    return backends
+
+class BackendRegistry:
+    def __init__(self, backends: dict[str, Backend]):
+        self.backends = backends
+
+    @property
+    def default(self) -> Backend:
+        return self.backends[DEFAULT_BACKEND]
+
+    def get(self, name: str) -> typing.Optional[Backend]:
+        return self.backends.get(name)
+
+    def resolve(self, model_ref: str) -> typing.Tuple[Backend, str]:
+        # OpenRouter ids contain '/' before any ':' (e.g. 'org/model:free'), so they never match a backend name.
+        name, separator, model_id = model_ref.partition(':')
+        if separator and model_id and name in self.backends:
+            return self.backends[name], model_id
+        return self.default, model_ref
+
+backend_registry = BackendRegistry(load_backends())
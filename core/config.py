@@ -1,18 +1,31 @@
 import copy
 import json
 import os
-from dotenv import load_dotenv
+import shutil
+import typing
 
-load_dotenv()
+from .log import get_logger
+
+logger = get_logger('config')
 
 CONFIG_FILE = 'config.json'
+OPENROUTER_BASE_URL = os.getenv('OPENROUTER_BASE_URL', 'https://openrouter.ai/api/v1').rstrip('/')
 
 DEFAULT_COMMAND_PREFIX = '!'
 DEFAULT_ADMIN_ROLE_ID = None
 DEFAULT_ALLOWED_CHANNEL_IDS = []
 DEFAULT_BOT_ENABLED_FOR_USERS = True
 DEFAULT_MAX_OUTPUT_TOKENS = 4096
+DEFAULT_PROMPT_CACHING = True
+DEFAULT_REASONING_EFFORT = 'auto'
+DEFAULT_REASONING_MAX_TOKENS = None
+DEFAULT_SHOW_REASONING = False
 DEFAULT_MODEL = os.getenv('MODEL_NAME', 'deepseek/deepseek-r1-0528:free')
+DEFAULT_SUMMARY_MODEL = os.getenv('SUMMARY_MODEL_NAME', 'meta-llama/llama-3.2-3b-instruct:free')
+DEFAULT_GUILD_REQUESTS_PER_MINUTE = 0
+DEFAULT_GUILD_TOKENS_PER_DAY = 0
+DEFAULT_USER_REQUESTS_PER_MINUTE = 0
+DEFAULT_USER_TOKENS_PER_DAY = 0
 
 DEFAULT_GUILD_CONFIG = {
     'command_prefix': DEFAULT_COMMAND_PREFIX,
@@ -20,16 +33,30 @@ DEFAULT_GUILD_CONFIG = {
     'allowed_channel_ids': DEFAULT_ALLOWED_CHANNEL_IDS,
     'bot_enabled_for_users': DEFAULT_BOT_ENABLED_FOR_USERS,
     'max_output_tokens': DEFAULT_MAX_OUTPUT_TOKENS,
+    'prompt_caching': DEFAULT_PROMPT_CACHING,
+    'reasoning_effort': DEFAULT_REASONING_EFFORT,
+    'reasoning_max_tokens': DEFAULT_REASONING_MAX_TOKENS,
+    'show_reasoning': DEFAULT_SHOW_REASONING,
     'model': DEFAULT_MODEL,
+    'summary_model': DEFAULT_SUMMARY_MODEL,
+    'guild_requests_per_minute': DEFAULT_GUILD_REQUESTS_PER_MINUTE,
+    'guild_tokens_per_day': DEFAULT_GUILD_TOKENS_PER_DAY,
+    'user_requests_per_minute': DEFAULT_USER_REQUESTS_PER_MINUTE,
+    'user_tokens_per_day': DEFAULT_USER_TOKENS_PER_DAY,
 }
 
 DEFAULT_AI_SETTINGS = {
     'personality': 'Tono: neutral. Estilo: formal.',
     'temperature': 0.5,
-    'natural_conversation': False
+    'natural_conversation': False,
+    'relevance_threshold': 0.5,
+    'summarize_history': False,
+    'long_term_memory': False
 }
 
 MAX_ATTACHMENT_SIZE_BYTES = 10 * 1024 * 1024 
+MAX_IMAGE_DIMENSION = 1024
+MAX_IMAGE_BYTES = 512 * 1024
 LANGUAGE_EXTENSIONS = {
     "python": ".py", "py": ".py", "javascript": ".js", "js": ".js",
     "typescript": ".ts", "ts": ".ts", "java": ".java", "csharp": ".cs",
@@ -44,25 +71,59 @@ class ConfigManager:
     def __init__(self, config_file: str = CONFIG_FILE):
         self.config_file = config_file
         self.bot_config = {}
-        self.load_config()
+        self.loaded = False
+        self.loaded_mtime: typing.Optional[float] = None
+        # Worker processes only follow the gateway's config.json and never write it.
+        self.read_only = False
 
     def load_config(self):
+        self.loaded = True
         try:
+            mtime = os.path.getmtime(self.config_file)
             with open(self.config_file, 'r', encoding='utf-8') as f:
                 self.bot_config = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            print(f"Warning: {self.config_file} not found or corrupt. A new one will be created.")
+            self.loaded_mtime = mtime
+        except FileNotFoundError:
+            logger.warning("%s not found. A new one will be created.", self.config_file)
             self.bot_config = {}
             self.save_config()
+        except json.JSONDecodeError as e:
+            logger.error("%s is corrupt, keeping the last good configuration: %s", self.config_file, e)
+            if self.loaded_mtime is None and not self.read_only:
+                # Nothing was loaded yet, so the next save would replace the file; keep a copy to recover from.
+                shutil.copyfile(self.config_file, f"{self.config_file}.corrupt")
+
+    def reload_if_changed(self) -> bool:
+        try:
+            mtime = os.path.getmtime(self.config_file)
+        except OSError:
+            return False
+        if mtime == self.loaded_mtime:
+            return False
+        self.load_config()
+        return True
 
     def save_config(self):
+        if self.read_only:
+            return
+        temp_file = f"{self.config_file}.tmp"
         try:
-            with open(self.config_file, 'w', encoding='utf-8') as f:
+            # Written to a temp file and swapped in, so readers never see a half-written config.
+            with open(temp_file, 'w', encoding='utf-8') as f:
                 json.dump(self.bot_config, f, indent=4)
+            os.replace(temp_file, self.config_file)
+            self.loaded_mtime = os.path.getmtime(self.config_file)
         except Exception as e:
-            print(f"Critical error saving configuration in {self.config_file}: {e}")
+            logger.critical("Error saving configuration in %s: %s", self.config_file, e)
+
+    def get_all_guild_configs(self) -> dict:
+        if not self.loaded:
+            self.load_config()
+        return self.bot_config
 
     def get_guild_config(self, guild_id: int) -> dict:
+        if not self.loaded:
+            self.load_config()
         guild_id_str = str(guild_id)
         guild_cfg = self.bot_config.get(guild_id_str)
 
@@ -1,27 +1,29 @@
+import asyncio
 import copy
-import os
 import typing
-from dotenv import load_dotenv
-
-from openai import AsyncOpenAI
 
 from .config import DEFAULT_AI_SETTINGS
+from .history import HistoryEntry
 
-load_dotenv()
-
-OPENROUTER_API_KEY = os.getenv('OPENROUTER_API_KEY')
-SITE_URL = os.getenv('OPENROUTER_SITE_URL', '')
-APP_NAME = os.getenv('OPENROUTER_APP_NAME', '')
-
-if not OPENROUTER_API_KEY:
-    print("Critical Error: OPENROUTER_API_KEY isn't set in the .env file")
+class RemoteControl(typing.Protocol):
+    def cancel(self, channel_id: int, message_id: int) -> bool: ...
+    def cancel_all(self, channel_id: int) -> int: ...
+    def clear(self, channel_id: int): ...
 
 class ChannelContext:
-    def __init__(self, channel_id: int):
+    def __init__(self, channel_id: int, remote_control: typing.Optional[RemoteControl] = None):
         self.channel_id = channel_id
-        self.history: list[dict] = []
+        # Set on the gateway when replies run in worker processes, so cancels and clears reach them.
+        self.remote_control = remote_control
+        self.history: list[HistoryEntry] = []
         self.settings = copy.deepcopy(DEFAULT_AI_SETTINGS)
-        self.stop_requested = False
+        self.active_requests: typing.Dict[int, asyncio.Task] = {}
+        self.summary: str = ""
+        self.pending_summary_turns: list[HistoryEntry] = []
+        self.summary_task: typing.Optional[asyncio.Task] = None
+        self.last_reply_at: typing.Optional[float] = None
+        self.last_mention_at: typing.Optional[float] = None
+        self.relevance_stats = {'passed': 0, 'gated': 0}
         self.system_prompt: str = ""
         self._last_personality: str | None = None
 
@@ -49,29 +51,61 @@ class ChannelContext:
         self.system_prompt = " ".join(prompt_parts)
         self._last_personality = current_personality
 
+    def track_request(self, message_id: int, task: asyncio.Task):
+        self.active_requests[message_id] = task
+
+        def _untrack(finished_task: asyncio.Task):
+            if self.active_requests.get(message_id) is finished_task:
+                del self.active_requests[message_id]
+
+        task.add_done_callback(_untrack)
+
+    def cancel_request(self, message_id: int) -> bool:
+        task = self.active_requests.get(message_id)
+        if task is None or task.done():
+            return self.remote_control.cancel(self.channel_id, message_id) if self.remote_control else False
+        task.cancel()
+        return True
+
+    def cancel_all_requests(self) -> int:
+        cancelled = 0
+        for message_id in list(self.active_requests):
+            task = self.active_requests.get(message_id)
+            if task is not None and not task.done():
+                task.cancel()
+                cancelled += 1
+        if self.remote_control:
+            cancelled += self.remote_control.cancel_all(self.channel_id)
+        return cancelled
+
     def get_system_prompt_message(self) -> dict[str, str]:
         self._build_system_prompt()
         return {'role': 'system', 'content': self.system_prompt}
 
-    def create_client(self) -> typing.Optional[AsyncOpenAI]:
-        try:
-            headers = {"HTTP-Referer": SITE_URL, "X-Title": APP_NAME}
-            return AsyncOpenAI(
-                api_key=OPENROUTER_API_KEY,
-                base_url="https://openrouter.ai/api/v1",
-                default_headers={k: v for k, v in headers.items() if v},
-            )
-        except Exception as e:
-            print(f"Error creating the OpenRouter client: {e}")
+    def get_summary_message(self, as_system: bool = True) -> typing.Optional[dict[str, str]]:
+        if not self.summary:
             return None
+        content = f"Resumen de la conversación anterior en este canal: {self.summary}"
+        return {'role': 'system' if as_system else 'user', 'content': content}
+
+    def clear_memory(self):
+        if self.remote_control:
+            self.remote_control.clear(self.channel_id)
+        self.history.clear()
+        self.summary = ""
+        self.pending_summary_turns = []
+        if self.summary_task and not self.summary_task.done():
+            self.summary_task.cancel()
+        self.summary_task = None
 
 class ContextManager:
     def __init__(self):
         self.channel_contexts: typing.Dict[int, ChannelContext] = {}
+        self.remote_control: typing.Optional[RemoteControl] = None
 
     async def get_channel_ctx(self, channel_id: int) -> ChannelContext:
         if channel_id not in self.channel_contexts:
-            self.channel_contexts[channel_id] = ChannelContext(channel_id)
+            self.channel_contexts[channel_id] = ChannelContext(channel_id, self.remote_control)
         return self.channel_contexts[channel_id]
 
 context_manager = ContextManager()
\ No newline at end of file
@@ -0,0 +1,204 @@
+import collections
+import contextlib
+import os
+import time
+import typing
+
+from .config import OPENROUTER_BASE_URL
+from .log import fields, get_logger
+
+if typing.TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+logger = get_logger('credentials')
+
+OPENROUTER_API_KEY = os.getenv('OPENROUTER_API_KEY', '')
+OPENROUTER_API_KEYS = os.getenv('OPENROUTER_API_KEYS', '')
+OPENROUTER_KEY_PINS = os.getenv('OPENROUTER_KEY_PINS', '')
+OPENROUTER_KEY_STRATEGY = os.getenv('OPENROUTER_KEY_STRATEGY', 'least_loaded').lower()
+OPENROUTER_KEY_RPM = int(os.getenv('OPENROUTER_KEY_RPM', '20'))
+OPENROUTER_KEEPALIVE_SECONDS = float(os.getenv('OPENROUTER_KEEPALIVE_SECONDS', '60'))
+SITE_URL = os.getenv('OPENROUTER_SITE_URL', '')
+APP_NAME = os.getenv('OPENROUTER_APP_NAME', '')
+
+KEY_STRATEGIES = ('least_loaded', 'round_robin')
+RATE_LIMIT_WINDOW_SECONDS = 60
+RATE_LIMIT_QUARANTINE_SECONDS = 60
+AUTH_QUARANTINE_SECONDS = 600
+RATE_LIMIT_STATUS_CODES = {429}
+AUTH_STATUS_CODES = {401, 402, 403}
+
+class ConnectionSettings(typing.NamedTuple):
+    base_url: str
+    headers: dict
+    keepalive_seconds: float
+    timeout: typing.Optional[float] = None
+    max_connections: typing.Optional[int] = None
+
+OPENROUTER_CONNECTION = ConnectionSettings(
+    base_url=OPENROUTER_BASE_URL,
+    headers={k: v for k, v in {"HTTP-Referer": SITE_URL, "X-Title": APP_NAME}.items() if v},
+    keepalive_seconds=OPENROUTER_KEEPALIVE_SECONDS,
+)
+
+def parse_api_keys(primary_key: str, pool_keys: str) -> list[tuple[str, str]]:
+    entries: list[tuple[str, str]] = []
+    for index, item in enumerate((part.strip() for part in pool_keys.split(',') if part.strip()), start=1):
+        name, separator, api_key = item.partition('=')
+        if not separator:
+            name, api_key = f"key{index}", item
+        entries.append((name.strip(), api_key.strip()))
+
+    if primary_key and primary_key not in {api_key for _, api_key in entries}:
+        entries.insert(0, ('default', primary_key))
+    return entries
+
+def parse_key_pins(pins: str) -> dict[int, str]:
+    pinned: dict[int, str] = {}
+    for item in (part.strip() for part in pins.split(',') if part.strip()):
+        guild_id, _, name = item.partition('=')
+        try:
+            pinned[int(guild_id)] = name.strip()
+        except ValueError:
+            logger.warning("Ignoring invalid API key pin %s", item)
+    return pinned
+
+def _retry_after_seconds(error: Exception) -> typing.Optional[float]:
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        if retry_after := headers.get('retry-after'):
+            return max(1.0, float(retry_after))
+        if reset_at := headers.get('x-ratelimit-reset'):
+            return max(1.0, int(reset_at) / 1000 - time.time())
+    except ValueError:
+        pass
+    return None
+
+class APICredential:
+    def __init__(self, name: str, api_key: str, connection: ConnectionSettings = OPENROUTER_CONNECTION):
+        self.name = name
+        self.api_key = api_key
+        self.connection = connection
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.recent_requests: typing.Deque[float] = collections.deque()
+        self.quarantined_until = 0.0
+        self.last_error: typing.Optional[int] = None
+        self._client: typing.Optional['AsyncOpenAI'] = None
+
+    def get_client(self) -> 'AsyncOpenAI':
+        if self._client is None:
+            from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+            from openai._constants import DEFAULT_CONNECTION_LIMITS, DEFAULT_TIMEOUT
+
+            connection = self.connection
+            max_connections = connection.max_connections or DEFAULT_CONNECTION_LIMITS.max_connections
+            # Retries are handled by the pool so a rate limited key fails over instead of waiting.
+            self._client = AsyncOpenAI(
+                api_key=self.api_key,
+                base_url=connection.base_url,
+                default_headers=connection.headers,
+                max_retries=0,
+                timeout=type(DEFAULT_TIMEOUT)(connection.timeout, connect=DEFAULT_TIMEOUT.connect) if connection.timeout else DEFAULT_TIMEOUT,
+                # Keep idle connections long enough for a warmed connection to still be open when the reply is sent.
+                http_client=DefaultAsyncHttpxClient(limits=type(DEFAULT_CONNECTION_LIMITS)(
+                    max_connections=max_connections,
+                    max_keepalive_connections=min(max_connections, DEFAULT_CONNECTION_LIMITS.max_keepalive_connections),
+                    keepalive_expiry=connection.keepalive_seconds,
+                )),
+            )
+        return self._client
+
+    def requests_in_window(self, now: float) -> int:
+        while self.recent_requests and now - self.recent_requests[0] >= RATE_LIMIT_WINDOW_SECONDS:
+            self.recent_requests.popleft()
+        return len(self.recent_requests)
+
+    def is_available(self, now: float) -> bool:
+        return self.quarantined_until <= now
+
+    def is_at_rate_limit(self, now: float, rpm: int) -> bool:
+        return rpm > 0 and self.requests_in_window(now) >= rpm
+
+class CredentialPool:
+    def __init__(self, entries: list[tuple[str, str]], pins: dict[int, str], strategy: str = OPENROUTER_KEY_STRATEGY,
+                 rpm: int = OPENROUTER_KEY_RPM, connection: ConnectionSettings = OPENROUTER_CONNECTION):
+        self.credentials = [APICredential(name, api_key, connection) for name, api_key in entries]
+        self.connection = connection
+        self.rpm = rpm
+        self.by_name = {credential.name: credential for credential in self.credentials}
+        self.strategy = strategy if strategy in KEY_STRATEGIES else KEY_STRATEGIES[0]
+        self.pins = {guild_id: name for guild_id, name in pins.items() if name in self.by_name}
+        self.pinned_names = set(self.pins.values())
+        self._next_index = 0
+
+        for guild_id, name in pins.items():
+            if name not in self.by_name:
+                logger.warning("Guild pinned to unknown API key %s, using the shared pool", name, extra=fields(guild=guild_id))
+
+    def _eligible(self, guild_id: typing.Optional[int]) -> list[APICredential]:
+        shared = [credential for credential in self.credentials if credential.name not in self.pinned_names]
+        pinned = self.by_name.get(self.pins.get(guild_id))
+        return [pinned] + shared if pinned else shared
+
+    def acquire(self, guild_id: typing.Optional[int]) -> typing.Optional[APICredential]:
+        now = time.monotonic()
+        available = [credential for credential in self._eligible(guild_id) if credential.is_available(now)]
+        if not available:
+            return None
+        if available[0].name in self.pinned_names:
+            return available[0]
+
+        with_capacity = [credential for credential in available if not credential.is_at_rate_limit(now, self.rpm)] or available
+        if self.strategy == 'round_robin':
+            self._next_index += 1
+            return with_capacity[self._next_index % len(with_capacity)]
+        return min(with_capacity, key=lambda credential: (credential.in_flight, credential.requests_in_window(now)))
+
+    @contextlib.contextmanager
+    def lease(self, guild_id: typing.Optional[int]) -> typing.Iterator[typing.Optional[APICredential]]:
+        credential = self.acquire(guild_id)
+        if credential is None:
+            yield None
+            return
+
+        credential.in_flight += 1
+        credential.requests += 1
+        credential.recent_requests.append(time.monotonic())
+        try:
+            yield credential
+        finally:
+            credential.in_flight -= 1
+
+    def report_error(self, credential: APICredential, error: Exception) -> bool:
+        status_code = getattr(error, 'status_code', None)
+        if status_code is None or status_code >= 500:
+            return True
+        body = getattr(error, 'body', None)
+        if isinstance(body, dict) and (body.get('metadata') or {}).get('provider_name'):
+            # The upstream provider rate limited this model; the key itself is still usable.
+            return False
+        if status_code in RATE_LIMIT_STATUS_CODES:
+            seconds = _retry_after_seconds(error) or RATE_LIMIT_QUARANTINE_SECONDS
+        elif status_code in AUTH_STATUS_CODES:
+            seconds = AUTH_QUARANTINE_SECONDS
+        else:
+            return False
+
+        credential.failures += 1
+        credential.last_error = status_code
+        credential.quarantined_until = time.monotonic() + seconds
+        logger.warning("API key quarantined", extra=fields(key=credential.name, status=status_code, seconds=round(seconds)))
+        return True
+
+    def seconds_until_available(self, guild_id: typing.Optional[int]) -> typing.Optional[float]:
+        eligible = self._eligible(guild_id)
+        if not eligible:
+            return None
+        return max(0.0, min(credential.quarantined_until for credential in eligible) - time.monotonic())
+
+credential_pool = CredentialPool(parse_api_keys(OPENROUTER_API_KEY, OPENROUTER_API_KEYS), parse_key_pins(OPENROUTER_KEY_PINS))
+if not credential_pool.credentials:
+    logger.critical("OPENROUTER_API_KEY isn't set in the .env file")
@@ -1,48 +1,252 @@
 import sqlite3
 import time
+import typing
 from pathlib import Path
 
+from .log import get_logger
+
+logger = get_logger('database_manager')
+
 DB_FILE = Path("bot_usage.db")
 
-def initialize_database():
+HOUR_SECONDS = 60 * 60
+DAY_SECONDS = 24 * HOUR_SECONDS
+
+RAW_RETENTION_SECONDS = 7 * DAY_SECONDS
+HOURLY_RETENTION_SECONDS = 90 * DAY_SECONDS
+DAILY_RETENTION_SECONDS = 730 * DAY_SECONDS
+
+ROLLUP_TABLES = {
+    'usage_hourly': HOUR_SECONDS,
+    'usage_daily': DAY_SECONDS,
+}
+
+USAGE_BREAKDOWNS = {'model', 'channel_id', 'user_id'}
+
+def _connect() -> sqlite3.Connection:
     conn = sqlite3.connect(DB_FILE)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+def _bucket_start(timestamp: int, bucket_seconds: int) -> int:
+    return timestamp - (timestamp % bucket_seconds)
+
+def _ensure_column(cursor: sqlite3.Cursor, table: str, column: str, declaration: str):
+    cursor.execute(f"PRAGMA table_info({table})")
+    if column not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+
+def _migrate_legacy_token_usage(cursor: sqlite3.Cursor):
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'token_usage'")
+    if not cursor.fetchone():
+        return
+
+    for table, bucket_seconds in ROLLUP_TABLES.items():
+        cursor.execute(f"""
+            INSERT INTO {table} (bucket, guild_id, channel_id, user_id, model, requests, prompt_tokens, completion_tokens, total_tokens)
+            SELECT timestamp - (timestamp % ?), 0, 0, 0, '', COUNT(*), 0, 0, SUM(total_tokens)
+            FROM token_usage WHERE true
+            GROUP BY timestamp - (timestamp % ?)
+            ON CONFLICT (bucket, guild_id, channel_id, user_id, model) DO UPDATE SET
+                requests = requests + excluded.requests,
+                total_tokens = total_tokens + excluded.total_tokens
+        """, (bucket_seconds, bucket_seconds))
+    cursor.execute("DROP TABLE token_usage")
+    logger.info("Migrated legacy token_usage rows into usage rollups.")
+
+def initialize_database():
+    conn = _connect()
     cursor = conn.cursor()
     cursor.execute("""
-        CREATE TABLE IF NOT EXISTS token_usage (
+        CREATE TABLE IF NOT EXISTS usage_events (
             timestamp INTEGER NOT NULL,
+            guild_id INTEGER NOT NULL,
+            channel_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            model TEXT NOT NULL,
+            prompt_tokens INTEGER NOT NULL,
+            completion_tokens INTEGER NOT NULL,
             total_tokens INTEGER NOT NULL
         )
     """)
+    _ensure_column(cursor, 'usage_events', 'cached_tokens', "INTEGER NOT NULL DEFAULT 0")
+    _ensure_column(cursor, 'usage_events', 'api_key', "TEXT NOT NULL DEFAULT ''")
+    _ensure_column(cursor, 'usage_events', 'reasoning_tokens', "INTEGER NOT NULL DEFAULT 0")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_usage_events_timestamp ON usage_events (timestamp)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_usage_events_guild ON usage_events (guild_id, timestamp)")
+
+    for table in ROLLUP_TABLES:
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                bucket INTEGER NOT NULL,
+                guild_id INTEGER NOT NULL,
+                channel_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                model TEXT NOT NULL,
+                requests INTEGER NOT NULL,
+                prompt_tokens INTEGER NOT NULL,
+                completion_tokens INTEGER NOT NULL,
+                total_tokens INTEGER NOT NULL,
+                PRIMARY KEY (bucket, guild_id, channel_id, user_id, model)
+            ) WITHOUT ROWID
+        """)
+        _ensure_column(cursor, table, 'cached_tokens', "INTEGER NOT NULL DEFAULT 0")
+        _ensure_column(cursor, table, 'reasoning_tokens', "INTEGER NOT NULL DEFAULT 0")
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_guild ON {table} (guild_id, bucket)")
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_model ON {table} (model, bucket)")
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS usage_by_key_daily (
+            bucket INTEGER NOT NULL,
+            api_key TEXT NOT NULL,
+            requests INTEGER NOT NULL,
+            total_tokens INTEGER NOT NULL,
+            PRIMARY KEY (bucket, api_key)
+        ) WITHOUT ROWID
+    """)
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS quota_buckets (
+            key TEXT PRIMARY KEY,
+            capacity INTEGER NOT NULL,
+            tokens REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    """)
+
+    _migrate_legacy_token_usage(cursor)
     conn.commit()
     conn.close()
 
-def log_token_usage(tokens: int):
-    conn = sqlite3.connect(DB_FILE)
+def log_token_usage(guild_id: int, channel_id: int, user_id: int, model: str, prompt_tokens: int, completion_tokens: int, total_tokens: int, cached_tokens: int = 0, reasoning_tokens: int = 0, api_key: str = ''):
+    now = int(time.time())
+    dimensions = (guild_id, channel_id, user_id, model or '')
+    tokens = (prompt_tokens or 0, completion_tokens or 0, total_tokens or 0, cached_tokens or 0, reasoning_tokens or 0)
+
+    conn = _connect()
     cursor = conn.cursor()
     cursor.execute(
-        "INSERT INTO token_usage (timestamp, total_tokens) VALUES (?, ?)",
-        (int(time.time()), tokens)
+        "INSERT INTO usage_events (timestamp, guild_id, channel_id, user_id, model, prompt_tokens, completion_tokens, total_tokens, cached_tokens, reasoning_tokens, api_key) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (now, *dimensions, *tokens, api_key)
     )
+    for table, bucket_seconds in ROLLUP_TABLES.items():
+        cursor.execute(f"""
+            INSERT INTO {table} (bucket, guild_id, channel_id, user_id, model, requests, prompt_tokens, completion_tokens, total_tokens, cached_tokens, reasoning_tokens)
+            VALUES (?, ?, ?, ?, ?, 1, ?, ?, ?, ?, ?)
+            ON CONFLICT (bucket, guild_id, channel_id, user_id, model) DO UPDATE SET
+                requests = requests + 1,
+                prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                completion_tokens = completion_tokens + excluded.completion_tokens,
+                total_tokens = total_tokens + excluded.total_tokens,
+                cached_tokens = cached_tokens + excluded.cached_tokens,
+                reasoning_tokens = reasoning_tokens + excluded.reasoning_tokens
+        """, (_bucket_start(now, bucket_seconds), *dimensions, *tokens))
+    cursor.execute("""
+        INSERT INTO usage_by_key_daily (bucket, api_key, requests, total_tokens) VALUES (?, ?, 1, ?)
+        ON CONFLICT (bucket, api_key) DO UPDATE SET
+            requests = requests + 1,
+            total_tokens = total_tokens + excluded.total_tokens
+    """, (_bucket_start(now, DAY_SECONDS), api_key, total_tokens or 0))
     conn.commit()
     conn.close()
 
 def get_tokens_from_last_7_days() -> int:
-    seven_days_ago_ts = int(time.time()) - (7 * 24 * 60 * 60)
-    conn = sqlite3.connect(DB_FILE)
+    seven_days_ago_ts = _bucket_start(int(time.time()) - (7 * DAY_SECONDS), HOUR_SECONDS)
+    conn = _connect()
     cursor = conn.cursor()
     cursor.execute(
-        "SELECT SUM(total_tokens) FROM token_usage WHERE timestamp >= ?",
+        "SELECT SUM(total_tokens) FROM usage_hourly WHERE bucket >= ?",
         (seven_days_ago_ts,)
     )
     result = cursor.fetchone()[0]
     conn.close()
     return result or 0
 
+def get_usage_summary(guild_id: int, days: int) -> dict:
+    since_ts = _bucket_start(int(time.time()) - ((days - 1) * DAY_SECONDS), DAY_SECONDS)
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT COALESCE(SUM(requests), 0), COALESCE(SUM(prompt_tokens), 0),
+               COALESCE(SUM(completion_tokens), 0), COALESCE(SUM(total_tokens), 0),
+               COALESCE(SUM(cached_tokens), 0), COALESCE(SUM(reasoning_tokens), 0)
+        FROM usage_daily WHERE guild_id = ? AND bucket >= ?
+    """, (guild_id, since_ts))
+    requests, prompt_tokens, completion_tokens, total_tokens, cached_tokens, reasoning_tokens = cursor.fetchone()
+    conn.close()
+    return {
+        'requests': requests,
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': completion_tokens,
+        'total_tokens': total_tokens,
+        'cached_tokens': cached_tokens,
+        'reasoning_tokens': reasoning_tokens,
+    }
+
+def get_usage_breakdown(guild_id: typing.Optional[int], dimension: str, days: int, limit: int = 10) -> list[tuple]:
+    if dimension not in USAGE_BREAKDOWNS:
+        raise ValueError(f"Unknown usage dimension: {dimension}")
+
+    since_ts = _bucket_start(int(time.time()) - ((days - 1) * DAY_SECONDS), DAY_SECONDS)
+    where_clause = "bucket >= ?"
+    params: list = [since_ts]
+    if guild_id is not None:
+        where_clause = "guild_id = ? AND " + where_clause
+        params.insert(0, guild_id)
+
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT {dimension}, SUM(requests), SUM(prompt_tokens), SUM(completion_tokens), SUM(total_tokens) AS tokens
+        FROM usage_daily WHERE {where_clause}
+        GROUP BY {dimension} ORDER BY tokens DESC LIMIT ?
+    """, (*params, limit))
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+def get_usage_by_key(days: int) -> list[tuple]:
+    since_ts = _bucket_start(int(time.time()) - ((days - 1) * DAY_SECONDS), DAY_SECONDS)
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT api_key, SUM(requests), SUM(total_tokens) AS tokens
+        FROM usage_by_key_daily WHERE bucket >= ?
+        GROUP BY api_key ORDER BY tokens DESC
+    """, (since_ts,))
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+def save_quota_buckets(rows: list[tuple]):
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM quota_buckets")
+    cursor.executemany(
+        "INSERT INTO quota_buckets (key, capacity, tokens, updated_at) VALUES (?, ?, ?, ?)",
+        rows
+    )
+    conn.commit()
+    conn.close()
+
+def load_quota_buckets() -> list[tuple]:
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute("SELECT key, capacity, tokens, updated_at FROM quota_buckets")
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
 def cleanup_old_logs():
-    seven_days_ago_ts = int(time.time()) - (7 * 24 * 60 * 60)
-    conn = sqlite3.connect(DB_FILE)
+    now = int(time.time())
+    conn = _connect()
     cursor = conn.cursor()
-    cursor.execute("DELETE FROM token_usage WHERE timestamp < ?", (seven_days_ago_ts,))
+    cursor.execute("DELETE FROM usage_events WHERE timestamp < ?", (now - RAW_RETENTION_SECONDS,))
+    cursor.execute("DELETE FROM usage_hourly WHERE bucket < ?", (now - HOURLY_RETENTION_SECONDS,))
+    cursor.execute("DELETE FROM usage_daily WHERE bucket < ?", (now - DAILY_RETENTION_SECONDS,))
+    cursor.execute("DELETE FROM usage_by_key_daily WHERE bucket < ?", (now - DAILY_RETENTION_SECONDS,))
     conn.commit()
     conn.close()
-    print("Cleaned up old token logs from the database.")
\ No newline at end of file
+    logger.info("Pruned token usage rows older than their retention windows.")
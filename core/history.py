@@ -0,0 +1,83 @@
+import json
+import sys
+import typing
+
+CHARS_PER_TOKEN_ESTIMATE = 4
+IMAGE_TOKEN_ESTIMATE = 800
+
+def _dumps(value: typing.Any) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+class HistoryEntry:
+    __slots__ = ('role', 'text', 'author_name', 'author_id', 'attachments', 'images', '_wire', '_token_estimate')
+
+    def __init__(self, role: str, text: str, author_name: typing.Optional[str] = None,
+                 author_id: typing.Optional[int] = None, attachments: typing.Iterable[str] = (),
+                 images: typing.Iterable[typing.Tuple[str, str]] = ()):
+        self.role = role
+        self.text = text
+        self.author_name = sys.intern(author_name) if author_name else None
+        self.author_id = author_id
+        self.attachments = tuple(attachments)
+        self.images = tuple(images)
+        self._wire: typing.Optional[str] = None
+        self._token_estimate: typing.Optional[int] = None
+
+    @classmethod
+    def user(cls, author_name: str, author_id: int, text: str, attachments: typing.Iterable[str] = (),
+             images: typing.Iterable[typing.Tuple[str, str]] = ()) -> 'HistoryEntry':
+        return cls('user', text, author_name, author_id, attachments, images)
+
+    @classmethod
+    def assistant(cls, text: str) -> 'HistoryEntry':
+        return cls('assistant', text)
+
+    def render_text(self) -> str:
+        if self.role != 'user':
+            return self.text
+        lines = [f"{self.author_name} (ID: {self.author_id}): {self.text}"] if self.text else []
+        lines.extend(self.attachments)
+        return "\n".join(lines)
+
+    def to_message(self) -> dict:
+        if self.role != 'user':
+            return {'role': self.role, 'content': self.text}
+
+        parts = []
+        if self.text:
+            parts.append({'type': 'text', 'text': f"{self.author_name} (ID: {self.author_id}): {self.text}"})
+        parts.extend({'type': 'text', 'text': attachment} for attachment in self.attachments)
+        parts.extend({'type': 'image_url', 'image_url': {'url': data_url}} for _, data_url in self.images)
+        return {'role': self.role, 'content': parts}
+
+    def to_json(self) -> str:
+        if self._wire is None:
+            self._wire = _dumps(self.to_message())
+        return self._wire
+
+    def strip_images(self):
+        if not self.images:
+            return
+        self.attachments += tuple(f"[Imagen adjunta: {filename}]" for filename, _ in self.images)
+        self.images = ()
+        self._wire = None
+        self._token_estimate = None
+
+    @property
+    def serialization_size(self) -> int:
+        if self._wire is not None:
+            return 0
+        return len(self.text) + sum(map(len, self.attachments)) + sum(len(data_url) for _, data_url in self.images)
+
+    @property
+    def token_estimate(self) -> int:
+        if self._token_estimate is None:
+            text_tokens = len(self.render_text()) // CHARS_PER_TOKEN_ESTIMATE + 1
+            self._token_estimate = text_tokens + len(self.images) * IMAGE_TOKEN_ESTIMATE
+        return self._token_estimate
+
+def serialize_chat_request(fields: dict, messages: typing.Iterable[typing.Union[HistoryEntry, dict]]) -> bytes:
+    fragments = [message.to_json() if isinstance(message, HistoryEntry) else _dumps(message) for message in messages]
+    head = _dumps({key: value for key, value in fields.items() if value is not None})
+    separator = ',' if len(head) > 2 else ''
+    return f'{head[:-1]}{separator}"messages":[{",".join(fragments)}]}}'.encode('utf-8')
@@ -0,0 +1,177 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import typing
+from pathlib import Path
+
+import discord
+
+from .log import fields, get_logger
+
+logger = get_logger('job_queue')
+
+AI_WORKERS = int(os.getenv('AI_WORKERS', '0'))
+JOB_QUEUE_PATH = Path(os.getenv('JOB_QUEUE_PATH', 'jobs.db'))
+JOB_MAX_AGE_SECONDS = int(os.getenv('JOB_MAX_AGE_SECONDS', '120'))
+JOB_LEASE_SECONDS = 300
+MAX_JOB_ATTEMPTS = 2
+
+JOB_REPLY = 'reply'
+JOB_CANCEL = 'cancel'
+JOB_CANCEL_ALL = 'cancel_all'
+JOB_CLEAR = 'clear'
+
+class Job(typing.NamedTuple):
+    id: int
+    kind: str
+    channel_id: int
+    message_id: typing.Optional[int]
+    payload: dict
+
+def reply_payload(message: discord.Message, content: str, settings: dict) -> dict:
+    return {
+        'guild_id': message.guild.id,
+        'author_id': message.author.id,
+        'author_name': message.author.display_name,
+        'content': content,
+        'attachments': [attachment.to_dict() for attachment in message.attachments],
+        'settings': settings,
+    }
+
+class JobQueue:
+    def __init__(self, path: Path = JOB_QUEUE_PATH, shard_count: int = AI_WORKERS):
+        self.path = path
+        self.shard_count = shard_count
+        self.enabled = shard_count > 0
+        self._conn: typing.Optional[sqlite3.Connection] = None
+        # The connection is shared by the loop and the threads enqueue/claim/finish run in.
+        self._lock = threading.RLock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("PRAGMA busy_timeout=5000")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    shard INTEGER NOT NULL,
+                    channel_id INTEGER NOT NULL,
+                    message_id INTEGER,
+                    payload TEXT NOT NULL,
+                    state TEXT NOT NULL DEFAULT 'queued',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    lease_until REAL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_shard ON jobs (shard, state, id)")
+            # Token charges flow back from the workers to the gateway, which owns the quota buckets.
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS quota_charges (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    guild_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    tokens INTEGER NOT NULL
+                )
+            """)
+        return self._conn
+
+    def shard_for(self, channel_id: int) -> int:
+        return channel_id % self.shard_count
+
+    def enqueue(self, kind: str, channel_id: int, message_id: typing.Optional[int] = None, payload: typing.Optional[dict] = None) -> int:
+        with self._lock:
+            cursor = self._connect().execute(
+                "INSERT INTO jobs (kind, shard, channel_id, message_id, payload, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (kind, self.shard_for(channel_id), channel_id, message_id, json.dumps(payload or {}, ensure_ascii=False), time.time())
+            )
+            return cursor.lastrowid
+
+    def cancel(self, channel_id: int, message_id: int) -> bool:
+        with self._lock:
+            conn = self._connect()
+            if conn.execute("DELETE FROM jobs WHERE kind = ? AND message_id = ? AND state = 'queued'", (JOB_REPLY, message_id)).rowcount:
+                return True
+            if conn.execute("SELECT 1 FROM jobs WHERE kind = ? AND message_id = ? AND state = 'running'", (JOB_REPLY, message_id)).fetchone():
+                self.enqueue(JOB_CANCEL, channel_id, message_id)
+                return True
+            return False
+
+    def cancel_all(self, channel_id: int) -> int:
+        with self._lock:
+            conn = self._connect()
+            dropped = conn.execute("DELETE FROM jobs WHERE kind = ? AND channel_id = ? AND state = 'queued'", (JOB_REPLY, channel_id)).rowcount
+            running = conn.execute("SELECT COUNT(*) FROM jobs WHERE kind = ? AND channel_id = ? AND state = 'running'", (JOB_REPLY, channel_id)).fetchone()[0]
+            if running:
+                self.enqueue(JOB_CANCEL_ALL, channel_id)
+            return dropped + running
+
+    def clear(self, channel_id: int):
+        self.enqueue(JOB_CLEAR, channel_id)
+
+    def claim(self, shard: int, limit: int) -> list[Job]:
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                expired = conn.execute(
+                    "DELETE FROM jobs WHERE shard = ? AND kind = ? AND state = 'queued' AND created_at < ?",
+                    (shard, JOB_REPLY, now - JOB_MAX_AGE_SECONDS)
+                ).rowcount
+                # A job whose worker died is retried once its lease runs out, unless it went stale or already used its attempts.
+                expired += conn.execute(
+                    "DELETE FROM jobs WHERE shard = ? AND state = 'running' AND lease_until < ? AND created_at < ?",
+                    (shard, now, now - JOB_MAX_AGE_SECONDS)
+                ).rowcount
+                conn.execute(
+                    "DELETE FROM jobs WHERE shard = ? AND state = 'running' AND lease_until < ? AND attempts >= ?",
+                    (shard, now, MAX_JOB_ATTEMPTS)
+                )
+                conn.execute("UPDATE jobs SET state = 'queued' WHERE shard = ? AND state = 'running' AND lease_until < ?", (shard, now))
+
+                controls = conn.execute(
+                    "DELETE FROM jobs WHERE shard = ? AND kind != ? AND state = 'queued' RETURNING id, kind, channel_id, message_id, payload",
+                    (shard, JOB_REPLY)
+                ).fetchall()
+                replies = conn.execute("""
+                    UPDATE jobs SET state = 'running', attempts = attempts + 1, lease_until = ?
+                    WHERE id IN (SELECT id FROM jobs WHERE shard = ? AND kind = ? AND state = 'queued' ORDER BY id LIMIT ?)
+                    RETURNING id, kind, channel_id, message_id, payload
+                """, (now + JOB_LEASE_SECONDS, shard, JOB_REPLY, limit)).fetchall() if limit > 0 else []
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+        if expired:
+            logger.warning("Dropped stale queued replies", extra=fields(shard=shard, jobs=expired, max_age=JOB_MAX_AGE_SECONDS))
+        jobs = [Job(job_id, kind, channel_id, message_id, json.loads(payload)) for job_id, kind, channel_id, message_id, payload in replies + controls]
+        return sorted(jobs, key=lambda job: job.id)
+
+    def finish(self, job_id: int):
+        with self._lock:
+            self._connect().execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def add_charges(self, charges: list[typing.Tuple[int, int, int]]):
+        with self._lock:
+            self._connect().executemany("INSERT INTO quota_charges (guild_id, user_id, tokens) VALUES (?, ?, ?)", charges)
+
+    def take_charges(self) -> list[typing.Tuple[int, int, int]]:
+        with self._lock:
+            return self._connect().execute("DELETE FROM quota_charges RETURNING guild_id, user_id, tokens").fetchall()
+
+    def depth(self) -> dict[int, dict[str, int]]:
+        with self._lock:
+            rows = self._connect().execute("SELECT shard, state, COUNT(*) FROM jobs GROUP BY shard, state").fetchall()
+        depth: dict[int, dict[str, int]] = {}
+        for shard, state, count in rows:
+            depth.setdefault(shard, {})[state] = count
+        return depth
+
+job_queue = JobQueue()
@@ -0,0 +1,99 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+import typing
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_QUEUE_SIZE = 10000
+RATE_LIMIT_WINDOW_SECONDS = 60
+RATE_LIMIT_MAX_RECORDS = 5
+ROOT_LOGGER_NAME = 'iris'
+
+_listener: typing.Optional[logging.handlers.QueueListener] = None
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f"{ROOT_LOGGER_NAME}.{name}")
+
+def fields(**values: typing.Any) -> dict:
+    return {'fields': {key: value for key, value in values.items() if value is not None}}
+
+class StructuredFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s", "%Y-%m-%dT%H:%M:%S")
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = super().format(record)
+        record_fields = getattr(record, 'fields', None)
+        if record_fields:
+            message += " " + " ".join(f"{key}={value}" for key, value in record_fields.items())
+        return message
+
+class RateLimitFilter(logging.Filter):
+    def __init__(self, min_level: int = logging.WARNING):
+        super().__init__()
+        self.min_level = min_level
+        self.windows: typing.Dict[typing.Tuple[str, str], typing.List[float]] = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < self.min_level:
+            return True
+
+        key = (record.name, str(record.msg))
+        now = time.monotonic()
+        with self.lock:
+            window = self.windows.get(key)
+            if window is None or now - window[0] >= RATE_LIMIT_WINDOW_SECONDS:
+                suppressed = int(window[2]) if window else 0
+                self.windows[key] = [now, 1, 0]
+            elif window[1] < RATE_LIMIT_MAX_RECORDS:
+                window[1] += 1
+                suppressed = 0
+            else:
+                window[2] += 1
+                return False
+
+        if suppressed:
+            record.fields = {**getattr(record, 'fields', {}), 'suppressed': suppressed}
+        return True
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+def setup_logging():
+    global _listener
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(StructuredFormatter())
+
+    log_queue: queue.Queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter())
+
+    root_logger = logging.getLogger(ROOT_LOGGER_NAME)
+    root_logger.setLevel(LOG_LEVEL)
+    root_logger.addHandler(queue_handler)
+    root_logger.propagate = False
+
+    discord_logger = logging.getLogger('discord')
+    discord_logger.setLevel(logging.INFO)
+    discord_logger.addHandler(queue_handler)
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
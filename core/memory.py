@@ -0,0 +1,256 @@
+import array
+import asyncio
+import json
+import math
+import os
+import re
+import threading
+import time
+import typing
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+from .history import HistoryEntry
+from .log import fields, get_logger
+from .offload import offload_pool
+
+logger = get_logger('memory')
+
+MEMORY_DIR = Path(os.getenv('MEMORY_DIR', 'memory'))
+MEMORY_TOP_K = int(os.getenv('MEMORY_TOP_K', '3'))
+MEMORY_MAX_ENTRIES = int(os.getenv('MEMORY_MAX_ENTRIES', '10000'))
+
+VECTOR_DIMENSIONS = 512
+ROW_BYTES = VECTOR_DIMENSIONS * 4
+MIN_SIMILARITY = 0.1
+MAX_SNIPPET_CHARS = 500
+MAX_RECALL_CHARS = 1500
+WORD_PATTERN = re.compile(r'\w{2,}', re.UNICODE)
+
+def _features(text: str) -> typing.Dict[str, int]:
+    words = WORD_PATTERN.findall(text.lower())
+    counts: typing.Dict[str, int] = {}
+    for feature in words + [f"{first} {second}" for first, second in zip(words, words[1:])]:
+        counts[feature] = counts.get(feature, 0) + 1
+    return counts
+
+def embed(text: str) -> typing.Dict[int, float]:
+    vector: typing.Dict[int, float] = {}
+    for feature, count in _features(text).items():
+        digest = zlib.crc32(feature.encode('utf-8'))
+        sign = -1.0 if digest & 0x80000000 else 1.0
+        index = digest % VECTOR_DIMENSIONS
+        vector[index] = vector.get(index, 0.0) + sign * (1.0 + math.log(count))
+    norm = math.sqrt(sum(value * value for value in vector.values()))
+    return {index: value / norm for index, value in vector.items() if value} if norm else {}
+
+def _snippets(turns: typing.Iterable[HistoryEntry]) -> list[str]:
+    snippets: list[str] = []
+    previous_role = None
+    for turn in turns:
+        text = turn.render_text() if turn.role == 'user' else f"Iris: {turn.text}"
+        text = text[:MAX_SNIPPET_CHARS]
+        if turn.role == 'assistant' and previous_role == 'user' and snippets:
+            snippets[-1] = f"{snippets[-1]}\n{text}"
+        elif text:
+            snippets.append(text)
+        previous_role = turn.role
+    return snippets
+
+class ChannelMemory:
+    def __init__(self, channel_id: int):
+        self.channel_id = channel_id
+        self.vectors_path = MEMORY_DIR / f"{channel_id}.f32"
+        self.snippets_path = MEMORY_DIR / f"{channel_id}.jsonl"
+        self.lock = threading.Lock()
+        self.offsets = array.array('Q')
+        self.document_frequency = np.zeros(VECTOR_DIMENSIONS, dtype=np.uint32)
+        self.count = 0
+        self._load()
+
+    def _temp_path(self, path: Path) -> Path:
+        return path.with_name(f"{path.name}.tmp")
+
+    def _recover_compaction(self):
+        vectors_temp, snippets_temp = self._temp_path(self.vectors_path), self._temp_path(self.snippets_path)
+        # Compaction writes the snippets temp file first and swaps it in first, so a lone vectors temp file is
+        # complete and only its swap was interrupted; any other leftover is a half-written compaction.
+        if vectors_temp.exists() and not snippets_temp.exists():
+            os.replace(vectors_temp, self.vectors_path)
+            return
+        vectors_temp.unlink(missing_ok=True)
+        snippets_temp.unlink(missing_ok=True)
+
+    def _load(self):
+        self._recover_compaction()
+        if not self.snippets_path.exists() or not self.vectors_path.exists():
+            return
+        with open(self.snippets_path, 'rb') as snippets_file:
+            position = 0
+            for line in snippets_file:
+                if not line.endswith(b"\n"):
+                    break
+                self.offsets.append(position)
+                position += len(line)
+        # A crash between the two appends can leave one file a row ahead; both are cut back to the shorter one
+        # so the next append lands on the same row in each.
+        self.count = min(len(self.offsets), self.vectors_path.stat().st_size // ROW_BYTES)
+        vectors_size = self.count * ROW_BYTES
+        snippets_size = self.offsets[self.count] if self.count < len(self.offsets) else position
+        if self.vectors_path.stat().st_size != vectors_size or self.snippets_path.stat().st_size != snippets_size:
+            os.truncate(self.vectors_path, vectors_size)
+            os.truncate(self.snippets_path, snippets_size)
+            logger.warning("Trimmed a partial write from channel memory", extra=fields(channel=self.channel_id, rows=self.count))
+        del self.offsets[self.count:]
+        if self.count:
+            self.document_frequency = np.count_nonzero(self._matrix(), axis=0).astype(np.uint32)
+
+    def _matrix(self) -> np.memmap:
+        return np.memmap(self.vectors_path, dtype='<f4', mode='r', shape=(self.count, VECTOR_DIMENSIONS))
+
+    def _encode_lines(self, snippets: list[str]) -> list[bytes]:
+        return [(json.dumps({'at': int(time.time()), 'text': snippet}, ensure_ascii=False) + "\n").encode('utf-8') for snippet in snippets]
+
+    def _index_rows(self, lines: list[bytes], vectors: np.ndarray, position: int):
+        self.document_frequency += np.count_nonzero(vectors, axis=0).astype(np.uint32)
+        for line in lines:
+            self.offsets.append(position)
+            position += len(line)
+        self.count += len(lines)
+
+    def _write_rows(self, snippets: list[str], vectors: np.ndarray):
+        lines = self._encode_lines(snippets)
+        MEMORY_DIR.mkdir(parents=True, exist_ok=True)
+        position = self.snippets_path.stat().st_size if self.snippets_path.exists() else 0
+        with open(self.vectors_path, 'ab') as vectors_file:
+            vectors.astype('<f4', copy=False).tofile(vectors_file)
+        with open(self.snippets_path, 'ab') as snippets_file:
+            snippets_file.writelines(lines)
+        self._index_rows(lines, vectors, position)
+
+    def _compact(self):
+        keep = MEMORY_MAX_ENTRIES * 3 // 4
+        first = self.count - keep
+        vectors = np.array(self._matrix()[first:])
+        lines = self._encode_lines(self._read_snippets(range(first, self.count)))
+
+        # Both files are rebuilt beside the live ones and swapped in; _recover_compaction relies on this order.
+        vectors_temp, snippets_temp = self._temp_path(self.vectors_path), self._temp_path(self.snippets_path)
+        with open(snippets_temp, 'wb') as snippets_file:
+            snippets_file.writelines(lines)
+        with open(vectors_temp, 'wb') as vectors_file:
+            vectors.astype('<f4', copy=False).tofile(vectors_file)
+        os.replace(snippets_temp, self.snippets_path)
+        os.replace(vectors_temp, self.vectors_path)
+
+        self.offsets = array.array('Q')
+        self.document_frequency = np.zeros(VECTOR_DIMENSIONS, dtype=np.uint32)
+        self.count = 0
+        self._index_rows(lines, vectors, 0)
+        logger.info("Compacted channel memory", extra=fields(channel=self.channel_id, dropped=first, kept=keep))
+
+    def _read_snippets(self, rows: typing.Iterable[int]) -> list[str]:
+        snippets = []
+        with open(self.snippets_path, 'rb') as snippets_file:
+            for row in rows:
+                snippets_file.seek(self.offsets[row])
+                snippets.append(json.loads(snippets_file.readline())['text'])
+        return snippets
+
+    def add(self, snippets: list[str]):
+        rows = [(snippet, vector) for snippet in snippets if (vector := embed(snippet))]
+        if not rows:
+            return
+        vectors = np.zeros((len(rows), VECTOR_DIMENSIONS), dtype='<f4')
+        for row, (_, vector) in enumerate(rows):
+            vectors[row, list(vector.keys())] = list(vector.values())
+        with self.lock:
+            self._write_rows([snippet for snippet, _ in rows], vectors)
+            if self.count > MEMORY_MAX_ENTRIES:
+                self._compact()
+
+    def _query_weights(self, query: str) -> typing.Dict[int, float]:
+        # IDF is applied on the query side only, so stored rows never need rewriting as the channel grows.
+        weights = {
+            index: value * math.log((1 + self.count) / (1 + int(self.document_frequency[index])))
+            for index, value in embed(query).items()
+        }
+        norm = math.sqrt(sum(value * value for value in weights.values()))
+        return {index: value / norm for index, value in weights.items()} if norm else {}
+
+    def search(self, query: str, top_k: int) -> list[str]:
+        with self.lock:
+            if not self.count:
+                return []
+            weights = self._query_weights(query)
+            if not weights:
+                return []
+            columns = np.fromiter(weights.keys(), dtype=np.intp)
+            scores = self._matrix()[:, columns] @ np.fromiter(weights.values(), dtype=np.float32)
+            best = np.argsort(scores)[::-1][:top_k].tolist()
+            return self._read_snippets(row for row in best if scores[row] >= MIN_SIMILARITY)
+
+    def clear(self):
+        with self.lock:
+            self.vectors_path.unlink(missing_ok=True)
+            self.snippets_path.unlink(missing_ok=True)
+            self.offsets = array.array('Q')
+            self.document_frequency = np.zeros(VECTOR_DIMENSIONS, dtype=np.uint32)
+            self.count = 0
+
+class LongTermMemory:
+    def __init__(self):
+        self.channels: typing.Dict[int, ChannelMemory] = {}
+        self.lock = threading.Lock()
+        self.tasks: typing.Set[asyncio.Task] = set()
+
+    def _channel(self, channel_id: int) -> ChannelMemory:
+        with self.lock:
+            if channel_id not in self.channels:
+                self.channels[channel_id] = ChannelMemory(channel_id)
+            return self.channels[channel_id]
+
+    def size(self, channel_id: int) -> int:
+        if channel_id in self.channels:
+            return self.channels[channel_id].count
+        vectors_path = MEMORY_DIR / f"{channel_id}.f32"
+        return vectors_path.stat().st_size // ROW_BYTES if vectors_path.exists() else 0
+
+    def store(self, channel_id: int, turns: list[HistoryEntry]):
+        self._channel(channel_id).add(_snippets(turns))
+
+    def search(self, channel_id: int, query: str, top_k: int = MEMORY_TOP_K) -> list[str]:
+        return self._channel(channel_id).search(query, top_k)
+
+    def clear(self, channel_id: int):
+        self._channel(channel_id).clear()
+
+    def schedule_store(self, channel_id: int, turns: list[HistoryEntry]):
+        if not turns:
+            return
+        task = asyncio.create_task(self._store(channel_id, turns))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _store(self, channel_id: int, turns: list[HistoryEntry]):
+        try:
+            # Always offloaded: store and search share the channel lock, which must never be taken on the loop.
+            await offload_pool.run('memory_store', self.store, channel_id, turns, size=None)
+        except Exception as e:
+            logger.error("Error storing channel memory: %s", e, extra=fields(channel=channel_id))
+
+    async def recall(self, channel_id: int, query: str) -> typing.Optional[str]:
+        if not query.strip():
+            return None
+        try:
+            snippets = await offload_pool.run('memory_search', self.search, channel_id, query, size=None)
+        except Exception as e:
+            logger.error("Error searching channel memory: %s", e, extra=fields(channel=channel_id))
+            return None
+        if not snippets:
+            return None
+        return "\n".join(f"- {snippet}" for snippet in snippets)[:MAX_RECALL_CHARS]
+
+long_term_memory = LongTermMemory()
@@ -0,0 +1,73 @@
+import asyncio
+import concurrent.futures
+import os
+import time
+import typing
+
+from .log import fields, get_logger
+
+logger = get_logger('offload')
+
+OFFLOAD_INLINE_BYTES = int(os.getenv('OFFLOAD_INLINE_BYTES', str(64 * 1024)))
+OFFLOAD_THREADS = int(os.getenv('OFFLOAD_THREADS', '2'))
+OFFLOAD_PROCESSES = int(os.getenv('OFFLOAD_PROCESSES', '0'))
+OFFLOAD_MAX_QUEUED = int(os.getenv('OFFLOAD_MAX_QUEUED', '16'))
+
+T = typing.TypeVar('T')
+
+def _timed_call(func: typing.Callable[..., T], *args) -> typing.Tuple[T, float]:
+    started_at = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started_at
+
+class OffloadStats:
+    __slots__ = ('inline', 'offloaded', 'inline_seconds', 'worker_seconds', 'wait_seconds')
+
+    def __init__(self):
+        self.inline = 0
+        self.offloaded = 0
+        self.inline_seconds = 0.0
+        self.worker_seconds = 0.0
+        self.wait_seconds = 0.0
+
+class OffloadPool:
+    def __init__(self):
+        self.thread_executor: typing.Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self.process_executor: typing.Optional[concurrent.futures.ProcessPoolExecutor] = None
+        self.slots: typing.Optional[asyncio.Semaphore] = None
+        self.stats: typing.Dict[str, OffloadStats] = {}
+
+    def _executor(self, picklable: bool) -> concurrent.futures.Executor:
+        if picklable and OFFLOAD_PROCESSES > 0:
+            if self.process_executor is None:
+                self.process_executor = concurrent.futures.ProcessPoolExecutor(max_workers=OFFLOAD_PROCESSES)
+            return self.process_executor
+        if self.thread_executor is None:
+            self.thread_executor = concurrent.futures.ThreadPoolExecutor(max_workers=OFFLOAD_THREADS, thread_name_prefix='offload')
+        return self.thread_executor
+
+    async def run(self, label: str, func: typing.Callable[..., T], *args, size: typing.Optional[int], picklable: bool = False) -> T:
+        stats = self.stats.setdefault(label, OffloadStats())
+        # size=None is for work that must never run on the loop, whatever its size.
+        if size is not None and size < OFFLOAD_INLINE_BYTES:
+            result, seconds = _timed_call(func, *args)
+            stats.inline += 1
+            stats.inline_seconds += seconds
+            return result
+
+        if self.slots is None:
+            # Bounds running plus queued jobs so a burst of uploads waits here instead of piling up in the executor.
+            self.slots = asyncio.Semaphore(max(1, OFFLOAD_THREADS + OFFLOAD_PROCESSES) + OFFLOAD_MAX_QUEUED)
+        queued_at = time.perf_counter()
+        async with self.slots:
+            submitted_at = time.perf_counter()
+            result, seconds = await asyncio.get_running_loop().run_in_executor(self._executor(picklable), _timed_call, func, *args)
+
+        stats.offloaded += 1
+        stats.worker_seconds += seconds
+        stats.wait_seconds += (time.perf_counter() - queued_at) - seconds
+        if submitted_at - queued_at > 1:
+            logger.warning("Offload queue is saturated", extra=fields(label=label, waited_ms=round((submitted_at - queued_at) * 1000)))
+        return result
+
+offload_pool = OffloadPool()
@@ -1,76 +1,148 @@
-import os
+import asyncio
 import time
-from typing import Any, Dict, Optional, Set
+from typing import Any, Dict, Optional, Tuple
 
 import aiohttp
-from openai import AsyncOpenAI, OpenAIError
 
-OPENROUTER_API_KEY = os.getenv('OPENROUTER_API_KEY')
+from .backends import DEFAULT_BACKEND, Backend, backend_registry
+from .credentials import APICredential
+from .log import fields, get_logger
+
+logger = get_logger('openrouter_models')
+
+CATALOG_TIMEOUT_SECONDS = 15
 
 class OpenRouterModelInfo:
     _instance = None
-    _cache: Optional[Dict[str, Any]] = None
-    _cache_timestamp: float = 0
     _cache_duration_seconds: int = 3600 * 24
-    _system_prompt_support_cache: Dict[str, bool] = {}
 
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super(OpenRouterModelInfo, cls).__new__(cls)
+            cls._instance._catalogs: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+            cls._instance._catalog_fetches = {}
+            cls._instance._system_prompt_support_cache = {}
+            cls._instance._image_input_cache = {}
+            cls._instance._reasoning_cache = {}
+            cls._instance._system_prompt_probes = {}
         return cls._instance
 
-    async def _fetch_models_from_api(self) -> None:
-        print("Fetching latest model data from OpenRouter API...")
+    def _store_catalog(self, backend: Backend, models: Dict[str, Any]):
+        self._catalogs[backend.name] = (time.time(), models)
+        self._image_input_cache = {}
+        self._reasoning_cache = {}
+
+    async def _fetch_models_from_api(self, backend: Backend) -> None:
+        if (static_models := backend.static_catalog()) is not None:
+            self._store_catalog(backend, static_models)
+            return
+
+        logger.info("Fetching latest model data...", extra=fields(backend=backend.name))
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get("https://openrouter.ai/api/v1/models") as response:
+            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=CATALOG_TIMEOUT_SECONDS)) as session:
+                async with session.get(f"{backend.pool.connection.base_url}/models", headers=backend.catalog_headers()) as response:
                     if response.status == 200:
-                        data = await response.json()
-                        self._cache = {model['id']: model for model in data.get('data', [])}
-                        self._cache_timestamp = time.time()
-                        print("Successfully fetched and cached model data.")
+                        models = backend.normalize_catalog(await response.json())
+                        self._store_catalog(backend, models)
+                        logger.info("Successfully fetched and cached model data.", extra=fields(backend=backend.name, models=len(models)))
+                    else:
+                        logger.warning("Model catalog request failed", extra=fields(backend=backend.name, status=response.status))
         except Exception as e:
-            print(f"An exception occurred while fetching model data: {e}")
+            logger.error("An exception occurred while fetching model data: %s", e, extra=fields(backend=backend.name))
 
-    async def get_all_models(self) -> Optional[Dict[str, Any]]:
-        is_cache_expired = (time.time() - self._cache_timestamp) > self._cache_duration_seconds
-        if self._cache is None or is_cache_expired:
-            await self._fetch_models_from_api()
-        return self._cache
+    async def get_all_models(self, backend_name: str = DEFAULT_BACKEND) -> Optional[Dict[str, Any]]:
+        backend = backend_registry.get(backend_name) or backend_registry.default
+        fetched_at, models = self._catalogs.get(backend.name, (0.0, None))
+        if models is None or (time.time() - fetched_at) > self._cache_duration_seconds:
+            # Capability lookups for one request run concurrently, so they share a single catalog fetch.
+            fetch = self._catalog_fetches.get(backend.name)
+            if fetch is None:
+                fetch = asyncio.ensure_future(self._fetch_models_from_api(backend))
+                self._catalog_fetches[backend.name] = fetch
+                fetch.add_done_callback(lambda _: self._catalog_fetches.pop(backend.name, None))
+            await asyncio.shield(fetch)
+            fetched_at, models = self._catalogs.get(backend.name, (0.0, None))
+        return models
 
     async def get_model_details(self, model_id: str) -> Optional[Dict[str, Any]]:
-        models = await self.get_all_models()
-        return models.get(model_id) if models else None
+        backend, backend_model_id = backend_registry.resolve(model_id)
+        models = await self.get_all_models(backend.name)
+        return models.get(backend.model_ref(backend_model_id)) if models else None
+
+    async def supports_image_input(self, model_id: str) -> bool:
+        if model_id in self._image_input_cache:
+            return self._image_input_cache[model_id]
+        details = await self.get_model_details(model_id)
+        if details is None:
+            return False
+
+        input_modalities = details.get('architecture', {}).get('input_modalities') or []
+        self._image_input_cache[model_id] = 'image' in input_modalities
+        return self._image_input_cache[model_id]
+
+    async def supports_reasoning(self, model_id: str) -> bool:
+        if model_id in self._reasoning_cache:
+            return self._reasoning_cache[model_id]
+        details = await self.get_model_details(model_id)
+        if details is None:
+            return False
+
+        supported_parameters = details.get('supported_parameters') or []
+        self._reasoning_cache[model_id] = 'reasoning' in supported_parameters or 'include_reasoning' in supported_parameters
+        return self._reasoning_cache[model_id]
 
     async def test_system_prompt_support(self, model_id: str) -> bool:
         if model_id in self._system_prompt_support_cache:
             return self._system_prompt_support_cache[model_id]
+        backend, _ = backend_registry.resolve(model_id)
+        if backend.system_prompt is not None:
+            return backend.system_prompt
+
+        # Concurrent callers share one probe; shielded so a cancelled reply doesn't abort it for the others.
+        probe = self._system_prompt_probes.get(model_id)
+        if probe is None:
+            probe = asyncio.ensure_future(self._probe_system_prompt(model_id))
+            self._system_prompt_probes[model_id] = probe
+            probe.add_done_callback(lambda _: self._system_prompt_probes.pop(model_id, None))
+        return await asyncio.shield(probe)
+
+    async def _probe_system_prompt(self, model_id: str) -> bool:
+        backend, backend_model_id = backend_registry.resolve(model_id)
+        with backend.pool.lease(None) as credential:
+            if credential is None:
+                logger.warning("No API key available for the system prompt test, result not cached", extra=fields(model=model_id))
+                return False
+            return await self._run_system_prompt_test(model_id, backend, backend_model_id, credential)
+
+    async def _run_system_prompt_test(self, model_id: str, backend: Backend, backend_model_id: str, credential: APICredential) -> bool:
+        from openai import APIConnectionError, OpenAIError
+
+        logger.info("Performing live system prompt test", extra=fields(model=model_id, key=credential.name))
 
-        print(f"Performing live system prompt test for model: {model_id}...")
-        
-        test_client = AsyncOpenAI(
-            api_key=OPENROUTER_API_KEY,
-            base_url="https://openrouter.ai/api/v1"
-        )
-        
         try:
-            await test_client.chat.completions.create(
-                model=model_id,
+            await credential.get_client().chat.completions.create(
+                model=backend_model_id,
                 messages=[
                     {"role": "system", "content": "Test prompt."},
                     {"role": "user", "content": "Hello."}
                 ],
                 max_tokens=5
             )
-            print(f"Test PASSED for {model_id}. System prompt is supported.")
+            logger.info("System prompt test passed, system prompt is supported", extra=fields(model=model_id))
             self._system_prompt_support_cache[model_id] = True
             return True
+        except APIConnectionError as e:
+            logger.warning("Could not reach the backend for the system prompt test, result not cached: %s", e, extra=fields(model=model_id, backend=backend.name))
+            return False
         except OpenAIError as e:
-            print(f"Test FAILED for {model_id}. System prompt is not supported. Error: {e.status_code}")
+            if backend.pool.report_error(credential, e):
+                logger.warning("System prompt test hit a rate limit or temporary error, result not cached", extra=fields(model=model_id, key=credential.name))
+                return False
+            logger.info("System prompt test failed, system prompt is not supported", extra=fields(model=model_id, status=getattr(e, 'status_code', None)))
             self._system_prompt_support_cache[model_id] = False
             return False
         except Exception as e:
-            print(f"An unexpected error occurred during system prompt test for {model_id}: {e}")
+            logger.error("An unexpected error occurred during the system prompt test: %s", e, extra=fields(model=model_id))
             self._system_prompt_support_cache[model_id] = False
             return False
 
@@ -0,0 +1,150 @@
+import asyncio
+import time
+import typing
+
+from . import database_manager
+
+MINUTE_SECONDS = 60
+DAY_SECONDS = 24 * 60 * 60
+REFUSAL_NOTICE_COOLDOWN_SECONDS = 60
+
+QUOTA_SETTINGS = {
+    ('guild', 'rpm'): ('guild_requests_per_minute', MINUTE_SECONDS),
+    ('guild', 'tpd'): ('guild_tokens_per_day', DAY_SECONDS),
+    ('user', 'rpm'): ('user_requests_per_minute', MINUTE_SECONDS),
+    ('user', 'tpd'): ('user_tokens_per_day', DAY_SECONDS),
+}
+
+class TokenBucket:
+    __slots__ = ('capacity', 'period_seconds', 'tokens', 'updated_at')
+
+    def __init__(self, capacity: int, period_seconds: int, tokens: typing.Optional[float] = None, updated_at: typing.Optional[float] = None):
+        self.capacity = capacity
+        self.period_seconds = period_seconds
+        self.tokens = float(capacity) if tokens is None else min(tokens, capacity)
+        self.updated_at = updated_at or time.time()
+
+    def refill(self, now: float):
+        elapsed = max(0.0, now - self.updated_at)
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.capacity / self.period_seconds)
+        self.updated_at = now
+
+    def is_full(self, now: float) -> bool:
+        self.refill(now)
+        return self.tokens >= self.capacity
+
+    def retry_after(self, amount: float) -> float:
+        missing = amount - self.tokens
+        if missing <= 0:
+            return 0.0
+        return missing * self.period_seconds / self.capacity
+
+class QuotaDecision(typing.NamedTuple):
+    allowed: bool
+    scope: typing.Optional[str] = None
+    kind: typing.Optional[str] = None
+    retry_after: float = 0.0
+
+class QuotaManager:
+    def __init__(self):
+        self.buckets: typing.Dict[str, TokenBucket] = {}
+        self._last_refusal_notice: typing.Dict[typing.Tuple[int, int], float] = {}
+        # Set in worker processes: the gateway admits requests and owns the buckets, so workers only collect charges for it.
+        self.forward_charges = False
+        self.pending_charges: list[typing.Tuple[int, int, int]] = []
+
+    def _bucket_key(self, scope: str, kind: str, guild_id: int, user_id: int) -> str:
+        if scope == 'guild':
+            return f"guild:{guild_id}:{kind}"
+        return f"user:{guild_id}:{user_id}:{kind}"
+
+    def _get_bucket(self, scope: str, kind: str, guild_id: int, user_id: int, guild_cfg: dict) -> typing.Optional[TokenBucket]:
+        setting_key, period_seconds = QUOTA_SETTINGS[(scope, kind)]
+        capacity = guild_cfg.get(setting_key) or 0
+        if capacity <= 0:
+            return None
+
+        key = self._bucket_key(scope, kind, guild_id, user_id)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(capacity, period_seconds)
+        elif bucket.capacity != capacity:
+            bucket.capacity = capacity
+            bucket.tokens = min(bucket.tokens, capacity)
+        return bucket
+
+    def check_request(self, guild_id: int, user_id: int, guild_cfg: dict) -> QuotaDecision:
+        if self.forward_charges:
+            return QuotaDecision(True)
+        now = time.time()
+        request_buckets = []
+
+        for (scope, kind) in QUOTA_SETTINGS:
+            bucket = self._get_bucket(scope, kind, guild_id, user_id, guild_cfg)
+            if bucket is None:
+                continue
+            bucket.refill(now)
+
+            if kind == 'rpm':
+                if bucket.tokens < 1:
+                    return QuotaDecision(False, scope, kind, bucket.retry_after(1))
+                request_buckets.append(bucket)
+            elif bucket.tokens <= 0:
+                return QuotaDecision(False, scope, kind, bucket.retry_after(1))
+
+        for bucket in request_buckets:
+            bucket.tokens -= 1
+        return QuotaDecision(True)
+
+    def charge_tokens(self, guild_id: int, user_id: int, guild_cfg: dict, tokens: int):
+        if not tokens:
+            return
+        if self.forward_charges:
+            self.pending_charges.append((guild_id, user_id, tokens))
+            return
+        now = time.time()
+        for scope in ('guild', 'user'):
+            bucket = self._get_bucket(scope, 'tpd', guild_id, user_id, guild_cfg)
+            if bucket is not None:
+                bucket.refill(now)
+                bucket.tokens -= tokens
+
+    def take_charges(self) -> list[typing.Tuple[int, int, int]]:
+        charges, self.pending_charges = self.pending_charges, []
+        return charges
+
+    def get_remaining(self, scope: str, kind: str, guild_id: int, user_id: int, guild_cfg: dict) -> typing.Optional[int]:
+        bucket = self._get_bucket(scope, kind, guild_id, user_id, guild_cfg)
+        if bucket is None:
+            return None
+        bucket.refill(time.time())
+        return int(bucket.tokens)
+
+    def should_notify_refusal(self, guild_id: int, user_id: int) -> bool:
+        now = time.monotonic()
+        key = (guild_id, user_id)
+        if now - self._last_refusal_notice.get(key, float('-inf')) < REFUSAL_NOTICE_COOLDOWN_SECONDS:
+            return False
+        self._last_refusal_notice[key] = now
+        return True
+
+    async def save_checkpoint(self):
+        now = time.time()
+        full_keys = [key for key, bucket in self.buckets.items() if bucket.is_full(now)]
+        for key in full_keys:
+            del self.buckets[key]
+
+        cutoff = time.monotonic() - REFUSAL_NOTICE_COOLDOWN_SECONDS
+        self._last_refusal_notice = {key: ts for key, ts in self._last_refusal_notice.items() if ts >= cutoff}
+
+        # Buckets are snapshotted on the loop that mutates them; only the write runs in a thread.
+        rows = [(key, bucket.capacity, bucket.tokens, bucket.updated_at) for key, bucket in self.buckets.items()]
+        await asyncio.to_thread(database_manager.save_quota_buckets, rows)
+
+    def load_checkpoint(self):
+        for key, capacity, tokens, updated_at in database_manager.load_quota_buckets():
+            kind = key.rsplit(':', 1)[-1]
+            period_seconds = MINUTE_SECONDS if kind == 'rpm' else DAY_SECONDS
+            self.buckets[key] = TokenBucket(capacity, period_seconds, tokens, updated_at)
+
+quota_manager = QuotaManager()
@@ -0,0 +1,65 @@
+import re
+import typing
+
+REASONING_EFFORTS = ('minimal', 'low', 'medium', 'high')
+REASONING_MODES = ('auto', 'model', 'off') + REASONING_EFFORTS
+MIN_REASONING_TOKENS = 128
+MAX_REASONING_TOKENS = 32000
+
+SHORT_QUESTION_WORDS = 25
+SHORT_QUESTION_EFFORT = 'low'
+MAX_SHOWN_REASONING_CHARS = 1500
+
+THINK_BLOCK_PATTERN = re.compile(r'<think>(.*?)(?:</think>|$)', re.DOTALL | re.IGNORECASE)
+CLOSING_THINK_TAG = '</think>'
+# Models whose chat template opens the <think> block in the prompt, so the reply only carries the closing tag.
+OPEN_TAG_DROPPING_MODELS = ('deepseek-r1', 'qwq', 'qwen3')
+
+def parse_reasoning_setting(value: str) -> typing.Optional[typing.Tuple[str, typing.Optional[int]]]:
+    value = value.strip().lower()
+    if value in REASONING_MODES:
+        return value, None
+    if value.isdigit() and MIN_REASONING_TOKENS <= int(value) <= MAX_REASONING_TOKENS:
+        return 'tokens', int(value)
+    return None
+
+def describe_reasoning_setting(effort: str, max_tokens: typing.Optional[int]) -> str:
+    return f"{max_tokens} tokens" if effort == 'tokens' and max_tokens else effort
+
+def is_short_question(text: str, has_attachments: bool) -> bool:
+    return not has_attachments and '```' not in text and len(text.split()) <= SHORT_QUESTION_WORDS
+
+def build_reasoning_options(effort: str, max_tokens: typing.Optional[int], show: bool, short_question: bool) -> typing.Optional[dict]:
+    if effort == 'off':
+        return {'enabled': False}
+
+    options: dict = {}
+    if effort == 'tokens' and max_tokens:
+        options['max_tokens'] = max_tokens
+    elif effort in REASONING_EFFORTS:
+        options['effort'] = effort
+    elif effort == 'auto' and short_question:
+        options['effort'] = SHORT_QUESTION_EFFORT
+    if not show:
+        options['exclude'] = True
+    return options or None
+
+def drops_opening_think_tag(model_id: str) -> bool:
+    model_id = model_id.lower()
+    return any(name in model_id for name in OPEN_TAG_DROPPING_MODELS)
+
+def split_reasoning(text: str, missing_open_tag: bool = False) -> typing.Tuple[str, str]:
+    reasoning_parts: list[str] = []
+    # A lone closing tag only ends reasoning for models known to drop the opening one; in any other answer it is
+    # just text, e.g. an explanation of the format, and everything before it must be kept.
+    head, closing, tail = text.partition(CLOSING_THINK_TAG)
+    if missing_open_tag and closing and '<think>' not in head.lower() and head.count('`') % 2 == 0:
+        reasoning_parts.append(head)
+        text = tail
+
+    def _collect(match: re.Match) -> str:
+        reasoning_parts.append(match.group(1))
+        return ''
+
+    answer = THINK_BLOCK_PATTERN.sub(_collect, text)
+    return answer.strip(), "\n".join(part.strip() for part in reasoning_parts if part.strip())
@@ -0,0 +1,115 @@
+import json
+import math
+import os
+import re
+import typing
+
+from .log import get_logger
+
+logger = get_logger('relevance')
+
+RELEVANCE_MODEL_PATH = os.getenv('RELEVANCE_MODEL_PATH', '')
+
+RECENT_REPLY_SECONDS = 60
+ACTIVE_CONVERSATION_SECONDS = 300
+LONG_MESSAGE_WORDS = 8
+
+QUESTION_WORDS = {
+    'qué', 'cómo', 'cuándo', 'dónde', 'quién', 'cuál', 'cuánto', 'puedes', 'podrías', 'sabes',
+    'what', 'how', 'why', 'when', 'where', 'who', 'which', 'can', 'could', 'do', 'does', 'is', 'are',
+}
+FILLER_WORDS = {
+    'lol', 'lmao', 'xd', 'xdd', 'ok', 'okay', 'oki', 'k', 'si', 'sí', 'no', 'gg', 'ya', 'vale',
+    'jaja', 'jajaja', 'jeje', 'haha', 'hahaha', 'uwu', 'owo', 'f', 'nice', 'gracias', 'thanks',
+}
+CUSTOM_EMOJI_PATTERN = re.compile(r'<a?:\w+:\d+>')
+LAUGHTER_PATTERN = re.compile(r'^(?:[jh][aeiou])+[jh]?$')
+WORD_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+class RelevanceSignals(typing.NamedTuple):
+    text: str
+    bot_names: typing.Tuple[str, ...]
+    has_attachments: bool
+    is_reply_to_bot: bool
+    is_reply_to_other: bool
+    mentions_others: bool
+    seconds_since_bot_reply: typing.Optional[float]
+
+def _words(text: str) -> list[str]:
+    return WORD_PATTERN.findall(CUSTOM_EMOJI_PATTERN.sub(' ', text.lower()))
+
+def is_low_content(text: str) -> bool:
+    words = _words(text)
+    if not words:
+        return True
+    return all(word in FILLER_WORDS or LAUGHTER_PATTERN.match(word) for word in words)
+
+def decisive_score(signals: RelevanceSignals) -> typing.Optional[float]:
+    if signals.is_reply_to_bot:
+        return 1.0
+    if any(name in _words(signals.text) for name in signals.bot_names):
+        return 1.0
+    if is_low_content(signals.text) and not signals.has_attachments:
+        return 0.0
+    return None
+
+def score_heuristics(signals: RelevanceSignals) -> float:
+    words = _words(signals.text)
+    score = 0.0
+    if '?' in signals.text or (words and words[0] in QUESTION_WORDS):
+        score += 0.5
+    if signals.seconds_since_bot_reply is not None:
+        if signals.seconds_since_bot_reply < RECENT_REPLY_SECONDS:
+            score += 0.4
+        elif signals.seconds_since_bot_reply < ACTIVE_CONVERSATION_SECONDS:
+            score += 0.2
+    if signals.has_attachments:
+        score += 0.3
+    if len(words) >= LONG_MESSAGE_WORDS:
+        score += 0.1
+    if signals.mentions_others or signals.is_reply_to_other:
+        score -= 0.5
+    return max(0.0, min(1.0, score))
+
+class LinearTextScorer:
+    def __init__(self, bias: float, weights: typing.Dict[str, float]):
+        self.bias = bias
+        self.weights = weights
+
+    @classmethod
+    def from_file(cls, path: str) -> 'LinearTextScorer':
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(float(data.get('bias', 0.0)), {k: float(v) for k, v in data.get('weights', {}).items()})
+
+    def __call__(self, signals: RelevanceSignals) -> float:
+        logit = self.bias + sum(self.weights.get(word, 0.0) for word in set(_words(signals.text)))
+        return 1.0 / (1.0 + math.exp(-logit))
+
+class RelevanceGate:
+    def __init__(self):
+        self.scorers: list[typing.Callable[[RelevanceSignals], float]] = []
+        if RELEVANCE_MODEL_PATH:
+            try:
+                self.register_scorer(LinearTextScorer.from_file(RELEVANCE_MODEL_PATH))
+                logger.info("Loaded relevance scoring model from %s", RELEVANCE_MODEL_PATH)
+            except (OSError, ValueError) as e:
+                logger.error("Could not load relevance scoring model %s: %s", RELEVANCE_MODEL_PATH, e)
+
+    def register_scorer(self, scorer: typing.Callable[[RelevanceSignals], float]):
+        self.scorers.append(scorer)
+
+    def score(self, signals: RelevanceSignals) -> float:
+        decisive = decisive_score(signals)
+        if decisive is not None:
+            return decisive
+
+        scores = [score_heuristics(signals)]
+        for scorer in self.scorers:
+            try:
+                scores.append(scorer(signals))
+            except Exception as e:
+                logger.error("Relevance scorer %s failed: %s", type(scorer).__name__, e)
+        return sum(scores) / len(scores)
+
+relevance_gate = RelevanceGate()
@@ -0,0 +1,157 @@
+import asyncio
+import importlib
+import sys
+import time
+import typing
+
+from discord.ext import commands
+
+from .log import fields, get_logger
+
+logger = get_logger('reloader')
+
+DRAIN_TIMEOUT_SECONDS = 60
+
+# Dependency order: a module is reloaded after everything it imports names from.
+RELOADABLE_MODULES = (
+    'core.config',
+    'core.history',
+    'core.attachments',
+    'core.reasoning',
+    'core.credentials',
+    'core.backends',
+    'core.job_queue',
+    'core.offload',
+    'core.database_manager',
+    'core.openrouter_models',
+    'core.contexts',
+    'core.quotas',
+    'core.summarizer',
+    'core.memory',
+    'core.relevance',
+    'core.traffic',
+    'core.speculation',
+    'core.tracing',
+    'core.ai_handler',
+    'core.startup',
+    'utils',
+)
+
+PRESERVED_STATE = {
+    'core.config': ('config_manager',),
+    'core.credentials': ('credential_pool',),
+    'core.job_queue': ('job_queue',),
+    'core.offload': ('offload_pool',),
+    'core.openrouter_models': ('model_info_manager',),
+    'core.contexts': ('context_manager',),
+    'core.quotas': ('quota_manager',),
+    'core.summarizer': ('history_summarizer',),
+    'core.memory': ('long_term_memory',),
+    'core.relevance': ('relevance_gate',),
+    'core.traffic': ('traffic_recorder',),
+    'core.speculation': ('speculative_warmer',),
+}
+
+class ReloadReport(typing.NamedTuple):
+    drained: int
+    still_running: int
+    modules: list[str]
+    extensions: list[str]
+    errors: list[str]
+    seconds: float
+
+def _adopt_class(obj: typing.Any, new_class: type):
+    if type(obj) is new_class or type(obj).__name__ != new_class.__name__:
+        return
+    try:
+        obj.__class__ = new_class
+    except TypeError as e:
+        logger.warning("Keeping old class for %s instance: %s", type(obj).__name__, e)
+
+class ReloadCoordinator:
+    def __init__(self):
+        self.accepting_requests = asyncio.Event()
+        self.accepting_requests.set()
+        self.lock = asyncio.Lock()
+
+    async def wait_until_ready(self):
+        await self.accepting_requests.wait()
+
+    def _in_flight_tasks(self) -> list[asyncio.Task]:
+        context_manager = sys.modules['core.contexts'].context_manager
+        return [
+            task
+            for channel_context in context_manager.channel_contexts.values()
+            for task in channel_context.active_requests.values()
+            if not task.done()
+        ]
+
+    async def _drain(self) -> typing.Tuple[int, int]:
+        tasks = self._in_flight_tasks()
+        if not tasks:
+            return 0, 0
+        logger.info("Draining in-flight AI requests before reload...", extra=fields(requests=len(tasks)))
+        done, pending = await asyncio.wait(tasks, timeout=DRAIN_TIMEOUT_SECONDS)
+        return len(done), len(pending)
+
+    def _reload_module(self, module_name: str):
+        module = sys.modules.get(module_name)
+        if module is None:
+            importlib.import_module(module_name)
+            return
+
+        preserved = {name: getattr(module, name) for name in PRESERVED_STATE.get(module_name, ()) if hasattr(module, name)}
+        try:
+            importlib.reload(module)
+        finally:
+            for name, state in preserved.items():
+                fresh = getattr(module, name, None)
+                if fresh is not None and fresh is not state:
+                    _adopt_class(state, type(fresh))
+                setattr(module, name, state)
+
+    def _adopt_live_objects(self):
+        contexts = sys.modules['core.contexts']
+        history = sys.modules['core.history']
+        model_info = sys.modules['core.openrouter_models']
+        model_info.OpenRouterModelInfo._instance = model_info.model_info_manager
+        # backends.json is read again on reload, so catalogs fetched with the old backend settings are dropped.
+        for backend_name in [name for name in model_info.model_info_manager._catalogs if name != sys.modules['core.backends'].DEFAULT_BACKEND]:
+            del model_info.model_info_manager._catalogs[backend_name]
+
+        for channel_context in contexts.context_manager.channel_contexts.values():
+            _adopt_class(channel_context, contexts.ChannelContext)
+            for entry in channel_context.history:
+                _adopt_class(entry, history.HistoryEntry)
+
+    async def reload(self, bot: commands.Bot) -> ReloadReport:
+        async with self.lock:
+            started_at = time.perf_counter()
+            self.accepting_requests.clear()
+            modules, extensions, errors = [], [], []
+            try:
+                drained, still_running = await self._drain()
+
+                for module_name in RELOADABLE_MODULES:
+                    try:
+                        self._reload_module(module_name)
+                        modules.append(module_name)
+                    except Exception as e:
+                        errors.append(f"{module_name}: {type(e).__name__} - {e}")
+                        break
+                else:
+                    self._adopt_live_objects()
+                    bot.command_prefix = sys.modules['utils'].get_prefix
+
+                    for extension_name in list(bot.extensions):
+                        try:
+                            await bot.reload_extension(extension_name)
+                            extensions.append(extension_name)
+                        except Exception as e:
+                            errors.append(f"{extension_name}: {type(e).__name__} - {e}")
+            finally:
+                self.accepting_requests.set()
+
+            return ReloadReport(drained, still_running, modules, extensions, errors, time.perf_counter() - started_at)
+
+reload_coordinator = ReloadCoordinator()
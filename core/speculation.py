@@ -0,0 +1,103 @@
+import asyncio
+import collections
+import os
+import time
+import typing
+
+from .backends import backend_registry
+from .config import config_manager
+from .contexts import ChannelContext
+from .history import HistoryEntry
+from .log import fields, get_logger
+from .offload import offload_pool
+from .openrouter_models import model_info_manager
+
+logger = get_logger('speculation')
+
+SPECULATIVE_WARMUP = os.getenv('SPECULATIVE_WARMUP', 'true').lower() in ('1', 'true', 'yes')
+SPECULATIVE_WARMUP_COOLDOWN_SECONDS = float(os.getenv('SPECULATIVE_WARMUP_COOLDOWN', '30'))
+SPECULATIVE_WARMUPS_PER_MINUTE = int(os.getenv('SPECULATIVE_WARMUPS_PER_MINUTE', '30'))
+RECENT_MENTION_SECONDS = 300
+
+def _cache_wire_json(entries: list[HistoryEntry]):
+    for entry in entries:
+        entry.to_json()
+
+class SpeculativeWarmer:
+    def __init__(self, enabled: bool = SPECULATIVE_WARMUP):
+        self.enabled = enabled
+        self.last_warmed_at: typing.Dict[int, float] = {}
+        self.recent_warmups: typing.Deque[float] = collections.deque()
+        self.connection_warmed_at: typing.Dict[typing.Tuple[str, str], float] = {}
+        self.tasks: typing.Set[asyncio.Task] = set()
+        self.stats = collections.Counter()
+
+    def is_candidate(self, channel_context: ChannelContext, now: float) -> bool:
+        if channel_context.settings.get('natural_conversation'):
+            return True
+        return channel_context.last_mention_at is not None and now - channel_context.last_mention_at < RECENT_MENTION_SECONDS
+
+    def schedule(self, guild_id: int, channel_context: ChannelContext) -> bool:
+        now = time.monotonic()
+        if not self.enabled or not self.is_candidate(channel_context, now):
+            return False
+
+        last_warmed_at = self.last_warmed_at.get(channel_context.channel_id)
+        if last_warmed_at is not None and now - last_warmed_at < SPECULATIVE_WARMUP_COOLDOWN_SECONDS:
+            self.stats['cooldown'] += 1
+            return False
+        while self.recent_warmups and now - self.recent_warmups[0] >= 60:
+            self.recent_warmups.popleft()
+        if SPECULATIVE_WARMUPS_PER_MINUTE > 0 and len(self.recent_warmups) >= SPECULATIVE_WARMUPS_PER_MINUTE:
+            self.stats['rate_limited'] += 1
+            return False
+
+        self.last_warmed_at[channel_context.channel_id] = now
+        self.recent_warmups.append(now)
+        task = asyncio.create_task(self._warm(guild_id, channel_context))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return True
+
+    async def _warm(self, guild_id: int, channel_context: ChannelContext):
+        started_at = time.perf_counter()
+        guild_cfg = config_manager.get_guild_config(guild_id)
+        model_name = channel_context.settings.get('model') or guild_cfg.get('model')
+        try:
+            await asyncio.gather(
+                model_info_manager.test_system_prompt_support(model_name),
+                model_info_manager.supports_image_input(model_name),
+                self._warm_connection(guild_id, model_name),
+            )
+            channel_context.get_system_prompt_message()
+            history = list(channel_context.history)
+            await offload_pool.run('warm_history', _cache_wire_json, history, size=sum(entry.serialization_size for entry in history))
+        except Exception as e:
+            self.stats['failed'] += 1
+            logger.warning("Speculative warm-up failed: %s - %s", type(e).__name__, e, extra=fields(guild=guild_id, channel=channel_context.channel_id))
+            return
+
+        self.stats['warmed'] += 1
+        logger.debug("Speculative warm-up finished", extra=fields(
+            guild=guild_id, channel=channel_context.channel_id, model=model_name, ms=round((time.perf_counter() - started_at) * 1000, 1)
+        ))
+
+    async def _warm_connection(self, guild_id: int, model_name: str):
+        backend, _ = backend_registry.resolve(model_name)
+        credential = backend.pool.acquire(guild_id)
+        if credential is None:
+            return
+
+        now = time.monotonic()
+        warmed_key = (backend.name, credential.name)
+        warmed_at = self.connection_warmed_at.get(warmed_key)
+        if warmed_at is not None and now - warmed_at < credential.connection.keepalive_seconds / 2:
+            return
+        self.connection_warmed_at[warmed_key] = now
+        try:
+            # Cheap authenticated GET that leaves a TLS connection in the key's pool for the reply to reuse.
+            await credential.get_client().get(backend.keepalive_path, cast_to=object)
+        except Exception as e:
+            logger.debug("Connection warm-up failed: %s", e, extra=fields(key=credential.name))
+
+speculative_warmer = SpeculativeWarmer()
@@ -0,0 +1,91 @@
+import asyncio
+import contextlib
+import importlib
+import time
+import typing
+
+from .backends import DEFAULT_BACKEND, Backend, backend_registry
+from .config import DEFAULT_MODEL, config_manager
+from .openrouter_models import model_info_manager
+
+MAX_CONCURRENT_PROBES = 4
+DEFERRED_IMPORTS = ('openai', 'openai.types.chat')
+
+class StartupTimer:
+    def __init__(self, started_at: float):
+        self.started_at = started_at
+        self.phases: typing.Dict[str, float] = {}
+
+    def record(self, name: str, seconds: float):
+        self.phases[name] = seconds
+
+    def mark(self, name: str):
+        self.phases[name] = time.perf_counter() - self.started_at
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        phase_started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - phase_started_at)
+
+    @contextlib.asynccontextmanager
+    async def async_phase(self, name: str):
+        phase_started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - phase_started_at)
+
+    def report(self) -> str:
+        breakdown = ", ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in self.phases.items())
+        return f"Startup timings: {breakdown}"
+
+def get_configured_models() -> set[str]:
+    models = {DEFAULT_MODEL}
+    for guild_cfg in config_manager.get_all_guild_configs().values():
+        if isinstance(guild_cfg, dict) and guild_cfg.get('model'):
+            models.add(guild_cfg['model'])
+    return models
+
+def get_configured_backends() -> dict[str, Backend]:
+    backends = {DEFAULT_BACKEND: backend_registry.default}
+    for model_id in get_configured_models():
+        backend, _ = backend_registry.resolve(model_id)
+        backends[backend.name] = backend
+    return backends
+
+def _import_deferred_modules():
+    for module_name in DEFERRED_IMPORTS:
+        importlib.import_module(module_name)
+
+def _build_clients(backends: typing.Iterable[Backend]):
+    # Building a client loads the TLS certificates, which would otherwise stall the event loop on the first reply.
+    for backend in backends:
+        for credential in backend.pool.credentials:
+            credential.get_client()
+
+async def _warm_model_catalog(timer: StartupTimer):
+    async with timer.async_phase('model_catalog'):
+        await asyncio.gather(*(model_info_manager.get_all_models(name) for name in get_configured_backends()))
+
+async def _warm_model_probes(timer: StartupTimer):
+    async with timer.async_phase('deferred_imports'):
+        await asyncio.to_thread(_import_deferred_modules)
+    async with timer.async_phase('clients'):
+        await asyncio.to_thread(_build_clients, get_configured_backends().values())
+
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_PROBES)
+
+    async def probe(model_id: str):
+        async with semaphore:
+            await model_info_manager.test_system_prompt_support(model_id)
+
+    models = get_configured_models()
+    async with timer.async_phase(f'model_probes[{len(models)}]'):
+        await asyncio.gather(*(probe(model_id) for model_id in models), return_exceptions=True)
+
+async def warm_up(timer: StartupTimer):
+    async with timer.async_phase('warm_up'):
+        await asyncio.gather(_warm_model_catalog(timer), _warm_model_probes(timer))
@@ -0,0 +1,118 @@
+import asyncio
+import typing
+
+from . import database_manager
+from .contexts import ChannelContext
+from .backends import backend_registry
+from .history import HistoryEntry
+from .log import fields, get_logger
+from .reasoning import drops_opening_think_tag, split_reasoning
+
+logger = get_logger('summarizer')
+
+SUMMARY_MAX_TOKENS = 400
+# Summaries aren't asked for by anyone, so their usage is logged under no user.
+SUMMARY_USER_ID = 0
+MAX_SUMMARY_CHARS = 2000
+# Turns waiting for a summary are capped, so a failing summary model can't grow the prompt until it never fits.
+MAX_PENDING_SUMMARY_CHARS = 8000
+
+SUMMARY_INSTRUCTION = (
+    "Eres un asistente que mantiene la memoria de un chat de Discord. Recibirás el resumen actual "
+    "y los mensajes más antiguos que van a salir del historial. Devuelve un único resumen actualizado, "
+    "breve y en tercera persona, que conserve nombres, IDs de usuario, hechos, decisiones y temas "
+    "pendientes. No añadas saludos ni comentarios, solo el resumen."
+)
+
+def _format_turn(turn: HistoryEntry) -> str:
+    if turn.role == 'user':
+        return turn.render_text()
+    return f"Iris: {turn.text}"
+
+class HistorySummarizer:
+    def schedule(self, channel_context: ChannelContext, dropped_turns: list, model: str, guild_id: int):
+        if not dropped_turns:
+            return
+        channel_context.pending_summary_turns.extend(dropped_turns)
+        self._cap_pending(channel_context)
+
+        if channel_context.summary_task and not channel_context.summary_task.done():
+            return
+        channel_context.summary_task = asyncio.create_task(self._run(channel_context, model, guild_id))
+
+    async def _run(self, channel_context: ChannelContext, model: str, guild_id: int):
+        while channel_context.pending_summary_turns:
+            turns = channel_context.pending_summary_turns
+            channel_context.pending_summary_turns = []
+
+            new_summary = await self._summarize(channel_context, turns, model, guild_id)
+            if not new_summary:
+                # Keep the turns for the next run instead of losing them from both the history and the summary.
+                channel_context.pending_summary_turns[:0] = turns
+                self._cap_pending(channel_context)
+                return
+            channel_context.summary = new_summary[:MAX_SUMMARY_CHARS]
+
+    def _cap_pending(self, channel_context: ChannelContext):
+        turns = channel_context.pending_summary_turns
+        total_chars = sum(len(_format_turn(turn)) for turn in turns)
+        dropped = 0
+        while dropped < len(turns) and total_chars > MAX_PENDING_SUMMARY_CHARS:
+            total_chars -= len(_format_turn(turns[dropped]))
+            dropped += 1
+        if dropped:
+            del turns[:dropped]
+            logger.warning("Dropped turns waiting for a summary", extra=fields(channel=channel_context.channel_id, turns=dropped))
+
+    def _log_usage(self, channel_context: ChannelContext, guild_id: int, model: str, api_key: str, usage):
+        details = getattr(usage, 'completion_tokens_details', None)
+        try:
+            database_manager.log_token_usage(
+                guild_id=guild_id,
+                channel_id=channel_context.channel_id,
+                user_id=SUMMARY_USER_ID,
+                model=model,
+                prompt_tokens=usage.prompt_tokens,
+                completion_tokens=usage.completion_tokens,
+                total_tokens=usage.total_tokens,
+                reasoning_tokens=(getattr(details, 'reasoning_tokens', None) or 0) if details else 0,
+                api_key=api_key,
+            )
+        except Exception as e:
+            logger.error("Error logging summary token usage: %s", e, extra=fields(channel=channel_context.channel_id, model=model))
+
+    async def _summarize(self, channel_context: ChannelContext, turns: list, model: str, guild_id: int) -> typing.Optional[str]:
+        from openai import OpenAIError
+
+        transcript = "\n".join(_format_turn(turn) for turn in turns)
+        user_prompt = (
+            f"Resumen actual:\n{channel_context.summary or '(vacío)'}\n\n"
+            f"Mensajes a incorporar:\n{transcript}"
+        )
+
+        backend, backend_model_id = backend_registry.resolve(model)
+        with backend.pool.lease(guild_id) as credential:
+            if credential is None:
+                return None
+            try:
+                response = await credential.get_client().chat.completions.create(
+                    model=backend_model_id,
+                    messages=[
+                        {'role': 'user', 'content': f"{SUMMARY_INSTRUCTION}\n\n{user_prompt}"},
+                    ],
+                    temperature=0.2,
+                    max_tokens=SUMMARY_MAX_TOKENS
+                )
+                if response.usage:
+                    await asyncio.to_thread(self._log_usage, channel_context, guild_id, model, credential.name, response.usage)
+                # Reasoning models can inline their thinking; only the answer belongs in the summary.
+                summary, _ = split_reasoning(response.choices[0].message.content or '', drops_opening_think_tag(model or ''))
+                return summary or None
+            except OpenAIError as e:
+                backend.pool.report_error(credential, e)
+                logger.error("Error summarizing history: %s", e, extra=fields(channel=channel_context.channel_id, model=model, key=credential.name))
+            except Exception as e:
+                logger.error("Unexpected error summarizing history: %s", e, extra=fields(channel=channel_context.channel_id, model=model))
+        return None
+
+history_summarizer = HistorySummarizer()
@@ -0,0 +1,58 @@
+import asyncio
+import contextlib
+import time
+import typing
+
+class Span(typing.NamedTuple):
+    name: str
+    started_at: float
+    ended_at: float
+    group: typing.Optional[str]
+
+    @property
+    def duration_ms(self) -> float:
+        return round((self.ended_at - self.started_at) * 1000, 1)
+
+class RequestTrace:
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.spans: list[Span] = []
+
+    @contextlib.contextmanager
+    def span(self, name: str, group: typing.Optional[str] = None):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans.append(Span(name, started_at, time.perf_counter(), group))
+
+    async def gather(self, group: str, steps: dict[str, typing.Awaitable]) -> dict[str, typing.Any]:
+        async def _run(name: str, step: typing.Awaitable):
+            with self.span(name, group):
+                return await step
+
+        with self.span(group):
+            results = await asyncio.gather(*(_run(name, step) for name, step in steps.items()))
+        return dict(zip(steps, results))
+
+    def durations(self) -> dict[str, float]:
+        return {f"{span.name}_ms": span.duration_ms for span in self.spans}
+
+    def critical_path(self) -> str:
+        # Stages run one after another; inside a concurrent group the step that finished last held up the group.
+        path = []
+        for span in sorted((span for span in self.spans if span.group is None), key=lambda span: span.started_at):
+            members = [member for member in self.spans if member.group == span.name]
+            path.append(f"{span.name}.{max(members, key=lambda member: member.ended_at).name}" if members else span.name)
+        return ">".join(path)
+
+    def render(self) -> str:
+        def _offsets(span: Span) -> str:
+            return f"{(span.started_at - self.started_at) * 1000:.0f}-{(span.ended_at - self.started_at) * 1000:.0f}ms"
+
+        parts = []
+        for span in sorted((span for span in self.spans if span.group is None), key=lambda span: span.started_at):
+            members = sorted((member for member in self.spans if member.group == span.name), key=lambda member: member.name)
+            detail = f" [{', '.join(f'{member.name} {_offsets(member)}' for member in members)}]" if members else ""
+            parts.append(f"{span.name} {_offsets(span)}{detail}")
+        return " | ".join(parts)
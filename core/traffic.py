@@ -0,0 +1,94 @@
+import asyncio
+import atexit
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+import typing
+
+from .log import fields, get_logger
+
+if typing.TYPE_CHECKING:
+    import discord
+
+logger = get_logger('traffic')
+
+TRAFFIC_RECORD_PATH = os.getenv('TRAFFIC_RECORD_PATH', '')
+TRAFFIC_HASH_SALT = os.getenv('TRAFFIC_HASH_SALT', '')
+TRAFFIC_FLUSH_EVERY = 100
+TRACE_FORMAT_VERSION = 1
+
+class TrafficRecorder:
+    def __init__(self, path: str = TRAFFIC_RECORD_PATH, salt: str = TRAFFIC_HASH_SALT):
+        self.path = path
+        self.enabled = bool(path)
+        self.salt = salt.encode() if salt else secrets.token_bytes(16)
+        self.started_at = time.monotonic()
+        self.buffer: list[str] = []
+        self.write_lock = threading.Lock()
+        if self.enabled:
+            self._append({'event': 'start', 'version': TRACE_FORMAT_VERSION, 'recorded_at': int(time.time())})
+            atexit.register(self.flush)
+            logger.info("Recording anonymized traffic traces", extra=fields(path=path))
+
+    def _hash(self, value: int) -> str:
+        return hmac.new(self.salt, str(value).encode(), hashlib.sha256).hexdigest()[:16]
+
+    def _append(self, record: dict):
+        self.buffer.append(json.dumps(record, separators=(',', ':')))
+        if len(self.buffer) >= TRAFFIC_FLUSH_EVERY:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                self.flush()
+            else:
+                loop.run_in_executor(None, self.write_lines, self.take_buffer())
+
+    def _base_record(self, event: str, guild_id: int, channel_id: int, message_id: int) -> dict:
+        return {
+            't': round(time.monotonic() - self.started_at, 3),
+            'event': event,
+            'id': self._hash(message_id),
+            'guild': self._hash(guild_id),
+            'channel': self._hash(channel_id),
+        }
+
+    def record_message(self, message: 'discord.Message', mode: str, command: typing.Optional[str] = None):
+        if not self.enabled:
+            return
+        record = self._base_record('message', message.guild.id, message.channel.id, message.id)
+        record.update({
+            'author': self._hash(message.author.id),
+            'mode': mode,
+            'length': len(message.content),
+            'attachments': [{'type': a.content_type, 'size': a.size} for a in message.attachments],
+        })
+        if command:
+            record['command'] = command
+        self._append(record)
+
+    def record_removal(self, event: str, guild_id: int, channel_id: int, message_id: int):
+        if self.enabled:
+            self._append(self._base_record(event, guild_id, channel_id, message_id))
+
+    def take_buffer(self) -> list[str]:
+        # Detached on the loop, so the writer thread never touches the list records are appended to.
+        lines, self.buffer = self.buffer, []
+        return lines
+
+    def write_lines(self, lines: list[str]):
+        if not lines:
+            return
+        try:
+            with self.write_lock, open(self.path, 'a', encoding='utf-8') as f:
+                f.write('\n'.join(lines) + '\n')
+        except OSError as e:
+            logger.error("Could not write traffic trace: %s", e, extra=fields(path=self.path, dropped=len(lines)))
+
+    def flush(self):
+        self.write_lines(self.take_buffer())
+
+traffic_recorder = TrafficRecorder()
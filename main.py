@@ -1,3 +1,6 @@
+import time
+STARTUP_STARTED_AT = time.perf_counter()
+
 import asyncio
 import os
 import typing
@@ -5,18 +8,29 @@ import typing
 import discord
 from discord.ext import commands
 from discord.ext import tasks
-from dotenv import load_dotenv
 
-from core import database_manager
-from core.ai_handler import AIResponseHandler
+import utils
+from core import ai_handler, database_manager, relevance
 from core.config import config_manager
 from core.contexts import context_manager
-from utils import get_prefix, is_admin, is_channel_allowed
+from core.job_queue import JOB_REPLY, job_queue, reply_payload
+from core.log import fields, get_logger
+from core.quotas import quota_manager
+from core.reloader import reload_coordinator
+from core.speculation import speculative_warmer
+from core.startup import StartupTimer, warm_up
+from core.traffic import traffic_recorder
+
+logger = get_logger('main')
+startup_timer = StartupTimer(STARTUP_STARTED_AT)
+startup_timer.mark('imports')
+warm_up_task: typing.Optional[asyncio.Task] = None
 
-load_dotenv()
 DISCORD_TOKEN = os.getenv('DISCORD_TOKEN')
+LEAN_MEMBER_CACHE = os.getenv('LEAN_MEMBER_CACHE', 'true').lower() == 'true'
+MESSAGE_CACHE_SIZE = int(os.getenv('MESSAGE_CACHE_SIZE', '200'))
 if not DISCORD_TOKEN:
-    print("Critical Error: DISCORD_TOKEN isn't set in the .env file")
+    logger.critical("DISCORD_TOKEN isn't set in the .env file")
     exit()
 
 intents = discord.Intents.default()
@@ -24,35 +38,128 @@ intents.message_content = True
 intents.reactions = True
 intents.members = True
 
-bot = commands.Bot(command_prefix=get_prefix, intents=intents, help_command=None)
+if LEAN_MEMBER_CACHE:
+    # Authors and their role ids come with every message, so only the bot's own member needs to be cached.
+    cache_options = dict(member_cache_flags=discord.MemberCacheFlags.none(), chunk_guilds_at_startup=False, max_messages=MESSAGE_CACHE_SIZE)
+else:
+    cache_options = {}
+
+bot = commands.Bot(command_prefix=utils.get_prefix, intents=intents, help_command=None, **cache_options)
+
+if job_queue.enabled:
+    context_manager.remote_control = job_queue
+
+@bot.event
+async def setup_hook():
+    global warm_up_task
+
+    async with startup_timer.async_phase('config_and_database'):
+        await asyncio.gather(
+            asyncio.to_thread(config_manager.load_config),
+            asyncio.to_thread(_initialize_storage),
+        )
+
+    async with startup_timer.async_phase('cogs'):
+        await _load_cogs()
+
+    warm_up_task = asyncio.create_task(_run_warm_up())
 
 @bot.event
 async def on_ready():
-    print(f'Bot connected as {bot.user}')
-    update_presence.start()
-    cleanup_database_task.start()
+    logger.info("Bot connected as %s", bot.user)
+    if 'gateway_ready' not in startup_timer.phases:
+        startup_timer.mark('gateway_ready')
+        logger.info(startup_timer.report())
+
+    for task in (update_presence, cleanup_database_task, checkpoint_quotas_task):
+        if not task.is_running():
+            task.start()
+    if job_queue.enabled and not apply_worker_charges_task.is_running():
+        apply_worker_charges_task.start()
 
 @bot.event
 async def on_message(message: discord.Message):
     if message.author.bot or not message.guild:
+        if job_queue.enabled and message.guild and message.author.id == bot.user.id:
+            # Replies are sent by workers, so the gateway learns about them from its own messages.
+            channel_context = context_manager.channel_contexts.get(message.channel.id)
+            if channel_context:
+                channel_context.last_reply_at = time.monotonic()
         return
 
     ctx = await bot.get_context(message)
     if ctx.valid:
+        traffic_recorder.record_message(message, 'command', command=ctx.command.qualified_name)
         await bot.process_commands(message)
         return
 
     should_process, content = await _should_process_ai(message)
     if not should_process:
+        traffic_recorder.record_message(message, 'ignored')
+        return
+    traffic_recorder.record_message(message, 'mention' if bot.user.mentioned_in(message) else 'natural')
+
+    channel_context = await context_manager.get_channel_ctx(message.channel.id)
+    if job_queue.enabled:
+        # Quotas are enforced here, where every shard's requests for a guild meet in one set of buckets.
+        if not await ai_handler.check_quota(message, config_manager.get_guild_config(message.guild.id)):
+            return
+        await asyncio.to_thread(job_queue.enqueue, JOB_REPLY, message.channel.id, message.id, reply_payload(message, content, channel_context.settings))
         return
 
+    await reload_coordinator.wait_until_ready()
+    handler = ai_handler.AIResponseHandler(bot, message, content)
+    request_task = asyncio.create_task(handler.process_request())
+    channel_context.track_request(message.id, request_task)
+
     try:
-        handler = AIResponseHandler(bot, message, content)
-        await handler.process_request()
+        await request_task
+    except asyncio.CancelledError:
+        logger.info("Generation was cancelled", extra=fields(guild=message.guild.id, channel=message.channel.id, request_id=message.id))
     except Exception as e:
-        print(f"Fatal error on on_message dispatch to message: {message.id}: {type(e).__name__} - {e}")
+        logger.exception("Fatal error on on_message dispatch: %s - %s", type(e).__name__, e, extra=fields(guild=message.guild.id, channel=message.channel.id, request_id=message.id))
         await message.channel.send("⚠️ Ocurrió un error inesperado al procesar tu mensaje.")
 
+@bot.event
+async def on_typing(channel, user, when):
+    if user.bot or not getattr(channel, 'guild', None) or not speculative_warmer.enabled or job_queue.enabled:
+        return
+    if not _may_reply_in(channel.guild.id, channel.id, user):
+        return
+    channel_context = await context_manager.get_channel_ctx(channel.id)
+    speculative_warmer.schedule(channel.guild.id, channel_context)
+
+# Raw events, because the trimmed message cache rarely still holds the message being deleted or edited.
+@bot.event
+async def on_raw_message_delete(payload: discord.RawMessageDeleteEvent):
+    if not payload.guild_id:
+        return
+    traffic_recorder.record_removal('delete', payload.guild_id, payload.channel_id, payload.message_id)
+    channel_context = context_manager.channel_contexts.get(payload.channel_id)
+    if channel_context:
+        channel_context.cancel_request(payload.message_id)
+
+@bot.event
+async def on_raw_message_edit(payload: discord.RawMessageUpdateEvent):
+    content = payload.data.get('content')
+    # Embed unfurls also arrive as updates; only a real edit sets edited_timestamp.
+    if not payload.guild_id or content is None or not payload.data.get('edited_timestamp'):
+        return
+    if payload.cached_message is not None and payload.cached_message.content == content:
+        return
+    traffic_recorder.record_removal('edit', payload.guild_id, payload.channel_id, payload.message_id)
+    channel_context = context_manager.channel_contexts.get(payload.channel_id)
+    if channel_context:
+        channel_context.cancel_request(payload.message_id)
+
+@bot.event
+async def on_guild_role_update(before: discord.Role, after: discord.Role):
+    utils.admin_cache.invalidate(after.guild.id)
+
+@bot.event
+async def on_guild_role_delete(role: discord.Role):
+    utils.admin_cache.invalidate(role.guild.id)
+
 @bot.event
 async def on_command_error(ctx: commands.Context, error):
     if isinstance(error, commands.CommandNotFound):
@@ -66,13 +173,13 @@ async def on_command_error(ctx: commands.Context, error):
     elif isinstance(error, commands.BadArgument):
         await ctx.send(f"❌ Argumento inválido: {error}")
     else:
-        print(f'Error not managed in command {ctx.command.qualified_name}: {type(error).__name__} - {error}')
+        logger.error("Error not managed in command %s: %s - %s", ctx.command.qualified_name, type(error).__name__, error, extra=fields(guild=ctx.guild.id if ctx.guild else None, channel=ctx.channel.id))
         await ctx.send("⚠️ Ocurrió un error desconocido al ejecutar el comando.")
 
 @tasks.loop(minutes=1)
 async def update_presence():
     try:
-        tokens = database_manager.get_tokens_from_last_7_days()
+        tokens = await asyncio.to_thread(database_manager.get_tokens_from_last_7_days)
         
         custom_state = f"Tokens usados (7d): {tokens:,}"
         activity = discord.Activity(
@@ -82,20 +189,39 @@ async def update_presence():
         )
         await bot.change_presence(activity=activity)
     except Exception as e:
-        print(f"Failed to change the state: {e}")
+        logger.warning("Failed to change the state: %s", e)
 
 @tasks.loop(hours=24)
 async def cleanup_database_task():
-    database_manager.cleanup_old_logs()
+    await asyncio.to_thread(database_manager.cleanup_old_logs)
 
-async def _should_process_ai(message: discord.Message) -> typing.Tuple[bool, typing.Optional[str]]:
-    guild_cfg = config_manager.get_guild_config(message.guild.id)
-    is_caller_admin = is_admin(message.author)
+@tasks.loop(minutes=5)
+async def checkpoint_quotas_task():
+    try:
+        await quota_manager.save_checkpoint()
+    except Exception as e:
+        logger.error("Failed to checkpoint quota buckets: %s", e)
+    if traffic_recorder.enabled:
+        await asyncio.to_thread(traffic_recorder.write_lines, traffic_recorder.take_buffer())
 
-    if not is_caller_admin and not guild_cfg.get('bot_enabled_for_users'):
-        return False, None
+@tasks.loop(seconds=5)
+async def apply_worker_charges_task():
+    try:
+        charges = await asyncio.to_thread(job_queue.take_charges)
+    except Exception as e:
+        logger.error("Failed to read worker quota charges: %s", e)
+        return
+    for guild_id, user_id, tokens in charges:
+        quota_manager.charge_tokens(guild_id, user_id, config_manager.get_guild_config(guild_id), tokens)
+
+def _may_reply_in(guild_id: int, channel_id: int, author: typing.Union[discord.Member, discord.User]) -> bool:
+    if utils.is_admin(author):
+        return True
+    guild_cfg = config_manager.get_guild_config(guild_id)
+    return bool(guild_cfg.get('bot_enabled_for_users')) and utils.is_channel_allowed(guild_id, channel_id)
 
-    if not is_caller_admin and not is_channel_allowed(message.guild.id, message.channel.id):
+async def _should_process_ai(message: discord.Message) -> typing.Tuple[bool, typing.Optional[str]]:
+    if not _may_reply_in(message.guild.id, message.channel.id, message.author):
         return False, None
 
     channel_context = await context_manager.get_channel_ctx(message.channel.id)
@@ -106,27 +232,61 @@ async def _should_process_ai(message: discord.Message) -> typing.Tuple[bool, typ
         stripped_content = stripped_content.replace(mention, '').strip()
 
     if is_mention and (stripped_content or message.attachments):
+        channel_context.last_mention_at = time.monotonic()
         return True, stripped_content
     if channel_context.settings.get('natural_conversation') and (stripped_content or message.attachments):
+        if not _passes_relevance_gate(message, stripped_content, channel_context):
+            return False, None
         return True, stripped_content
 
     return False, None
 
-async def main():
+def _passes_relevance_gate(message: discord.Message, content: str, channel_context) -> bool:
+    referenced = message.reference.resolved if message.reference else None
+    is_reply = isinstance(referenced, discord.Message)
+    seconds_since_bot_reply = time.monotonic() - channel_context.last_reply_at if channel_context.last_reply_at else None
+
+    signals = relevance.RelevanceSignals(
+        text=content,
+        bot_names=tuple({bot.user.name.lower(), bot.user.display_name.lower(), 'iris'}),
+        has_attachments=bool(message.attachments),
+        is_reply_to_bot=is_reply and referenced.author.id == bot.user.id,
+        is_reply_to_other=is_reply and referenced.author.id != bot.user.id,
+        mentions_others=any(user.id != bot.user.id for user in message.mentions),
+        seconds_since_bot_reply=seconds_since_bot_reply,
+    )
+    passed = relevance.relevance_gate.score(signals) >= channel_context.settings.get('relevance_threshold', 0.5)
+    channel_context.relevance_stats['passed' if passed else 'gated'] += 1
+    return passed
+
+def _initialize_storage():
     database_manager.initialize_database()
+    quota_manager.load_checkpoint()
+
+async def _load_cog(name: str):
+    try:
+        await bot.load_extension(f'cogs.{name}')
+        logger.info("Cog loaded: %s", name)
+    except Exception as e:
+        logger.error("Error loading cog %s: %s", name, e)
+
+async def _load_cogs():
+    names = [filename[:-3] for filename in os.listdir('./cogs') if filename.endswith('.py') and not filename.startswith('_')]
+    await asyncio.gather(*(_load_cog(name) for name in names))
+
+async def _run_warm_up():
+    try:
+        await warm_up(startup_timer)
+        logger.info(startup_timer.report())
+    except Exception as e:
+        logger.error("Warm-up failed: %s - %s", type(e).__name__, e)
+
+async def main():
     async with bot:
-        for filename in os.listdir('./cogs'):
-            if filename.endswith('.py') and not filename.startswith('_'):
-                try:
-                    await bot.load_extension(f'cogs.{filename[:-3]}')
-                    print(f'Cog loaded: {filename[:-3]}')
-                except Exception as e:
-                    print(f'Error loading cog {filename[:-3]}: {e}')
-        
         await bot.start(DISCORD_TOKEN)
 
 if __name__ == '__main__':
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
-        print("\nBot stopped manually.")
\ No newline at end of file
+        logger.info("Bot stopped manually.")
\ No newline at end of file
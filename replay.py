@@ -0,0 +1,530 @@
+import argparse
+import asyncio
+import collections
+import contextlib
+import contextvars
+import functools
+import io
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+import typing
+from pathlib import Path
+
+from aiohttp import web
+from discord.ext import commands
+
+REPO_DIR = Path(__file__).resolve().parent
+BOT_USER_ID = 1
+SESSION_GAP_SECONDS = 1.0
+LOOP_LAG_INTERVAL_SECONDS = 0.05
+MAX_NOISE_IMAGE_SIDE = 4096
+
+current_trace: contextvars.ContextVar[typing.Optional['EventTrace']] = contextvars.ContextVar('current_trace', default=None)
+
+class EventTrace:
+    def __init__(self, mode: str, scheduled_at: float):
+        self.mode = mode
+        self.scheduled_at = scheduled_at
+        self.started_at: typing.Optional[float] = None
+        self.first_send_at: typing.Optional[float] = None
+        self.finished_at: typing.Optional[float] = None
+
+class ReplayStats:
+    def __init__(self):
+        self.traces: list[EventTrace] = []
+        self.removals = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.loop_lag: list[float] = []
+
+    def record_send(self):
+        trace = current_trace.get()
+        if trace and trace.first_send_at is None:
+            trace.first_send_at = time.perf_counter()
+
+def percentiles(values: list[float]) -> str:
+    if not values:
+        return "n/a"
+    ordered = sorted(values)
+    pick = lambda p: ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+    return f"p50={pick(0.5) * 1000:.0f} p95={pick(0.95) * 1000:.0f} p99={pick(0.99) * 1000:.0f} max={ordered[-1] * 1000:.0f}"
+
+def load_trace(path: str) -> list[dict]:
+    events, offset, session_end = [], 0.0, 0.0
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get('event') == 'start':
+                offset = session_end + SESSION_GAP_SECONDS if events else 0.0
+                continue
+            record['t'] = offset + float(record.get('t', 0))
+            session_end = max(session_end, record['t'])
+            events.append(record)
+    events.sort(key=lambda record: record['t'])
+    return events
+
+class StubOpenRouter:
+    def __init__(self, latency: float, completion_tokens: int, key_rpm: int):
+        self.latency = latency
+        self.completion_tokens = completion_tokens
+        self.key_rpm = key_rpm
+        self.model_ids: set[str] = set()
+        self.key_requests: dict[str, collections.deque] = collections.defaultdict(collections.deque)
+        self.rate_limited: collections.Counter = collections.Counter()
+        self.requests = 0
+        self.key_checks = 0
+        self.reasoning_tokens = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.runner: typing.Optional[web.AppRunner] = None
+
+    async def key_info(self, request: web.Request) -> web.Response:
+        self.key_checks += 1
+        return web.json_response({'data': {'label': request.headers.get('Authorization', '')[-8:], 'usage': 0, 'limit': None}})
+
+    async def models(self, request: web.Request) -> web.Response:
+        return web.json_response({'data': [
+            {
+                'id': model_id, 'name': model_id, 'created': 0, 'context_length': 131072,
+                'pricing': {'prompt': '0', 'completion': '0'},
+                'architecture': {'input_modalities': ['text', 'image']},
+                'supported_parameters': ['max_tokens', 'temperature', 'reasoning', 'include_reasoning'],
+            }
+            for model_id in sorted(self.model_ids)
+        ]})
+
+    def _is_rate_limited(self, api_key: str) -> bool:
+        if not self.key_rpm:
+            return False
+        now = time.monotonic()
+        recent = self.key_requests[api_key]
+        while recent and now - recent[0] >= 60:
+            recent.popleft()
+        if len(recent) >= self.key_rpm:
+            self.rate_limited[api_key] += 1
+            return True
+        recent.append(now)
+        return False
+
+    async def chat_completions(self, request: web.Request) -> web.Response:
+        body = await request.read()
+        api_key = request.headers.get('Authorization', '').removeprefix('Bearer ')
+        if self._is_rate_limited(api_key):
+            retry_after = int(60 - (time.monotonic() - self.key_requests[api_key][0])) + 1
+            return web.json_response(
+                {'error': {'code': 429, 'message': 'Rate limit exceeded: free-models-per-min.'}},
+                status=429, headers={'Retry-After': str(retry_after)},
+            )
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency * random.uniform(0.75, 1.25))
+        finally:
+            self.in_flight -= 1
+
+        payload = json.loads(body)
+        prompt_tokens = len(body) // 4
+        reasoning = payload.get('reasoning') or {}
+        reasoning_tokens = 0
+        message = {'role': 'assistant', 'content': "respuesta " * (self.completion_tokens // 2)}
+        if reasoning.get('enabled', True):
+            effort_share = {'minimal': 0.25, 'low': 0.5, 'medium': 1.0, 'high': 2.0}.get(reasoning.get('effort'), 1.0)
+            reasoning_tokens = min(reasoning.get('max_tokens') or 10**6, int(self.completion_tokens * effort_share))
+            self.reasoning_tokens += reasoning_tokens
+            # Mimics providers that leave the reasoning inline in the content.
+            message['content'] = f"<think>{'pienso ' * (reasoning_tokens // 2)}</think>\n{message['content']}"
+            if not reasoning.get('exclude'):
+                message['reasoning'] = 'pienso ' * (reasoning_tokens // 2)
+        return web.json_response({
+            'id': f"gen-replay-{self.requests}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': payload.get('model', ''),
+            'choices': [{
+                'index': 0,
+                'finish_reason': 'stop',
+                'message': message,
+            }],
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': self.completion_tokens + reasoning_tokens,
+                'total_tokens': prompt_tokens + self.completion_tokens + reasoning_tokens,
+                'completion_tokens_details': {'reasoning_tokens': reasoning_tokens},
+            },
+        })
+
+    async def start(self) -> str:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_get('/api/v1/models', self.models)
+        app.router.add_get('/api/v1/key', self.key_info)
+        app.router.add_post('/api/v1/chat/completions', self.chat_completions)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}/api/v1"
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+class ReplayUser:
+    def __init__(self, user_id: int, name: str, is_bot: bool = False):
+        self.id = user_id
+        self.name = name
+        self.display_name = name
+        self.mention = f"<@{user_id}>"
+        self.bot = is_bot
+        self.avatar = types.SimpleNamespace(url='https://cdn.discordapp.com/embed/avatars/0.png')
+
+    def mentioned_in(self, message: 'ReplayMessage') -> bool:
+        return message.mention_everyone or any(user.id == self.id for user in message.mentions)
+
+class ReplayGuild:
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+        self.name = f"guild-{guild_id}"
+        self.owner_id = 0
+        self.icon = None
+
+    def get_role(self, role_id: int):
+        return None
+
+class ReplayChannel:
+    def __init__(self, channel_id: int, guild: ReplayGuild, stats: ReplayStats, bot_user: ReplayUser):
+        self.id = channel_id
+        self.guild = guild
+        self.name = f"channel-{channel_id}"
+        self.mention = f"<#{channel_id}>"
+        self.stats = stats
+        self.bot_user = bot_user
+        self.sent_ids = itertools.count(1)
+
+    async def send(self, content: typing.Optional[str] = None, **kwargs) -> 'ReplayMessage':
+        self.stats.record_send()
+        return ReplayMessage(next(self.sent_ids), content or '', self.bot_user, self)
+
+    @contextlib.asynccontextmanager
+    async def typing(self):
+        yield
+
+class ReplayContext(commands.Context):
+    async def send(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+    async def reply(self, content=None, **kwargs):
+        return await self.message.reply(content, **kwargs)
+
+class ReplayAttachment:
+    def __init__(self, index: int, content_type: typing.Optional[str], size: int):
+        self.content_type = content_type
+        self.size = size
+        subtype = (content_type or 'application/octet-stream').split(';', 1)[0].split('/')[-1]
+        self.filename = f"attachment{index}.{subtype}"
+
+    async def read(self) -> bytes:
+        return synthesize_attachment_bytes(self.content_type, self.size)
+
+class ReplayMessage:
+    def __init__(self, message_id: int, content: str, author: ReplayUser, channel: ReplayChannel,
+                 attachments: list[ReplayAttachment] = None, mentions: list[ReplayUser] = None):
+        self.id = message_id
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.guild = channel.guild
+        self.attachments = attachments or []
+        self.mentions = mentions or []
+        self.mention_everyone = False
+        self.reference = None
+        self._state = None
+
+    async def reply(self, content: typing.Optional[str] = None, **kwargs) -> 'ReplayMessage':
+        return await self.channel.send(content, **kwargs)
+
+    async def edit(self, **kwargs):
+        self.content = kwargs.get('content', self.content)
+
+    async def delete(self, **kwargs):
+        pass
+
+    async def add_reaction(self, emoji):
+        pass
+
+@functools.lru_cache(maxsize=16)
+def _noise_png(side: int) -> bytes:
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.frombytes('RGB', (side, side), os.urandom(side * side * 3)).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+def synthesize_attachment_bytes(content_type: typing.Optional[str], size: int) -> bytes:
+    mime_type = (content_type or '').split(';', 1)[0]
+    if mime_type.startswith('image/'):
+        return _noise_png(max(16, min(MAX_NOISE_IMAGE_SIDE, int((size / 3) ** 0.5))))
+    if mime_type.startswith('text/') or mime_type.startswith('application/json'):
+        return (b"lorem ipsum " * (size // 12 + 1))[:size]
+    return os.urandom(size)
+
+def synthesize_content(event: dict, bot_user: ReplayUser, prefix: str) -> str:
+    mode = event.get('mode')
+    if mode == 'command':
+        return f"{prefix}{event.get('command', 'help')}"
+    if mode == 'mention':
+        head = f"{bot_user.mention} ¿qué opinas"
+    elif mode == 'natural':
+        head = "iris, ¿qué opinas"
+    else:
+        return "jaja"
+    padding = max(0, int(event.get('length', 0)) - len(head) - 1)
+    return f"{head}{' de esto' * (padding // 8)}?"
+
+class Replayer:
+    def __init__(self, bot, stats: ReplayStats, speed: float, typing_lead: float):
+        self.bot = bot
+        self.stats = stats
+        self.speed = speed
+        self.typing_lead = typing_lead
+        self.bot_user = bot.user
+        self.ids = itertools.count(10_000)
+        self.guilds: dict[str, ReplayGuild] = {}
+        self.channels: dict[str, ReplayChannel] = {}
+        self.authors: dict[str, ReplayUser] = {}
+        self.messages: dict[str, ReplayMessage] = {}
+        self.tasks: list[asyncio.Task] = []
+
+    def _channel(self, event: dict) -> ReplayChannel:
+        guild = self.guilds.get(event['guild'])
+        if guild is None:
+            guild = self.guilds[event['guild']] = ReplayGuild(next(self.ids))
+        channel = self.channels.get(event['channel'])
+        if channel is None:
+            channel = self.channels[event['channel']] = ReplayChannel(next(self.ids), guild, self.stats, self.bot_user)
+        return channel
+
+    def _author(self, event: dict) -> ReplayUser:
+        author = self.authors.get(event.get('author', ''))
+        if author is None:
+            user_id = next(self.ids)
+            author = self.authors[event.get('author', '')] = ReplayUser(user_id, f"user{user_id}")
+        return author
+
+    async def prepare(self, events: list[dict]):
+        from core.contexts import context_manager
+
+        for event in events:
+            channel = self._channel(event)
+            if event.get('mode') == 'natural':
+                channel_context = await context_manager.get_channel_ctx(channel.id)
+                channel_context.settings['natural_conversation'] = True
+
+    def _build_message(self, event: dict, prefix: str) -> ReplayMessage:
+        channel = self._channel(event)
+        attachments = [
+            ReplayAttachment(index, attachment.get('type'), int(attachment.get('size', 0)))
+            for index, attachment in enumerate(event.get('attachments', []))
+        ]
+        message = ReplayMessage(
+            next(self.ids), synthesize_content(event, self.bot_user, prefix), self._author(event), channel,
+            attachments, [self.bot_user] if event.get('mode') == 'mention' else [],
+        )
+        self.messages[event.get('id', '')] = message
+        return message
+
+    async def _run(self, trace: EventTrace, handler: typing.Awaitable):
+        current_trace.set(trace)
+        trace.started_at = time.perf_counter()
+        self.stats.in_flight += 1
+        self.stats.max_in_flight = max(self.stats.max_in_flight, self.stats.in_flight)
+        try:
+            await handler
+        except Exception as e:
+            print(f"Replay handler failed: {type(e).__name__} - {e}", file=sys.stderr)
+        finally:
+            self.stats.in_flight -= 1
+            trace.finished_at = time.perf_counter()
+
+    def _dispatch(self, event: dict, scheduled_at: float, prefix: str):
+        import main
+
+        if event.get('event') == 'typing':
+            self.tasks.append(asyncio.create_task(main.on_typing(self._channel(event), self._author(event), None)))
+            return
+        if event.get('event') == 'message':
+            message = self._build_message(event, prefix)
+            trace = EventTrace(event.get('mode', 'ignored'), scheduled_at)
+            self.stats.traces.append(trace)
+            self.tasks.append(asyncio.create_task(self._run(trace, main.on_message(message))))
+            return
+
+        message = self.messages.get(event.get('id', ''))
+        if message is None:
+            return
+        self.stats.removals += 1
+        ids = {'message_id': message.id, 'channel_id': message.channel.id, 'guild_id': message.guild.id}
+        if event.get('event') == 'delete':
+            payload = types.SimpleNamespace(**ids, cached_message=None)
+            self.tasks.append(asyncio.create_task(main.on_raw_message_delete(payload)))
+        elif event.get('event') == 'edit':
+            data = {'content': message.content + " (editado)", 'edited_timestamp': time.time()}
+            payload = types.SimpleNamespace(**ids, data=data, cached_message=None)
+            self.tasks.append(asyncio.create_task(main.on_raw_message_edit(payload)))
+
+    async def run(self, events: list[dict]) -> float:
+        from core.config import DEFAULT_COMMAND_PREFIX
+
+        if self.typing_lead > 0:
+            typing_events = [
+                {**event, 'event': 'typing', 't': max(0.0, event['t'] - self.typing_lead)}
+                for event in events if event.get('event') == 'message' and event.get('mode') in ('mention', 'natural')
+            ]
+            events = sorted(events + typing_events, key=lambda event: event['t'])
+
+        started_at = time.perf_counter()
+        for event in events:
+            scheduled_at = started_at + event['t'] / self.speed
+            delay = scheduled_at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._dispatch(event, scheduled_at, DEFAULT_COMMAND_PREFIX)
+
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        return time.perf_counter() - started_at
+
+async def sample_loop_lag(stats: ReplayStats):
+    while True:
+        started_at = time.perf_counter()
+        await asyncio.sleep(LOOP_LAG_INTERVAL_SECONDS)
+        stats.loop_lag.append(max(0.0, time.perf_counter() - started_at - LOOP_LAG_INTERVAL_SECONDS))
+
+def print_report(args, events: list[dict], stats: ReplayStats, stub: StubOpenRouter, elapsed: float):
+    from core.contexts import context_manager
+
+    mib = lambda value: f"{value / (1024 * 1024):.1f} MiB"
+    span = events[-1]['t'] if events else 0.0
+    print(f"Replayed {len(stats.traces)} messages and {stats.removals} deletes/edits from {args.trace} "
+          f"at {args.speed:g}x in {elapsed:.1f}s (trace span {span:.1f}s)")
+
+    for mode in ('mention', 'natural', 'command', 'ignored'):
+        traces = [trace for trace in stats.traces if trace.mode == mode]
+        if not traces:
+            continue
+        first_reply = [trace.first_send_at - trace.scheduled_at for trace in traces if trace.first_send_at]
+        handled = [trace.finished_at - trace.scheduled_at for trace in traces if trace.finished_at]
+        print(f"  {mode:<8} n={len(traces):<6} replied={len(first_reply):<6} "
+              f"first reply ms: {percentiles(first_reply)} | handled ms: {percentiles(handled)}")
+
+    dispatch_lag = [trace.started_at - trace.scheduled_at for trace in stats.traces if trace.started_at]
+    print(f"Queueing: dispatch lag ms {percentiles(dispatch_lag)}; event loop lag ms {percentiles(stats.loop_lag)}")
+    print(f"Concurrency: max in-flight handlers {stats.max_in_flight}, "
+          f"max in-flight API calls {stub.max_in_flight}, API requests {stub.requests}")
+    if args.typing_lead > 0:
+        from core.speculation import speculative_warmer
+
+        counts = ", ".join(f"{name} {count}" for name, count in sorted(speculative_warmer.stats.items())) or "none"
+        print(f"Speculative warm-ups: {counts}; connection warm-ups {stub.key_checks}")
+    if stub.reasoning_tokens:
+        print(f"Reasoning: {stub.reasoning_tokens:,} reasoning tokens across {stub.requests} API requests")
+    if stub.rate_limited:
+        print(f"Rate limited by the stub: {sum(stub.rate_limited.values())} responses across {len(stub.rate_limited)} keys")
+
+    retained, peak = tracemalloc.get_traced_memory()
+    history_entries = [entry for channel_context in context_manager.channel_contexts.values() for entry in channel_context.history]
+    print(f"Memory growth: {mib(retained)} retained after the replay, {mib(peak)} peak; {len(history_entries)} history entries "
+          f"(~{sum(entry.token_estimate for entry in history_entries):,} tokens) in {len(context_manager.channel_contexts)} channels")
+
+async def run_replay(args) -> int:
+    events = load_trace(args.trace)
+    if not events:
+        print(f"No events found in {args.trace}", file=sys.stderr)
+        return 1
+
+    stub = StubOpenRouter(args.api_latency, args.completion_tokens, args.key_rpm)
+    base_url = await stub.start()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='iris-replay-')
+    os.chdir(workdir)
+    os.environ.update({
+        'DISCORD_TOKEN': 'replay', 'OPENROUTER_API_KEY': '',
+        'OPENROUTER_API_KEYS': ','.join(f"replay{index}=replay-key-{index}" for index in range(1, args.keys + 1)),
+        'OPENROUTER_BASE_URL': base_url, 'LOG_LEVEL': args.log_level.upper(),
+    })
+    os.environ.pop('TRAFFIC_RECORD_PATH', None)
+    if args.backend:
+        # Route every channel through an OpenAI-compatible backend served by the same stub, as a local server would be.
+        with open('backends.json', 'w', encoding='utf-8') as f:
+            json.dump({args.backend: {'base_url': base_url}}, f)
+        os.environ.update({'BACKENDS_FILE': 'backends.json', 'MODEL_NAME': f"{args.backend}:replay-model", 'SUMMARY_MODEL_NAME': f"{args.backend}:replay-summary"})
+    sys.path.insert(0, str(REPO_DIR))
+
+    import main
+    from core.backends import backend_registry
+    from core.config import DEFAULT_MODEL, DEFAULT_SUMMARY_MODEL, config_manager
+    from core.startup import get_configured_models
+
+    bot = main.bot
+    stats = ReplayStats()
+    loop_lag_sampler: typing.Optional[asyncio.Task] = None
+
+    try:
+        async with bot:
+            bot._connection.user = ReplayUser(BOT_USER_ID, 'Iris', is_bot=True)
+            bot.owner_id = -1
+            bot.get_context = functools.partial(bot.get_context, cls=ReplayContext)
+
+            await asyncio.gather(asyncio.to_thread(config_manager.load_config), asyncio.to_thread(main._initialize_storage))
+            for path in sorted((REPO_DIR / 'cogs').glob('*.py')):
+                if not path.name.startswith('_'):
+                    await main._load_cog(path.stem)
+            stub.model_ids.update(backend_registry.resolve(model_ref)[1] for model_ref in get_configured_models() | {DEFAULT_MODEL, DEFAULT_SUMMARY_MODEL})
+            await main._run_warm_up()
+
+            replayer = Replayer(bot, stats, args.speed, args.typing_lead)
+            await replayer.prepare(events)
+
+            tracemalloc.start()
+            loop_lag_sampler = asyncio.create_task(sample_loop_lag(stats))
+            elapsed = await replayer.run(events)
+            print_report(args, events, stats, stub, elapsed)
+    finally:
+        if loop_lag_sampler:
+            loop_lag_sampler.cancel()
+        tracemalloc.stop()
+        await stub.stop()
+    return 0
+
+def parse_args(argv: typing.Optional[list[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Replay a recorded traffic trace against a local OpenRouter stub.")
+    parser.add_argument('trace', help="JSONL trace written with TRAFFIC_RECORD_PATH")
+    parser.add_argument('--speed', type=float, default=1.0, help="replay speed multiplier, e.g. 1 to 50 (default: 1)")
+    parser.add_argument('--api-latency', type=float, default=1.0, help="mean stub completion latency in seconds (default: 1.0)")
+    parser.add_argument('--completion-tokens', type=int, default=200, help="completion tokens per stub response (default: 200)")
+    parser.add_argument('--keys', type=int, default=1, help="number of API keys in the replay key pool (default: 1)")
+    parser.add_argument('--key-rpm', type=int, default=0, help="stub requests per minute per key before it answers 429 (default: 0, unlimited)")
+    parser.add_argument('--typing-lead', type=float, default=0.0, help="trace seconds before each AI message to send a typing event, 0 to disable (default: 0)")
+    parser.add_argument('--backend', help="name of an OpenAI-compatible backend to route all models through, served by the stub (default: OpenRouter)")
+    parser.add_argument('--workdir', help="directory for the replay config.json and database (default: a new temp dir)")
+    parser.add_argument('--log-level', default='WARNING', help="bot log level during the replay (default: WARNING)")
+    args = parser.parse_args(argv)
+    if args.speed <= 0:
+        parser.error("--speed must be positive")
+    if args.keys < 1:
+        parser.error("--keys must be at least 1")
+    args.trace = os.path.abspath(args.trace)
+    return args
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(run_replay(parse_args())))
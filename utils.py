@@ -1,4 +1,6 @@
 import asyncio
+import os
+import time
 import typing
 import copy
 
@@ -7,10 +9,49 @@ from discord.ext import commands
 
 from core.config import config_manager, DEFAULT_GUILD_CONFIG, DEFAULT_AI_SETTINGS, DEFAULT_MAX_OUTPUT_TOKENS
 from core.contexts import ChannelContext
+from core.log import fields, get_logger
 from core.openrouter_models import model_info_manager
+from core.reasoning import MAX_REASONING_TOKENS, MIN_REASONING_TOKENS
+
+logger = get_logger('utils')
 
 MIN_ALLOWED_OUTPUT_TOKENS = 64
 MAX_ALLOWED_OUTPUT_TOKENS = 8192
+REASONING_SETTING_HELP = (
+    "`auto` (poco razonamiento para preguntas cortas), `model` (lo que decida el modelo), `off`, "
+    f"`minimal`, `low`, `medium`, `high`, o un máximo de tokens entre {MIN_REASONING_TOKENS} y {MAX_REASONING_TOKENS}"
+)
+ADMIN_CACHE_TTL_SECONDS = float(os.getenv('ADMIN_CACHE_TTL_SECONDS', '60'))
+
+class AdminCache:
+    def __init__(self, ttl: float = ADMIN_CACHE_TTL_SECONDS):
+        self.ttl = ttl
+        self.entries: dict[typing.Tuple[int, int], typing.Tuple[float, tuple, bool]] = {}
+
+    def get(self, guild_id: int, user_id: int, fingerprint: tuple) -> typing.Optional[bool]:
+        entry = self.entries.get((guild_id, user_id))
+        if entry is None:
+            return None
+        expires_at, cached_fingerprint, result = entry
+        if expires_at < time.monotonic() or cached_fingerprint != fingerprint:
+            del self.entries[(guild_id, user_id)]
+            return None
+        return result
+
+    def put(self, guild_id: int, user_id: int, fingerprint: tuple, result: bool):
+        now = time.monotonic()
+        if len(self.entries) > 10000:
+            self.entries = {key: entry for key, entry in self.entries.items() if entry[0] >= now}
+        self.entries[(guild_id, user_id)] = (now + self.ttl, fingerprint, result)
+
+    def invalidate(self, guild_id: int, user_id: typing.Optional[int] = None):
+        if user_id is not None:
+            self.entries.pop((guild_id, user_id), None)
+            return
+        for key in [key for key in self.entries if key[0] == guild_id]:
+            del self.entries[key]
+
+admin_cache = AdminCache()
 
 def parse_model_id_from_input(input_str: str) -> str:
     base_url_models = "https://openrouter.ai/models/"
@@ -55,16 +96,25 @@ async def set_and_verify_model(ctx: commands.Context, model_id: str) -> tuple[bo
 def is_admin(member: typing.Union[discord.Member, discord.User]) -> bool:
     if not isinstance(member, discord.Member):
         return False
-    if member.guild.owner_id == member.id:
+    guild = member.guild
+    if guild.owner_id == member.id:
         return True
-    if member.guild_permissions.administrator:
+
+    admin_role_id = config_manager.get_guild_config(guild.id).get('admin_role_id')
+    # Role ids come with every message, so a changed role set or admin role misses the cache without member events.
+    fingerprint = (admin_role_id, tuple(role.id for role in member.roles))
+    cached = admin_cache.get(guild.id, member.id, fingerprint)
+    if cached is not None:
+        return cached
+
+    result = _has_admin_role(member, admin_role_id)
+    admin_cache.put(guild.id, member.id, fingerprint, result)
+    return result
+
+def _has_admin_role(member: discord.Member, admin_role_id: typing.Optional[int]) -> bool:
+    if admin_role_id and member.get_role(admin_role_id) is not None:
         return True
-    
-    guild_cfg = config_manager.get_guild_config(member.guild.id)
-    admin_role_id = guild_cfg.get('admin_role_id')
-    if admin_role_id:
-        return any(role.id == admin_role_id for role in member.roles)
-    return False
+    return member.guild_permissions.administrator
 
 def is_admin_check():
     async def predicate(ctx: commands.Context) -> bool:
@@ -75,6 +125,13 @@ def is_admin_check():
         return True
     return commands.check(predicate)
 
+def is_bot_owner_check():
+    async def predicate(ctx: commands.Context) -> bool:
+        if not await ctx.bot.is_owner(ctx.author):
+            raise commands.CheckFailure("Solo el dueño del bot puede usar este comando.")
+        return True
+    return commands.check(predicate)
+
 def is_owner_check():
     async def predicate(ctx: commands.Context) -> bool:
         if not ctx.guild:
@@ -124,8 +181,8 @@ def reset_channel_settings(channel_context: ChannelContext):
     channel_context.settings = copy.deepcopy(DEFAULT_AI_SETTINGS)
     if 'model' in channel_context.settings:
         del channel_context.settings['model']
-    channel_context.stop_requested = False
-    print(f"Configuración de IA del canal {channel_context.channel_id} restablecida.")
+    channel_context.cancel_all_requests()
+    logger.info("Channel AI settings reset", extra=fields(channel=channel_context.channel_id))
 
 async def perform_set_max_output_tokens(ctx: commands.Context, max_tokens: int) -> bool:
     if not (MIN_ALLOWED_OUTPUT_TOKENS <= max_tokens <= MAX_ALLOWED_OUTPUT_TOKENS):
@@ -142,6 +199,6 @@ async def perform_set_max_output_tokens(ctx: commands.Context, max_tokens: int)
         await ctx.send(f"✅ Límite máximo de tokens de salida establecido en **{max_tokens}** para este servidor.", delete_after=15)
         return True
     except Exception as e:
-        print(f"Error en perform_set_max_output_tokens para guild {ctx.guild.id}: {e}")
+        logger.error("Error in perform_set_max_output_tokens: %s", e, extra=fields(guild=ctx.guild.id))
         await ctx.send("⚠️ Ocurrió un error inesperado al guardar la configuración.", delete_after=10)
         return False
\ No newline at end of file
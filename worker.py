@@ -0,0 +1,145 @@
+import argparse
+import asyncio
+import os
+import time
+import typing
+
+import discord
+
+from core import ai_handler, database_manager
+from core.config import config_manager
+from core.contexts import context_manager
+from core.job_queue import AI_WORKERS, JOB_CANCEL, JOB_CANCEL_ALL, JOB_CLEAR, JOB_REPLY, Job, job_queue
+from core.log import fields, get_logger
+from core.memory import long_term_memory
+from core.quotas import quota_manager
+from core.startup import StartupTimer, warm_up
+
+logger = get_logger('worker')
+
+DISCORD_TOKEN = os.getenv('DISCORD_TOKEN')
+WORKER_CONCURRENCY = int(os.getenv('WORKER_CONCURRENCY', '8'))
+POLL_INTERVAL_SECONDS = 0.1
+
+class QueuedAuthor:
+    def __init__(self, author_id: int, display_name: str):
+        self.id = author_id
+        self.display_name = display_name
+        self.mention = f"<@{author_id}>"
+
+class QueuedMessage:
+    def __init__(self, client: discord.Client, job: Job):
+        payload = job.payload
+        self.id = job.message_id
+        self.guild = discord.Object(payload['guild_id'])
+        self.channel = client.get_partial_messageable(job.channel_id, guild_id=payload['guild_id'])
+        self.author = QueuedAuthor(payload['author_id'], payload['author_name'])
+        self.attachments = [discord.Attachment(data=data, state=client._connection) for data in payload['attachments']]
+
+    async def reply(self, content: typing.Optional[str] = None, **kwargs) -> discord.Message:
+        return await self.channel.get_partial_message(self.id).reply(content, **kwargs)
+
+class Worker:
+    def __init__(self, client: discord.Client, shard: int):
+        self.client = client
+        self.shard = shard
+        self.running: typing.Set[asyncio.Task] = set()
+
+    async def run(self):
+        while True:
+            try:
+                config_manager.reload_if_changed()
+                if charges := quota_manager.take_charges():
+                    try:
+                        await asyncio.to_thread(job_queue.add_charges, charges)
+                    except Exception:
+                        quota_manager.pending_charges[:0] = charges
+                        raise
+                jobs = await asyncio.to_thread(job_queue.claim, self.shard, WORKER_CONCURRENCY - len(self.running))
+            except Exception as e:
+                logger.error("Failed to claim jobs: %s - %s", type(e).__name__, e, extra=fields(shard=self.shard))
+                jobs = []
+            for job in jobs:
+                self._dispatch(job)
+            if not jobs:
+                await asyncio.sleep(POLL_INTERVAL_SECONDS)
+
+    def _dispatch(self, job: Job):
+        if job.kind == JOB_REPLY:
+            task = asyncio.create_task(self._reply(job))
+            self.running.add(task)
+            task.add_done_callback(self.running.discard)
+            return
+
+        channel_context = context_manager.channel_contexts.get(job.channel_id)
+        if channel_context is None:
+            return
+        if job.kind == JOB_CANCEL:
+            channel_context.cancel_request(job.message_id)
+        elif job.kind == JOB_CANCEL_ALL:
+            channel_context.cancel_all_requests()
+        elif job.kind == JOB_CLEAR:
+            channel_context.clear_memory()
+            # The gateway already deleted the index files; drop the open index so it isn't appended to.
+            long_term_memory.channels.pop(job.channel_id, None)
+
+    async def _reply(self, job: Job):
+        log_fields = fields(guild=job.payload['guild_id'], channel=job.channel_id, request_id=job.message_id, shard=self.shard)
+        message = QueuedMessage(self.client, job)
+        try:
+            channel_context = await context_manager.get_channel_ctx(job.channel_id)
+            # Channel settings are owned by the gateway, which runs the commands that change them.
+            channel_context.settings = job.payload['settings']
+            handler = ai_handler.AIResponseHandler(self.client, message, job.payload['content'])
+            request_task = asyncio.create_task(handler.process_request())
+            channel_context.track_request(job.message_id, request_task)
+            await request_task
+        except asyncio.CancelledError:
+            logger.info("Generation was cancelled", extra=log_fields)
+        except Exception as e:
+            logger.exception("Fatal error handling queued reply: %s - %s", type(e).__name__, e, extra=log_fields)
+            await message.channel.send("⚠️ Ocurrió un error inesperado al procesar tu mensaje.")
+        finally:
+            await asyncio.to_thread(job_queue.finish, job.id)
+
+async def _run_warm_up(startup_timer: StartupTimer, shard: int):
+    try:
+        await warm_up(startup_timer)
+        logger.info(startup_timer.report(), extra=fields(shard=shard))
+    except Exception as e:
+        logger.error("Warm-up failed: %s - %s", type(e).__name__, e, extra=fields(shard=shard))
+
+async def run_worker(shard: int) -> int:
+    if not DISCORD_TOKEN:
+        logger.critical("DISCORD_TOKEN isn't set in the .env file")
+        return 1
+    if not job_queue.enabled or not 0 <= shard < AI_WORKERS:
+        logger.critical("Set AI_WORKERS to the number of workers and start each one with --shard 0..AI_WORKERS-1")
+        return 1
+
+    startup_timer = StartupTimer(time.perf_counter())
+    with startup_timer.phase('config_and_database'):
+        config_manager.read_only = True
+        config_manager.load_config()
+        database_manager.initialize_database()
+        quota_manager.forward_charges = True
+
+    client = discord.Client(intents=discord.Intents.none())
+    async with client:
+        await client.login(DISCORD_TOKEN)
+        startup_timer.mark('rest_login')
+        warm_up_task = asyncio.create_task(_run_warm_up(startup_timer, shard))
+        logger.info("Worker ready", extra=fields(shard=shard, workers=AI_WORKERS, concurrency=WORKER_CONCURRENCY))
+        await Worker(client, shard).run()
+    return 0
+
+def parse_args(argv: typing.Optional[list[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Runs AI replies queued by a gateway started with AI_WORKERS > 0.")
+    parser.add_argument('--shard', type=int, default=0, help="worker index from 0 to AI_WORKERS-1; each channel is always handled by the same shard (default: 0)")
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    try:
+        raise SystemExit(asyncio.run(run_worker(parse_args().shard)))
+    except KeyboardInterrupt:
+        logger.info("Worker stopped manually.")